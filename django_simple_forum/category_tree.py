@@ -0,0 +1,101 @@
+"""
+Process-local cache of the category tree.
+
+The tree is built from two queries and kept in memory, each category carrying
+its children and the published topic count and latest topic activity of its
+whole subtree. Category and topic writes bump a version in the shared cache,
+so every process rebuilds its copy on the next read; in between, rendering
+category navigation costs a cache lookup and no queries.
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+VERSION_KEY = 'forum:category_tree:version'
+
+_lock = threading.Lock()
+_local = {'version': None, 'tree': None}
+
+
+class CategoryTree(object):
+
+    def __init__(self, categories, latest_activity):
+        self.by_id = dict((category.id, category) for category in categories)
+        self.roots = []
+        for category in categories:
+            category.children = []
+            category.latest_activity = latest_activity.get(category.id)
+        for category in categories:
+            parent = self.by_id.get(category.parent_id)
+            if parent is None:
+                self.roots.append(category)
+            else:
+                # set in memory so that templates reading the parent do not query
+                category.parent = parent
+                parent.children.append(category)
+        self.nodes = []
+        for root in self.roots:
+            self.roll_up(root, 0)
+
+    def roll_up(self, category, depth):
+        category.depth = depth
+        self.nodes.append(category)
+        category.subtree_topic_count = category.topic_count
+        for child in category.children:
+            self.roll_up(child, depth + 1)
+            category.subtree_topic_count += child.subtree_topic_count
+            if child.latest_activity and (
+                    category.latest_activity is None or child.latest_activity > category.latest_activity):
+                category.latest_activity = child.latest_activity
+
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+
+    def topic_categories(self):
+        """Active, votable categories a new topic can be posted in."""
+        return [category for category in self.nodes if category.is_active and category.is_votable]
+
+    def category_choices(self):
+        return [('', '---------')] + [(category.id, str(category)) for category in self.nodes]
+
+
+def build_category_tree():
+    ForumCategory = apps.get_model('django_simple_forum', 'ForumCategory')
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    categories = list(ForumCategory.objects.select_related('created_by').order_by('id'))
+    latest_activity = dict(Topic.objects.filter(status='Published').values_list('category_id').annotate(
+        latest=Max('updated_on')).order_by())
+    return CategoryTree(categories, latest_activity)
+
+
+def current_version():
+    cache.add(VERSION_KEY, int(time.time() * 1000000), None)
+    return cache.get(VERSION_KEY)
+
+
+def get_category_tree():
+    version = current_version()
+    if _local['version'] != version or _local['tree'] is None:
+        with _lock:
+            if _local['version'] != version or _local['tree'] is None:
+                _local['tree'] = build_category_tree()
+                _local['version'] = version
+    return _local['tree']
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, int(time.time() * 1000000), None)
+
+
+def invalidate_category_tree():
+    # bumped now for this request and again once the write is visible to others,
+    # so no process keeps a tree it built from before the commit
+    bump_version()
+    transaction.on_commit(bump_version)
@@ -0,0 +1,72 @@
+"""
+A small HyperLogLog sketch for approximate distinct counts.
+
+Registers are kept in a ``bytearray`` so a sketch serializes to ``PRECISION``
+bits worth of bytes (2 KB at the default precision) and two sketches merge by
+taking the register-wise maximum, which is what lets sketches recorded on
+different days or by different processes be combined.
+"""
+import hashlib
+import math
+
+from django.utils.encoding import force_bytes
+
+PRECISION = 11
+HASH_BITS = 64
+
+
+class HyperLogLog(object):
+
+    def __init__(self, registers=None, precision=PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.m)
+        else:
+            self.registers = bytearray(registers)
+            if len(self.registers) != self.m:
+                raise ValueError('Expected %s registers, got %s' % (self.m, len(self.registers)))
+
+    @classmethod
+    def position(cls, value, precision=PRECISION):
+        """Return the (register index, rank) an item lands on."""
+        hashed = int(hashlib.sha1(force_bytes(value)).hexdigest()[:16], 16)
+        index = hashed >> (HASH_BITS - precision)
+        remaining_bits = HASH_BITS - precision
+        rest = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - rest.bit_length() + 1
+        return index, rank
+
+    def add(self, value):
+        """Add an item, returning True if any register changed."""
+        index, rank = self.position(value, self.precision)
+        return self.update(index, rank)
+
+    def update(self, index, rank):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    @property
+    def error(self):
+        """Standard error of the estimate, e.g. 0.023 for 2.3%."""
+        return 1.04 / math.sqrt(self.m)
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = list(self.registers).count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction: linear counting
+            estimate = self.m * math.log(float(self.m) / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
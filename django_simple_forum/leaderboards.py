@@ -0,0 +1,175 @@
+"""
+Cached "most topics" leaderboards for the forum sidebar.
+
+A board caches its top entries under a versioned key, and the topic count of
+each ranked object under a counter key of its own that only writes touch.
+Topic writes ``incr`` the counters of the objects they change and re-rank
+the top entries with them, so neither a read nor a write of the sidebar
+loads the counts of the whole table.
+A rebuild is done by a single process holding a lock while the others serve
+the last good copy, and the entry's timeout bounds any drift.
+"""
+import heapq
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+BOARD_SIZE = 10
+LOCK_TIMEOUT = 30
+
+
+class Leaderboard(object):
+
+    def __init__(self, name, get_queryset, related='topic', count_field=None):
+        self.name = name
+        self.get_queryset = get_queryset
+        self.related = related
+        # a stored count column to rebuild from instead of aggregating
+        self.count_field = count_field
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'FORUM_LEADERBOARD_TIMEOUT', 60 * 60)
+
+    def version_key(self):
+        return 'forum:board:%s:version' % self.name
+
+    def key(self):
+        # a fresh version after an eviction never collides with an old one
+        cache.add(self.version_key(), int(time.time()), None)
+        return 'forum:board:%s:%s' % (self.name, cache.get(self.version_key()))
+
+    def count_key(self, key, pk):
+        return '%s:count:%s' % (key, pk)
+
+    def stale_key(self):
+        return 'forum:board:%s:stale' % self.name
+
+    def lock_key(self):
+        return 'forum:board:%s:lock' % self.name
+
+    def top(self, counts):
+        top_ids = heapq.nlargest(BOARD_SIZE, counts, key=lambda pk: (counts[pk], -pk))
+        entries = list(self.get_queryset().filter(id__in=top_ids))
+        if len(entries) < BOARD_SIZE:
+            entries.extend(self.get_queryset().exclude(id__in=list(counts))[:BOARD_SIZE - len(entries)])
+        for entry in entries:
+            entry.num_topics = counts.get(entry.id, 0)
+        entries.sort(key=lambda entry: (-entry.num_topics, entry.id))
+        return entries
+
+    def counts(self, ids=None):
+        """
+        The topic counts of the objects with ``ids``, zeros included, or of
+        every object with topics when ``ids`` is None.
+        """
+        queryset = self.get_queryset()
+        if self.count_field:
+            queryset = queryset.values_list('id', self.count_field)
+            count_field = self.count_field
+        else:
+            queryset = queryset.annotate(num_topics=Count(self.related)).values_list('id', 'num_topics')
+            count_field = 'num_topics'
+        if ids is None:
+            queryset = queryset.filter(**{count_field + '__gt': 0})
+        else:
+            queryset = queryset.filter(id__in=ids)
+        return dict(queryset.order_by())
+
+    def build(self):
+        counts = self.counts()
+        return counts, self.top(counts)
+
+    def store(self, key, counts, top):
+        counters = dict((self.count_key(key, pk), count) for pk, count in counts.items())
+        counters.update((self.count_key(key, entry.id), entry.num_topics) for entry in top)
+        cache.set_many(counters, self.timeout)
+        cache.set(key, top, self.timeout)
+        cache.set(self.stale_key(), top, None)
+
+    def get(self):
+        key = self.key()
+        top = cache.get(key)
+        if top is not None:
+            return top
+        if cache.add(self.lock_key(), 1, LOCK_TIMEOUT):
+            try:
+                counts, top = self.build()
+                self.store(key, counts, top)
+            finally:
+                cache.delete(self.lock_key())
+            return top
+        # someone else is rebuilding: serve the last good copy meanwhile
+        top = cache.get(self.stale_key())
+        if top is None:
+            counts, top = self.build()
+        return top
+
+    def adjust(self, deltas):
+        """Apply ``{id: delta}`` topic count changes to the cached board."""
+        deltas = dict((pk, delta) for pk, delta in deltas.items() if pk and delta)
+        if not deltas:
+            return
+        key = self.key()
+        if cache.get(key) is None:
+            # a rebuild may have read the counts before this write committed
+            self.invalidate()
+            return
+        counts = {}
+        for pk, delta in deltas.items():
+            try:
+                counts[pk] = cache.incr(self.count_key(key, pk), delta)
+            except ValueError:
+                pass
+        missing = [pk for pk in deltas if pk not in counts]
+        if missing:
+            # not counted when the board was built, or evicted: the committed
+            # count of just these rows already includes the delta
+            for pk, count in self.counts(missing).items():
+                cache.add(self.count_key(key, pk), count, self.timeout)
+                counts[pk] = count
+        if not cache.add(self.lock_key(), 1, LOCK_TIMEOUT):
+            # a rebuild or another update is in flight, let the next read rebuild
+            self.invalidate()
+            return
+        try:
+            self.rerank(key, counts)
+        finally:
+            cache.delete(self.lock_key())
+
+    def rerank(self, key, counts):
+        top = cache.get(key)
+        if top is None:
+            self.invalidate()
+            return
+        current = cache.get_many([self.count_key(key, entry.id) for entry in top])
+        if len(current) < len(top):
+            self.invalidate()
+            return
+        full = len(top) >= BOARD_SIZE
+        last = (top[-1].num_topics, -top[-1].id) if top else None
+        entries = {}
+        for entry in top:
+            entry.num_topics = current[self.count_key(key, entry.id)]
+            if full and (entry.num_topics, -entry.id) < last:
+                # it may have dropped below objects that are not on the board
+                self.invalidate()
+                return
+            entries[entry.id] = entry
+        entrants = [pk for pk, count in counts.items()
+                    if pk not in entries and (not full or (count, -pk) > last)]
+        if entrants:
+            for entry in self.get_queryset().filter(id__in=entrants):
+                entry.num_topics = counts[entry.id]
+                entries[entry.id] = entry
+        top = sorted(entries.values(), key=lambda entry: (-entry.num_topics, entry.id))[:BOARD_SIZE]
+        cache.set(key, top, self.timeout)
+        cache.set(self.stale_key(), top, None)
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key())
+        except ValueError:
+            cache.add(self.version_key(), int(time.time()), None)
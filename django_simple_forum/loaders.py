@@ -0,0 +1,78 @@
+"""
+Request-scoped batch loading for the forum template filters.
+
+Views prime the keys a page is going to ask for and the filters load them, so
+every kind of lookup costs one query per request however many times a
+template asks for it. ``ForumLoaderMiddleware`` scopes the loaders to a
+request; without it each lookup gets a fresh loader and behaves as before.
+"""
+import threading
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:
+    MiddlewareMixin = object
+
+from .models import UserProfile, UserTopics
+
+_active = threading.local()
+
+
+class BatchLoader(object):
+
+    def __init__(self, batch_fn, default=None):
+        self.batch_fn = batch_fn
+        self.default = default
+        self.cache = {}
+        self.pending = set()
+
+    def prime(self, keys):
+        self.pending.update(key for key in keys if key not in self.cache)
+
+    def load(self, key):
+        if key not in self.cache:
+            self.pending.add(key)
+            self.dispatch()
+        return self.cache[key]
+
+    def dispatch(self):
+        keys, self.pending = self.pending, set()
+        results = self.batch_fn(keys)
+        for key in keys:
+            self.cache[key] = results.get(key, self.default)
+
+
+def load_profile_pics(user_ids):
+    profiles = UserProfile.objects.filter(user_id__in=user_ids).only('user_id', 'profile_pic')
+    return dict((profile.user_id, profile.profile_pic) for profile in profiles)
+
+
+def load_user_topics(keys):
+    topic_ids = set(topic_id for topic_id, user_id in keys)
+    user_ids = set(user_id for topic_id, user_id in keys)
+    rows = UserTopics.objects.filter(topic_id__in=topic_ids, user_id__in=user_ids).values_list(
+        'topic_id', 'user_id', 'is_like', 'is_followed')
+    return dict(((topic_id, user_id), (is_like, is_followed))
+                for topic_id, user_id, is_like, is_followed in rows)
+
+
+class ForumLoaders(object):
+
+    def __init__(self):
+        self.profile_pic = BatchLoader(load_profile_pics, default='')
+        self.user_topic = BatchLoader(load_user_topics, default=(False, False))
+
+
+def get_loaders():
+    loaders = getattr(_active, 'loaders', None)
+    return loaders if loaders is not None else ForumLoaders()
+
+
+class ForumLoaderMiddleware(MiddlewareMixin):
+
+    def process_request(self, request):
+        _active.loaders = request.forum_loaders = ForumLoaders()
+
+    def process_response(self, request, response):
+        _active.loaders = None
+        return response
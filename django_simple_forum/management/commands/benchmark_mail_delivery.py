@@ -0,0 +1,68 @@
+import asyncore
+import smtpd
+import threading
+import time
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.management.base import BaseCommand
+
+from django_simple_forum.sending_mail import MailMessage, SMTPTransport
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+class SinkServer(smtpd.SMTPServer):
+    """A local SMTP stand-in accepting and discarding every message."""
+
+    received = 0
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.received += 1
+
+
+class Command(BaseCommand):
+    help = 'Compare a connection per message with the pooled mail transport against a local SMTP server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--chunk-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        server = SinkServer(('127.0.0.1', 0), None)
+        host, port = server.socket.getsockname()
+        loop = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.005})
+        loop.daemon = True
+        loop.start()
+        try:
+            messages = [
+                MailMessage(['user%s@example.com' % i], 'forum@example.com', 'New Comment For The Topic',
+                            '<p>New comment %s</p>' % i)
+                for i in range(options['messages'])
+            ]
+            self.report('connection per message', self.per_message, messages, host, port)
+            self.report('pooled transport', self.pooled, messages, host, port, options['chunk_size'])
+        finally:
+            server.close()
+
+    def report(self, label, send, messages, *args):
+        started = time.time()
+        send(messages, *args)
+        elapsed = max(time.time() - started, 1e-6)
+        self.stdout.write('%s: %s messages in %.2fs, %.0f messages/s' % (
+            label, len(messages), elapsed, len(messages) / elapsed))
+
+    def per_message(self, messages, host, port):
+        for message in messages:
+            email = EmailMultiAlternatives(
+                message.msubject, message.mbody, message.mfrom, message.mto,
+                connection=get_connection(SMTP_BACKEND, host=host, port=port))
+            email.attach_alternative(message.mbody, "text/html")
+            email.send()
+
+    def pooled(self, messages, host, port, chunk_size):
+        transport = SMTPTransport(SMTP_BACKEND, host=host, port=port)
+        try:
+            for start in range(0, len(messages), chunk_size):
+                transport.send_messages(messages[start:start + chunk_size])
+        finally:
+            transport.close()
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_simple_forum.outbox import drain
+
+
+class Command(BaseCommand):
+    help = 'Handle the pending forum outbox events, retrying failed ones with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--max-attempts', type=int, default=5)
+
+    def handle(self, *args, **options):
+        handled, failed = drain(
+            batch_size=options['batch_size'], workers=options['workers'], max_attempts=options['max_attempts'])
+        self.stdout.write('Handled %s outbox events, %s failed' % (handled, failed))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from django_simple_forum.view_counts import flush_topic_views
+
+
+class Command(BaseCommand):
+    help = 'Write the topic views buffered in the cache to Topic.no_of_views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        updated = flush_topic_views(batch_size=options['batch_size'])
+        self.stdout.write('Flushed views of %s topics' % updated)
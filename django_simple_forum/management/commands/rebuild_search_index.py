@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_simple_forum.models import Topic, Comment
+from django_simple_forum.search import SearchDocumentData, get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index of topics and comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.clear()
+        topics = self.index(backend, Topic.objects.only(
+            'id', 'title', 'description'), SearchDocumentData.for_topic, options['chunk_size'])
+        comments = self.index(backend, Comment.objects.only(
+            'id', 'topic_id', 'comment'), SearchDocumentData.for_comment, options['chunk_size'])
+        self.stdout.write('Indexed %s topics and %s comments' % (topics, comments))
+
+    def index(self, backend, queryset, document_for, chunk_size):
+        last_id = 0
+        indexed = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                backend.index_many([document_for(obj) for obj in chunk])
+            indexed += len(chunk)
+            last_id = chunk[-1].id
+        return indexed
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from django_simple_forum.models import Topic, Comment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored comment count and last comment of every topic.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        rebuilt = 0
+        while True:
+            topic_ids = list(Topic.objects.filter(id__gt=last_id).order_by(
+                'id').values_list('id', flat=True)[:chunk_size])
+            if not topic_ids:
+                break
+            stats = dict(
+                (row['topic_id'], row) for row in Comment.objects.filter(
+                    topic_id__in=topic_ids).values('topic_id').annotate(
+                    count=Count('id'), last_comment_id=Max('id')).order_by())
+            # comments are never re-dated, so the highest id is also the latest
+            last_commented = dict(Comment.objects.filter(
+                id__in=[row['last_comment_id'] for row in stats.values()]
+            ).values_list('id', 'updated_on'))
+            with transaction.atomic():
+                for topic_id in topic_ids:
+                    row = stats.get(topic_id, {'count': 0, 'last_comment_id': None})
+                    Topic.objects.filter(id=topic_id).update(
+                        comment_count=row['count'],
+                        last_comment_id=row['last_comment_id'],
+                        last_commented_at=last_commented.get(row['last_comment_id']),
+                    )
+            rebuilt += len(topic_ids)
+            last_id = topic_ids[-1]
+        self.stdout.write('Rebuilt comment stats for %s topics' % rebuilt)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from django_simple_forum.models import Topic, Comment, Vote
+
+
+class Command(BaseCommand):
+    help = 'Recount the stored up/down vote counters of topics and comments and fix any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (Topic, Comment):
+            fixed = self.reconcile(model, options['chunk_size'])
+            self.stdout.write('Fixed vote counters of %s %s rows' % (fixed, model.__name__.lower()))
+
+    def reconcile(self, model, chunk_size):
+        last_id = 0
+        fixed = 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id).order_by(
+                'id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            actual = dict((pk, {'U': 0, 'D': 0}) for pk in ids)
+            votes = Vote.objects.filter(
+                target_type=Vote.target_type_of(model), target_id__in=ids).values_list(
+                'target_id', 'type').annotate(count=Count('id')).order_by()
+            for pk, vote_type, count in votes:
+                actual[pk][vote_type] = count
+            rows = model.objects.filter(id__in=ids).values_list('id', 'up_votes', 'down_votes')
+            with transaction.atomic():
+                for pk, up_votes, down_votes in rows:
+                    if (up_votes, down_votes) != (actual[pk]['U'], actual[pk]['D']):
+                        model.objects.filter(id=pk).update(
+                            up_votes=actual[pk]['U'], down_votes=actual[pk]['D'])
+                        fixed += 1
+            last_id = ids[-1]
+        return fixed
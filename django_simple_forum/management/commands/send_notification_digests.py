@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from django_simple_forum.notifications import send_notification_digests
+
+
+class Command(BaseCommand):
+    help = 'Send the hourly or daily digest of comment notifications.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frequency', choices=['hourly', 'daily'], default='hourly')
+
+    def handle(self, *args, **options):
+        sent = send_notification_digests(options['frequency'])
+        self.stdout.write('Sent %s %s digests' % (sent, options['frequency']))
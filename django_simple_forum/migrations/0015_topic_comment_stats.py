@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_comment_stats(apps, schema_editor):
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    for topic_id in Topic.objects.values_list('id', flat=True).iterator():
+        comments = Comment.objects.filter(topic_id=topic_id)
+        last_comment = comments.order_by('-updated_on', '-id').first()
+        Topic.objects.filter(id=topic_id).update(
+            comment_count=comments.count(),
+            last_comment=last_comment,
+            last_commented_at=last_comment.updated_on if last_comment else None,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0014_auto_20170208_0550'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='last_comment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='django_simple_forum.Comment'),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_comment_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:15
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_participants(apps, schema_editor):
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    UserTopics = apps.get_model('django_simple_forum', 'UserTopics')
+    TopicParticipant = apps.get_model('django_simple_forum', 'TopicParticipant')
+    for topic in Topic.objects.all().iterator():
+        roles = {topic.created_by_id: {'is_creator': True}}
+        for user_id in Comment.objects.filter(topic=topic).values_list('commented_by_id', flat=True):
+            roles.setdefault(user_id, {})['is_commenter'] = True
+        for user_id, is_like, is_followed in UserTopics.objects.filter(topic=topic).values_list(
+                'user_id', 'is_like', 'is_followed'):
+            if is_like:
+                roles.setdefault(user_id, {})['is_liker'] = True
+            if is_followed:
+                roles.setdefault(user_id, {})['is_follower'] = True
+        TopicParticipant.objects.bulk_create([
+            TopicParticipant(topic=topic, user_id=user_id, **user_roles)
+            for user_id, user_roles in roles.items()
+        ])
+        Topic.objects.filter(id=topic.id).update(participant_count=len(roles))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('django_simple_forum', '0015_topic_comment_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicParticipant',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_creator', models.BooleanField(default=False)),
+                ('is_commenter', models.BooleanField(default=False)),
+                ('is_liker', models.BooleanField(default=False)),
+                ('is_follower', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topicparticipant',
+            name='topic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='django_simple_forum.Topic'),
+        ),
+        migrations.AddField(
+            model_name='topicparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_participations', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicparticipant',
+            unique_together=set([('topic', 'user')]),
+        ),
+        migrations.RunPython(backfill_participants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:16
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0016_topicparticipant'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='topic',
+            index_together=set([('created_on', 'id'), ('category', 'created_on', 'id')]),
+        ),
+    ]
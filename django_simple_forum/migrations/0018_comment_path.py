@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+PATH_STEP = 7
+PATH_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(comment_id):
+    segment = ''
+    while comment_id:
+        comment_id, digit = divmod(comment_id, len(PATH_ALPHABET))
+        segment = PATH_ALPHABET[digit] + segment
+    return segment.rjust(PATH_STEP, '0')
+
+
+def backfill_comment_paths(apps, schema_editor):
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    for topic_id in Topic.objects.values_list('id', flat=True).iterator():
+        parents = dict(Comment.objects.filter(topic_id=topic_id).values_list('id', 'parent_id'))
+        paths = {}
+
+        def resolve(comment_id, seen=()):
+            if comment_id not in paths:
+                parent_id = parents.get(comment_id)
+                if parent_id in parents and parent_id not in seen:
+                    parent_path, parent_depth = resolve(parent_id, seen + (comment_id,))
+                    paths[comment_id] = (parent_path + path_segment(comment_id), parent_depth + 1)
+                else:
+                    paths[comment_id] = (path_segment(comment_id), 0)
+            return paths[comment_id]
+
+        for comment_id in sorted(parents):
+            path, depth = resolve(comment_id)
+            Comment.objects.filter(id=comment_id).update(path=path, depth=depth)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0017_topic_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=700),
+        ),
+        migrations.RunPython(backfill_comment_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_vote_counters(apps, schema_editor):
+    for model_name in ('Topic', 'Comment'):
+        model = apps.get_model('django_simple_forum', model_name)
+        for obj in model.objects.all().iterator():
+            model.objects.filter(id=obj.id).update(
+                up_votes=obj.votes.filter(type='U').count(),
+                down_votes=obj.votes.filter(type='D').count(),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0018_comment_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='down_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='up_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='down_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='up_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
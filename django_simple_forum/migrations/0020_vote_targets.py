@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def convert_votes(apps, schema_editor):
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    Vote = apps.get_model('django_simple_forum', 'Vote')
+    seen = set()
+    recount = set()
+    for target_type, model, field in (('T', Topic, 'topic_id'), ('C', Comment, 'comment_id')):
+        links = model.votes.through.objects.order_by('vote_id').values_list(
+            field, 'vote_id', 'vote__user_id')
+        for target_id, vote_id, user_id in links.iterator():
+            key = (user_id, target_type, target_id)
+            if key in seen:
+                # duplicate vote from a double submit: keep the first one only
+                Vote.objects.filter(id=vote_id).delete()
+                recount.add((model, target_id))
+                continue
+            seen.add(key)
+            Vote.objects.filter(id=vote_id).update(target_type=target_type, target_id=target_id)
+    Vote.objects.filter(target_id=None).delete()
+
+    for model, target_id in recount:
+        votes = Vote.objects.filter(target_type='T' if model is Topic else 'C', target_id=target_id)
+        model.objects.filter(id=target_id).update(
+            up_votes=votes.filter(type='U').count(),
+            down_votes=votes.filter(type='D').count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0019_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='target_type',
+            field=models.CharField(choices=[('T', 'Topic'), ('C', 'Comment')], default='T', max_length=1),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='target_id',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.RunPython(convert_votes, migrations.RunPython.noop),
+    ]
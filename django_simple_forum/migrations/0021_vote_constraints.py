@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('django_simple_forum', '0020_vote_targets'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='comment',
+            name='votes',
+        ),
+        migrations.RemoveField(
+            model_name='topic',
+            name='votes',
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='target_id',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vote',
+            unique_together=set([('user', 'target_type', 'target_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('target_type', 'target_id')]),
+        ),
+    ]
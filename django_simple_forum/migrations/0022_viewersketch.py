@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0021_vote_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewerSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.CharField(choices=[('T', 'Topic'), ('C', 'Category')], max_length=1)),
+                ('target_id', models.PositiveIntegerField()),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='viewersketch',
+            unique_together=set([('target_type', 'target_id', 'day')]),
+        ),
+    ]
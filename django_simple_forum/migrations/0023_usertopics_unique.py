@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:26
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_user_topics(apps, schema_editor):
+    UserTopics = apps.get_model('django_simple_forum', 'UserTopics')
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    duplicates = UserTopics.objects.values('user_id', 'topic_id').annotate(
+        count=Count('id')).filter(count__gt=1).order_by()
+    topic_ids = set()
+    for row in duplicates:
+        rows = list(UserTopics.objects.filter(
+            user_id=row['user_id'], topic_id=row['topic_id']).order_by('id'))
+        kept = rows[0]
+        kept.is_like = any(each.is_like for each in rows)
+        kept.is_followed = any(each.is_followed for each in rows)
+        kept.followed_on = max([each.followed_on for each in rows if each.followed_on] or [None])
+        kept.save()
+        UserTopics.objects.filter(id__in=[each.id for each in rows[1:]]).delete()
+        topic_ids.add(row['topic_id'])
+    # duplicated rows are what made the like counters drift
+    for topic_id in topic_ids:
+        Topic.objects.filter(id=topic_id).update(
+            no_of_likes=UserTopics.objects.filter(topic_id=topic_id, is_like=True).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('django_simple_forum', '0022_viewersketch'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_user_topics, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='usertopics',
+            unique_together=set([('user', 'topic')]),
+        ),
+    ]
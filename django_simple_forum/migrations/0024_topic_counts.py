@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_topic_counts(apps, schema_editor):
+    ForumCategory = apps.get_model('django_simple_forum', 'ForumCategory')
+    Tags = apps.get_model('django_simple_forum', 'Tags')
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    published = Topic.objects.filter(status='Published')
+    for category_id, count in published.values_list('category_id').annotate(count=Count('id')).order_by():
+        ForumCategory.objects.filter(id=category_id).update(topic_count=count)
+    for tag_id, count in published.filter(tags__isnull=False).values_list('tags').annotate(
+            count=Count('id')).order_by():
+        Tags.objects.filter(id=tag_id).update(topic_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0023_usertopics_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forumcategory',
+            name='topic_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tags',
+            name='topic_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_topic_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='forumcategory',
+            index=models.Index(fields=['is_active', '-topic_count', 'id'], name='forum_category_topic_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tags',
+            index=models.Index(fields=['-topic_count', 'id'], name='forum_tags_topic_count_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 21:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_search_fields(apps, schema_editor):
+    UserProfile = apps.get_model('django_simple_forum', 'UserProfile')
+    for profile in UserProfile.objects.select_related('user').iterator():
+        UserProfile.objects.filter(id=profile.id).update(
+            search_username=(profile.user.username or '').lower(),
+            search_email=(profile.user.email or '').lower(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0025_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='search_email',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='search_username',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(backfill_search_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0027_notification_digests'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(max_length=100)),
+                ('payload', models.TextField()),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('F', 'Failed')], default='P', max_length=1)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxevent',
+            index_together=set([('status', 'available_at')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 19:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0028_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='timeline',
+            name='created_on',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 20:17
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0030_outboxevent_claim_token'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='searchposting',
+            index_together=set([('term', 'weight')]),
+        ),
+    ]
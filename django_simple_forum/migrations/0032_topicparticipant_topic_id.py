@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 20:38
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_simple_forum', '0031_searchposting_term_weight'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='topicparticipant',
+            index_together=set([('topic', 'id')]),
+        ),
+    ]
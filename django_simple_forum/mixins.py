@@ -1,7 +1,10 @@
 from django.shortcuts import redirect, get_object_or_404
+from django.core.paginator import InvalidPage
 from django.core.urlresolvers import reverse
 from django.contrib.auth import logout
+from django.http import Http404, JsonResponse
 from django_simple_forum.models import Topic
+from django_simple_forum.pagination import CursorPaginator
 
 
 class AdminMixin(object):
@@ -36,3 +39,37 @@ class LoginRequiredMixin(object):
             else:
                 logout(self.request)
         return redirect(reverse('django_simple_forum:topic_list'))
+
+
+class TopicCursorPaginationMixin(object):
+    paginate_by = 20
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') != 'json':
+            return super(TopicCursorPaginationMixin, self).render_to_response(context, **response_kwargs)
+        page = context['page_obj']
+        topics = []
+        for topic in page.object_list:
+            topics.append({
+                'id': topic.id,
+                'title': topic.title,
+                'url': reverse('django_simple_forum:view_topic', kwargs={'slug': topic.slug}),
+                'category': topic.category.title,
+                'created_by': topic.created_by.username,
+                'created_on': topic.created_on,
+                'updated_on': topic.updated_on,
+                'no_of_likes': topic.no_of_likes,
+                'comment_count': topic.comment_count,
+                'participant_count': topic.participant_count,
+            })
+        return JsonResponse({'topics': topics, 'next_cursor': page.next_cursor,
+                             'previous_cursor': page.previous_cursor})
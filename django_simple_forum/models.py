@@ -1,9 +1,24 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Concat, Substr
+from django.db.models.query import ModelIterable
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 import hashlib
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
+
+from .category_tree import invalidate_category_tree
+from .hyperloglog import HyperLogLog
+from .leaderboards import Leaderboard
+from .search import SearchDocumentData, get_search_backend
+from .typeahead import index_tag_title, unindex_tag_title, index_topic_title, unindex_topic_title
 
 STATUS = (
     ('Draft', 'Draft'),
@@ -16,6 +31,12 @@ USER_ROLES = (
     ('Publisher', 'Publisher'),
 )
 
+NOTIFICATION_FREQUENCIES = (
+    ('immediate', 'Immediately'),
+    ('hourly', 'Hourly digest'),
+    ('daily', 'Daily digest'),
+)
+
 User = settings.AUTH_USER_MODEL
 
 
@@ -23,6 +44,19 @@ User = settings.AUTH_USER_MODEL
 class Tags(models.Model):
     title = models.CharField(max_length=50, unique=True)
     slug = models.CharField(max_length=50, unique=True)
+    # published topics with this tag
+    topic_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['-topic_count', 'id'], name='forum_tags_topic_count_idx')]
+
+    def __init__(self, *args, **kwargs):
+        super(Tags, self).__init__(*args, **kwargs)
+        # remembered so that a save can tell the typeahead index needs the change
+        self._loaded_typeahead = self.typeahead_fields()
+
+    def typeahead_fields(self):
+        return (self.__dict__.get('title'), self.__dict__.get('slug'))
 
     def get_topics(self):
         topics = Topic.objects.filter(tags__in=[self], status='Published')
@@ -50,6 +84,7 @@ def img_url(self, filename):
 # user profile to store no of votes available to user, badges for a topic, user roles,
 class UserProfile(models.Model):
     file_prepend = "forum_user/profilepics/"
+    NOTIFICATION_FREQUENCIES = NOTIFICATION_FREQUENCIES
     
     user = models.ForeignKey(User)
     used_votes = models.IntegerField(default='0')
@@ -58,9 +93,22 @@ class UserProfile(models.Model):
     profile_pic = models.FileField(
         max_length=500, null=True, blank=True, upload_to=img_url)
     send_mailnotifications = models.BooleanField(default=False)
+    notification_frequency = models.CharField(choices=NOTIFICATION_FREQUENCIES, max_length=10, default='immediate')
+    # lowercased copies of the user's username and email for indexed prefix search
+    search_username = models.CharField(max_length=150, default='', editable=False, db_index=True)
+    search_email = models.CharField(max_length=254, default='', editable=False, db_index=True)
 
     # need to add social details for a user if we implement socail login
 
+    @classmethod
+    def search(cls, text):
+        text = text.strip().lower()
+        return cls.objects.filter(Q(search_username__startswith=text) | Q(search_email__startswith=text))
+
+    def set_search_fields(self, user):
+        self.search_username = (user.username or '').lower()
+        self.search_email = (user.email or '').lower()
+
     def get_no_of_up_votes(self):
         user_topics = UserTopics.objects.filter(user=self.user)
         votes = 0
@@ -119,6 +167,13 @@ class ForumCategory(models.Model):
     slug = models.SlugField(max_length=1000)
     description = models.TextField()
     parent = models.ForeignKey('self', blank=True, null=True)
+    # published topics in this category
+    topic_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', '-topic_count', 'id'], name='forum_category_topic_count_idx'),
+        ]
 
     def get_topics(self):
         topics = Topic.objects.filter(category=self, status='Published')
@@ -133,14 +188,119 @@ class Vote(models.Model):
         ("U", "Up"),
         ("D", "Down"),
     )
+    TARGET_TYPES = (
+        ("T", "Topic"),
+        ("C", "Comment"),
+    )
     user = models.ForeignKey(User)
     type = models.CharField(choices=TYPES, max_length=1)
+    target_type = models.CharField(choices=TARGET_TYPES, max_length=1)
+    target_id = models.PositiveIntegerField()
     created_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        unique_together = [("user", "target_type", "target_id"), ]
+        index_together = [("target_type", "target_id"), ]
+
     def __str__(self):
         return self.user
 
+    @classmethod
+    def target_type_of(cls, target):
+        return "T" if target._meta.model is Topic else "C"
+
+    @classmethod
+    def cast(cls, user, target, vote_type):
+        """
+        Apply a vote of ``vote_type`` by ``user`` on a topic or comment and
+        keep the target's counters in step. A first vote is recorded, a vote
+        against an existing opposite vote withdraws it and a repeated vote is
+        a no-op. Returns "up", "down", "removed" or "neutral".
+        """
+        target_type = cls.target_type_of(target)
+        model = target.__class__
+        counter = "up_votes" if vote_type == "U" else "down_votes"
+        try:
+            # the unique constraint decides whether this is the user's first vote
+            with transaction.atomic():
+                cls.objects.create(user=user, type=vote_type, target_type=target_type, target_id=target.id)
+                model.objects.filter(id=target.id).update(**{counter: F(counter) + 1})
+            return "up" if vote_type == "U" else "down"
+        except IntegrityError:
+            pass
+
+        vote = cls.objects.filter(user=user, target_type=target_type, target_id=target.id).first()
+        if vote is None or vote.type == vote_type:
+            return "neutral"
+        counter = "down_votes" if vote_type == "U" else "up_votes"
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(id=vote.id).delete()
+            if deleted:
+                model.objects.filter(id=target.id, **{counter + "__gt": 0}).update(
+                    **{counter: F(counter) - 1})
+        return "removed"
+
+
+def prefetch_topic_listing(topics):
+    """Resolve the avatar strip for a page of topics in bulk."""
+    topic_ids = [topic.id for topic in topics]
+    if not topic_ids:
+        return topics
+    topic_user_ids = dict((topic_id, []) for topic_id in topic_ids)
+    # each topic's first participants only, up to the id of its last avatar
+    condition = Q()
+    for topic in topics:
+        if topic.avatar_cutoff is None:
+            condition |= Q(topic_id=topic.id)
+        else:
+            condition |= Q(topic_id=topic.id, id__lte=topic.avatar_cutoff)
+    participants = TopicParticipant.objects.filter(condition).order_by('id').values_list('topic_id', 'user_id')
+    for topic_id, user_id in participants:
+        topic_user_ids[topic_id].append(user_id)
+
+    all_user_ids = set()
+    for user_ids in topic_user_ids.values():
+        all_user_ids.update(user_ids)
+    profiles = {}
+    for profile in UserProfile.objects.filter(user_id__in=all_user_ids).select_related('user'):
+        profiles.setdefault(profile.user_id, []).append(profile)
+    for topic in topics:
+        topic._avatar_users = []
+        for user_id in topic_user_ids[topic.id]:
+            topic._avatar_users.extend(profiles.get(user_id, []))
+    return topics
+
+
+class TopicQuerySet(models.QuerySet):
+    _with_listing_data = False
+
+    def with_listing_data(self):
+        """
+        Load category and author with the topics, and attach the avatar strip
+        to every fetched row with a fixed number of queries.
+        """
+        avatar_cutoff = TopicParticipant.objects.filter(topic_id=OuterRef('id')).order_by('id').values('id')
+        clone = self.select_related('category', 'created_by').annotate(
+            avatar_cutoff=Subquery(avatar_cutoff[Topic.AVATAR_LIMIT - 1:Topic.AVATAR_LIMIT]))
+        clone._with_listing_data = True
+        return clone
+
+    def _clone(self, **kwargs):
+        clone = super(TopicQuerySet, self)._clone(**kwargs)
+        clone._with_listing_data = self._with_listing_data
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+        super(TopicQuerySet, self)._fetch_all()
+        # values() and values_list() rows have no avatars to attach
+        if self._with_listing_data and not fetched and self._iterable_class is ModelIterable:
+            prefetch_topic_listing(self._result_cache)
+
+
 class Topic(models.Model):
+    AVATAR_LIMIT = 10
+
     title = models.CharField(max_length=2000)
     description = models.TextField()
     created_by = models.ForeignKey(User)
@@ -152,7 +312,31 @@ class Topic(models.Model):
     slug = models.SlugField(max_length=1000)
     tags = models.ManyToManyField(Tags)
     no_of_likes = models.IntegerField(default='0')
-    votes = models.ManyToManyField(Vote)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_comment = models.ForeignKey(
+        'Comment', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    last_commented_at = models.DateTimeField(null=True, blank=True)
+    participant_count = models.PositiveIntegerField(default=0)
+    up_votes = models.PositiveIntegerField(default=0)
+    down_votes = models.PositiveIntegerField(default=0)
+
+    objects = TopicQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('created_on', 'id'), ('category', 'created_on', 'id')]
+
+    def __init__(self, *args, **kwargs):
+        super(Topic, self).__init__(*args, **kwargs)
+        # remembered so that a save can tell the topic moved category or changed status
+        self._loaded_category_id = self.__dict__.get('category_id')
+        self._loaded_status = self.__dict__.get('status')
+        self._loaded_typeahead = self.typeahead_fields()
+
+    def typeahead_fields(self):
+        return (self.__dict__.get('title'), self.__dict__.get('slug'), self.__dict__.get('status'))
+
+    def is_published(self):
+        return self.status == 'Published'
 
     def get_comments(self):
         comments = Comment.objects.filter(topic=self, parent=None)
@@ -162,27 +346,66 @@ class Topic(models.Model):
         comments = Comment.objects.filter(topic=self)
         return comments
 
+    def get_comment_tree(self):
+        """
+        Load every comment of the topic, with its author and author's profile
+        pic, in one query and return them in display order. Each comment gets
+        ``children`` and ``reply_count`` attributes.
+        """
+        profile_pic = UserProfile.objects.filter(
+            user=OuterRef('commented_by')).order_by('id').values('profile_pic')[:1]
+        # ordering by the materialized path yields a depth-first walk of the tree
+        tree = list(Comment.objects.filter(topic=self).select_related(
+            'commented_by').annotate(author_profile_pic=Subquery(profile_pic)).order_by('path'))
+        by_id = dict((comment.id, comment) for comment in tree)
+        for comment in tree:
+            comment.children = []
+        for comment in tree:
+            parent = by_id.get(comment.parent_id)
+            if parent:
+                parent.children.append(comment)
+        for comment in tree:
+            comment.reply_count = len(comment.children)
+        return tree
+
+    def get_reply_count(self):
+        return self.comment_count
+
     def get_last_comment(self):
-        comments = Comment.objects.filter(topic=self).order_by('-updated_on').first()
-        return comments
+        return self.last_comment
+
+    def refresh_comment_stats(self):
+        """Recompute the stored comment count and last comment from the comments table."""
+        comments = Comment.objects.filter(topic=self)
+        last_comment = comments.order_by('-updated_on', '-id').first()
+        self.comment_count = comments.count()
+        self.last_comment = last_comment
+        self.last_commented_at = last_comment.updated_on if last_comment else None
+        Topic.objects.filter(id=self.id).update(
+            comment_count=self.comment_count,
+            last_comment=self.last_comment,
+            last_commented_at=self.last_commented_at,
+        )
 
     def get_topic_users(self):
-        comment_user_ids = Comment.objects.filter(topic=self).values_list('commented_by', flat=True)
-        liked_users_ids = UserTopics.objects.filter(topic=self, is_like=True).values_list('user', flat=True)
-        followed_users = UserTopics.objects.filter(topic=self, is_followed=True).values_list('user', flat=True)
-        all_users = list(comment_user_ids) + list(liked_users_ids) + list(followed_users) + [self.created_by.id]
-        users = UserProfile.objects.filter(user_id__in=set(all_users))
+        users = UserProfile.objects.filter(
+            user__topic_participations__topic=self).order_by('user__topic_participations__id')
         return users
 
+    def get_avatar_users(self):
+        if hasattr(self, '_avatar_users'):
+            return self._avatar_users
+        return self.get_topic_users().select_related('user')[:self.AVATAR_LIMIT]
+
     # def get_total_of_votes(self):
     #     no_of_votes = self.no_of_votes + self.no_of_down_votes
     #     return no_of_votes
 
     def up_votes_count(self):
-        return self.votes.filter(type="U").count()
+        return self.up_votes
 
     def down_votes_count(self):
-        return self.votes.filter(type="D").count()  
+        return self.down_votes  
 
     def __str__(self):
         return self.title      
@@ -197,6 +420,91 @@ class UserTopics(models.Model):
     no_of_down_votes = models.IntegerField(default='0')
     is_like = models.BooleanField(default=False)
 
+    # participant role kept in step with each flag
+    FLAG_ROLES = {'is_like': 'is_liker', 'is_followed': 'is_follower'}
+    # toggles racing this one for the row, beyond which it gives up
+    TOGGLE_ATTEMPTS = 5
+
+    class Meta:
+        unique_together = [("user", "topic"), ]
+
+    @classmethod
+    def toggle(cls, user, topic, flag, **extra):
+        """
+        Flip ``flag`` (is_like or is_followed) of the user's row for the topic
+        and return the new value. The row is created through the unique
+        constraint and flipped with a conditional UPDATE, so concurrent
+        toggles each flip it exactly once. ``extra`` columns are set with it.
+        """
+        with transaction.atomic():
+            for attempt in range(cls.TOGGLE_ATTEMPTS):
+                # fetched again on a retry, in case the row was deleted meanwhile
+                user_topic, created = cls.objects.get_or_create(user=user, topic=topic)
+                if cls.set_flag(user_topic.id, flag, True, extra):
+                    active = True
+                    break
+                if cls.set_flag(user_topic.id, flag, False, extra):
+                    active = False
+                    break
+                # another toggle flipped the flag between the two updates, or deleted the row
+            else:
+                raise IntegrityError('Could not toggle %s of user %s on topic %s' % (flag, user.id, topic.id))
+            if flag == 'is_like':
+                if active:
+                    Topic.objects.filter(id=topic.id).update(no_of_likes=F('no_of_likes') + 1)
+                else:
+                    Topic.objects.filter(id=topic.id, no_of_likes__gt=0).update(
+                        no_of_likes=F('no_of_likes') - 1)
+            if active:
+                TopicParticipant.add_role(topic.id, user.id, cls.FLAG_ROLES[flag])
+            else:
+                TopicParticipant.remove_role(topic.id, user.id, cls.FLAG_ROLES[flag])
+        return active
+
+    @classmethod
+    def set_flag(cls, user_topic_id, flag, value, extra):
+        """Set ``flag`` to ``value`` if it is not already, returning the number of rows changed."""
+        return cls.objects.filter(id=user_topic_id, **{flag: not value}).update(**dict(extra, **{flag: value}))
+
+
+# users taking part in a topic, kept in step with topics, comments, likes and follows
+class TopicParticipant(models.Model):
+    ROLES = ('is_creator', 'is_commenter', 'is_liker', 'is_follower')
+
+    topic = models.ForeignKey(Topic, related_name='participants')
+    user = models.ForeignKey(User, related_name='topic_participations')
+    is_creator = models.BooleanField(default=False)
+    is_commenter = models.BooleanField(default=False)
+    is_liker = models.BooleanField(default=False)
+    is_follower = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = [('topic', 'user'), ]
+        # a topic's first participants, for its avatar strip
+        index_together = [('topic', 'id'), ]
+
+    @classmethod
+    def add_role(cls, topic_id, user_id, role):
+        participant, created = cls.objects.get_or_create(
+            topic_id=topic_id, user_id=user_id, defaults={role: True})
+        if created:
+            Topic.objects.filter(id=topic_id).update(participant_count=F('participant_count') + 1)
+        elif not getattr(participant, role):
+            cls.objects.filter(id=participant.id).update(**{role: True})
+
+    @classmethod
+    def remove_role(cls, topic_id, user_id, role):
+        participant = cls.objects.filter(topic_id=topic_id, user_id=user_id).first()
+        if not participant or not getattr(participant, role):
+            return
+        setattr(participant, role, False)
+        if any(getattr(participant, each) for each in cls.ROLES):
+            participant.save(update_fields=[role])
+        else:
+            participant.delete()
+            Topic.objects.filter(id=topic_id, participant_count__gt=0).update(
+                participant_count=F('participant_count') - 1)
+
 
 class Comment(models.Model):
     comment = models.TextField(null=True, blank=True)
@@ -206,17 +514,416 @@ class Comment(models.Model):
     updated_on = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey("self", blank=True, null=True, related_name="comment_parent")
     mentioned = models.ManyToManyField(User, related_name="mentioned_users")
-    votes = models.ManyToManyField(Vote)
+    # materialized path: the fixed-width base36 ids of the ancestors and the comment itself
+    path = models.CharField(max_length=700, db_index=True, default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    up_votes = models.PositiveIntegerField(default=0)
+    down_votes = models.PositiveIntegerField(default=0)
+
+    PATH_STEP = 7
+    PATH_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+    # levels of replies whose paths fit the column
+    MAX_DEPTH = 100
+
+    @classmethod
+    def path_segment(cls, comment_id):
+        segment = ''
+        while comment_id:
+            comment_id, digit = divmod(comment_id, len(cls.PATH_ALPHABET))
+            segment = cls.PATH_ALPHABET[digit] + segment
+        return segment.rjust(cls.PATH_STEP, '0')
+
+    def get_parent_position(self):
+        """
+        The path and depth of the parent, refusing a parent that does not
+        exist, is in another topic or is in this comment's own thread.
+        """
+        try:
+            parent = Comment.objects.filter(id=self.parent_id).values_list('topic_id', 'path', 'depth').first()
+        except (TypeError, ValueError):
+            parent = None
+        if parent is None or parent[0] != self.topic_id:
+            raise ValidationError('The comment replied to does not exist in this topic.', code='invalid_parent')
+        parent_path, parent_depth = parent[1:]
+        if self.path and parent_path.startswith(self.path):
+            raise ValidationError('A comment cannot be moved under its own replies.', code='invalid_parent')
+        self.check_depth(parent_path, parent_depth)
+        return parent_path, parent_depth
+
+    def check_depth(self, parent_path, parent_depth):
+        """Refuse a reply, or a move of a thread, that would nest deeper than ``MAX_DEPTH``."""
+        height = 0
+        if self.path and self.path != parent_path + self.path_segment(self.id):
+            deepest = Comment.objects.filter(
+                topic_id=self.topic_id, path__startswith=self.path).aggregate(deepest=Max('depth'))['deepest']
+            height = (deepest or self.depth) - self.depth
+        if parent_depth + 1 + height >= self.MAX_DEPTH:
+            raise ValidationError(
+                'Replies can be nested at most %s levels deep.' % self.MAX_DEPTH, code='max_depth')
+
+    def save(self, *args, **kwargs):
+        if self.parent_id:
+            parent_path, parent_depth = self.get_parent_position()
+        super(Comment, self).save(*args, **kwargs)
+        if self.parent_id:
+            path, depth = parent_path + self.path_segment(self.id), parent_depth + 1
+        else:
+            path, depth = self.path_segment(self.id), 0
+        if path == self.path:
+            return
+        old_path, old_depth = self.path, self.depth
+        self.path, self.depth = path, depth
+        Comment.objects.filter(id=self.id).update(path=path, depth=depth)
+        if old_path:
+            # re-parented: move the whole subtree in one statement
+            Comment.objects.filter(
+                topic_id=self.topic_id, path__startswith=old_path).exclude(id=self.id).update(
+                path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (depth - old_depth),
+            )
 
     def get_comments(self):
         comments = self.comment_parent.all()
         return comments
 
+    def get_descendants(self):
+        comments = Comment.objects.filter(
+            topic_id=self.topic_id, path__startswith=self.path).exclude(id=self.id).order_by('path')
+        return comments
+
+    def get_thread_reply_count(self):
+        return self.get_descendants().count()
+
     def up_votes_count(self):
-        return self.votes.filter(type="U").count()
+        return self.up_votes
 
     def down_votes_count(self):
-        return self.votes.filter(type="D").count()
+        return self.down_votes
+
+
+class ViewerSketch(models.Model):
+    """
+    Daily HyperLogLog sketch of the distinct viewers of a topic or category.
+    """
+    TARGET_TYPES = (
+        ("T", "Topic"),
+        ("C", "Category"),
+    )
+    target_type = models.CharField(choices=TARGET_TYPES, max_length=1)
+    target_id = models.PositiveIntegerField()
+    day = models.DateField()
+    registers = models.BinaryField()
+
+    class Meta:
+        unique_together = [("target_type", "target_id", "day"), ]
+
+    def get_sketch(self):
+        return HyperLogLog(bytes(self.registers))
+
+    @classmethod
+    def add(cls, target_type, target_id, day, index, rank):
+        """
+        Raise register ``index`` of the day's sketch to ``rank`` and return the
+        stored registers. The row is locked so concurrent writers merge instead
+        of overwriting each other.
+        """
+        with transaction.atomic():
+            sketch, created = cls.objects.get_or_create(
+                target_type=target_type, target_id=target_id, day=day,
+                defaults={'registers': HyperLogLog().to_bytes()})
+            sketch = cls.objects.select_for_update().get(id=sketch.id)
+            hll = sketch.get_sketch()
+            if hll.update(index, rank):
+                sketch.registers = hll.to_bytes()
+                sketch.save(update_fields=['registers'])
+        return hll.to_bytes()
+
+    @classmethod
+    def estimate(cls, target_type, target_id, start, end):
+        """Merged sketch of the days from ``start`` to ``end`` inclusive."""
+        hll = HyperLogLog()
+        for registers in cls.objects.filter(
+                target_type=target_type, target_id=target_id,
+                day__gte=start, day__lte=end).values_list('registers', flat=True):
+            hll.merge(HyperLogLog(bytes(registers)))
+        return hll
+
+    @classmethod
+    def unique_viewers(cls, target_type, target_id, today):
+        """Approximate distinct viewers today and over the last 7 and 30 days."""
+        sketches = dict(
+            (day, HyperLogLog(bytes(registers))) for day, registers in cls.objects.filter(
+                target_type=target_type, target_id=target_id,
+                day__gt=today - timedelta(days=30), day__lte=today).values_list('day', 'registers'))
+        stats = {}
+        for label, days in (('today', 1), ('week', 7), ('month', 30)):
+            hll = HyperLogLog()
+            for day, sketch in sketches.items():
+                if day > today - timedelta(days=days):
+                    hll.merge(sketch)
+            stats[label] = hll.count()
+        stats['error'] = round(hll.error * 100, 1)
+        return stats
+
+
+# documents and postings of the search backend that works on any database
+class SearchDocument(models.Model):
+    KINDS = (
+        ("T", "Topic"),
+        ("C", "Comment"),
+    )
+    kind = models.CharField(choices=KINDS, max_length=1)
+    doc_id = models.PositiveIntegerField()
+    topic = models.ForeignKey(Topic, related_name='+')
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    length = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [("kind", "doc_id"), ]
+
+
+class SearchPosting(models.Model):
+    document = models.ForeignKey(SearchDocument, related_name='postings')
+    term = models.CharField(max_length=64, db_index=True)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # a word's heaviest postings are read first
+        index_together = [("term", "weight"), ]
+
+
+class NotificationEvent(models.Model):
+    """
+    A comment notification waiting for the next digest of a user who has
+    chosen hourly or daily digests; deleted once the digest is sent.
+    """
+    KINDS = (
+        ("C", "Comment"),
+        ("M", "Mention"),
+    )
+    user = models.ForeignKey(User, related_name='+')
+    comment = models.ForeignKey(Comment, related_name='+')
+    kind = models.CharField(choices=KINDS, max_length=1)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+
+# sidebar leaderboards of the categories, tags and users with the most topics
+CATEGORY_BOARD = Leaderboard(
+    'categories', lambda: ForumCategory.objects.filter(is_active=True), count_field='topic_count')
+TAG_BOARD = Leaderboard('tags', lambda: Tags.objects.all(), count_field='topic_count')
+USER_BOARD = Leaderboard('users', lambda: get_user_model().objects.all())
+
+
+def adjust_leaderboard(board, deltas):
+    transaction.on_commit(lambda: board.adjust(deltas))
+
+
+def adjust_topic_counts(model, deltas):
+    """
+    Apply ``{id: delta}`` to the stored published topic counts of categories
+    or tags, one UPDATE per distinct delta, and to their leaderboard.
+    """
+    by_delta = {}
+    for pk, delta in deltas.items():
+        if pk and delta:
+            by_delta.setdefault(delta, []).append(pk)
+    for delta, ids in by_delta.items():
+        model.objects.filter(id__in=ids, topic_count__gte=-delta).update(
+            topic_count=F('topic_count') + delta)
+    adjust_leaderboard(CATEGORY_BOARD if model is ForumCategory else TAG_BOARD, deltas)
+
+
+@receiver(post_save, sender=Topic)
+def add_topic_creator(sender, instance, created, **kwargs):
+    if created:
+        TopicParticipant.objects.create(topic=instance, user_id=instance.created_by_id, is_creator=True)
+        instance.participant_count = 1
+        Topic.objects.filter(id=instance.id).update(participant_count=1)
+
+
+@receiver(post_save, sender=UserTopics)
+def sync_topic_participant_roles(sender, instance, **kwargs):
+    for role, active in (('is_liker', instance.is_like), ('is_follower', instance.is_followed)):
+        if active:
+            TopicParticipant.add_role(instance.topic_id, instance.user_id, role)
+        else:
+            TopicParticipant.remove_role(instance.topic_id, instance.user_id, role)
+
+
+@receiver(post_delete, sender=UserTopics)
+def remove_topic_participant_roles(sender, instance, **kwargs):
+    TopicParticipant.remove_role(instance.topic_id, instance.user_id, 'is_liker')
+    TopicParticipant.remove_role(instance.topic_id, instance.user_id, 'is_follower')
+
+
+@receiver(post_save, sender=Comment)
+def increment_topic_comment_stats(sender, instance, created, **kwargs):
+    if created:
+        Topic.objects.filter(id=instance.topic_id).update(
+            comment_count=F('comment_count') + 1,
+            last_comment=instance,
+            last_commented_at=instance.updated_on,
+        )
+        TopicParticipant.add_role(instance.topic_id, instance.commented_by_id, 'is_commenter')
+
+
+@receiver(post_delete, sender=Topic)
+@receiver(post_delete, sender=Comment)
+def delete_target_votes(sender, instance, **kwargs):
+    Vote.objects.filter(target_type=Vote.target_type_of(instance), target_id=instance.id).delete()
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_topic_comment_stats(sender, instance, **kwargs):
+    # runs for cascaded replies too; last_comment has already been SET_NULL
+    Topic.objects.filter(id=instance.topic_id, comment_count__gt=0).update(
+        comment_count=F('comment_count') - 1)
+    topic = Topic.objects.filter(id=instance.topic_id, last_comment=None).first()
+    if topic and topic.comment_count:
+        topic.refresh_comment_stats()
+    if not Comment.objects.filter(topic_id=instance.topic_id, commented_by_id=instance.commented_by_id).exists():
+        TopicParticipant.remove_role(instance.topic_id, instance.commented_by_id, 'is_commenter')
+
+
+@receiver(post_save, sender=Topic)
+def adjust_topic_leaderboards(sender, instance, created, **kwargs):
+    if created:
+        adjust_topic_counts(ForumCategory, {instance.category_id: int(instance.is_published())})
+        adjust_leaderboard(USER_BOARD, {instance.created_by_id: 1})
+    else:
+        was_published = int(instance._loaded_status == 'Published')
+        is_published = int(instance.is_published())
+        deltas = {instance._loaded_category_id: -was_published}
+        deltas[instance.category_id] = deltas.get(instance.category_id, 0) + is_published
+        adjust_topic_counts(ForumCategory, deltas)
+        if was_published != is_published:
+            adjust_topic_counts(Tags, dict(
+                (tag_id, is_published - was_published)
+                for tag_id in instance.tags.values_list('id', flat=True)))
+    instance._loaded_category_id = instance.category_id
+    instance._loaded_status = instance.status
+
+
+@receiver(pre_delete, sender=Topic)
+def remember_deleted_topic_tags(sender, instance, **kwargs):
+    # the tag rows are gone by post_delete and their removal sends no m2m_changed
+    instance._deleted_tag_ids = list(instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Topic)
+def remove_deleted_topic_from_leaderboards(sender, instance, **kwargs):
+    adjust_leaderboard(USER_BOARD, {instance.created_by_id: -1})
+    if instance._loaded_status == 'Published':
+        adjust_topic_counts(ForumCategory, {instance._loaded_category_id: -1})
+        adjust_topic_counts(Tags, dict((tag_id, -1) for tag_id in getattr(instance, '_deleted_tag_ids', [])))
+
+
+@receiver(m2m_changed, sender=Topic.tags.through)
+def adjust_tag_topic_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_count = instance.topic_set.filter(status='Published').count()
+        else:
+            instance._cleared_tag_ids = list(instance.tags.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        if reverse:
+            adjust_topic_counts(Tags, {instance.id: -instance._cleared_count})
+        elif instance.is_published():
+            adjust_topic_counts(Tags, dict((tag_id, -1) for tag_id in instance._cleared_tag_ids))
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        published = Topic.objects.filter(id__in=pk_set, status='Published').count()
+        adjust_topic_counts(Tags, {instance.id: delta * published})
+    elif instance.is_published():
+        adjust_topic_counts(Tags, dict((tag_id, delta) for tag_id in pk_set))
+
+
+@receiver(post_save, sender=ForumCategory)
+@receiver(post_delete, sender=ForumCategory)
+def invalidate_category_leaderboard(sender, **kwargs):
+    CATEGORY_BOARD.invalidate()
+
+
+@receiver(post_save, sender=ForumCategory)
+@receiver(post_delete, sender=ForumCategory)
+@receiver(post_save, sender=Topic)
+@receiver(post_delete, sender=Topic)
+def invalidate_category_tree_cache(sender, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Tags)
+@receiver(post_delete, sender=Tags)
+def invalidate_tag_leaderboard(sender, **kwargs):
+    TAG_BOARD.invalidate()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_user_leaderboard(sender, **kwargs):
+    USER_BOARD.invalidate()
+
+
+@receiver(pre_save, sender=UserProfile)
+def set_profile_search_fields(sender, instance, **kwargs):
+    if not instance.search_username and not instance.search_email:
+        instance.set_search_fields(instance.user)
+
+
+@receiver(post_save, sender=User)
+def update_profile_search_fields(sender, instance, **kwargs):
+    profile = UserProfile(user=instance)
+    profile.set_search_fields(instance)
+    UserProfile.objects.filter(user=instance).exclude(
+        search_username=profile.search_username, search_email=profile.search_email
+    ).update(search_username=profile.search_username, search_email=profile.search_email)
+
+
+@receiver(post_save, sender=Topic)
+def index_topic(sender, instance, **kwargs):
+    get_search_backend().index(SearchDocumentData.for_topic(instance))
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    get_search_backend().index(SearchDocumentData.for_comment(instance))
+
+
+@receiver(post_delete, sender=Topic)
+@receiver(post_delete, sender=Comment)
+def remove_search_document(sender, instance, **kwargs):
+    get_search_backend().remove("T" if sender is Topic else "C", instance.id)
+
+
+@receiver(post_save, sender=Tags)
+def index_typeahead_tag(sender, instance, created, **kwargs):
+    loaded, instance._loaded_typeahead = instance._loaded_typeahead, instance.typeahead_fields()
+    if created or loaded != instance._loaded_typeahead:
+        transaction.on_commit(lambda: index_tag_title(instance))
+
+
+@receiver(post_delete, sender=Tags)
+def unindex_typeahead_tag(sender, instance, **kwargs):
+    transaction.on_commit(lambda: unindex_tag_title(instance))
+
+
+@receiver(post_save, sender=Topic)
+def index_typeahead_topic(sender, instance, created, **kwargs):
+    # other saves, such as counter updates, leave the index as it is
+    loaded, instance._loaded_typeahead = instance._loaded_typeahead, instance.typeahead_fields()
+    if created and not instance.is_published():
+        return
+    if created or loaded != instance._loaded_typeahead:
+        transaction.on_commit(lambda: index_topic_title(instance))
+
+
+@receiver(post_delete, sender=Topic)
+def unindex_typeahead_topic(sender, instance, **kwargs):
+    transaction.on_commit(lambda: unindex_topic_title(instance))
 
 
 # user activity
@@ -228,7 +935,8 @@ class Timeline(models.Model):
     event_type = models.CharField(max_length=250, db_index=True)
     user = models.ForeignKey(User, null=True)
     data = models.TextField(null=True, blank=True)
-    created_on = models.DateTimeField(auto_now_add=True)
+    # set by the outbox to the time of the event, which may be well before the insert
+    created_on = models.DateTimeField(default=timezone.now)
     is_read = models.BooleanField(default=False)
 
     class Meta:
@@ -236,6 +944,34 @@ class Timeline(models.Model):
         ordering = ['-created_on']
 
 
+class OutboxEvent(models.Model):
+    """
+    A side effect of a forum write, saved in the same transaction and run
+    later by ``outbox.drain``; deleted once its handler succeeds.
+    """
+    STATUSES = (
+        ("P", "Pending"),
+        ("F", "Failed"),
+    )
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(choices=STATUSES, max_length=1, default="P")
+    # not claimed by a drain, or not retried, before this time
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_on = models.DateTimeField(default=timezone.now)
+    # set by the drain whose lease on the event is current
+    claim_token = models.CharField(max_length=32, blank=True, editable=False)
+
+    class Meta:
+        index_together = [("status", "available_at"), ]
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+
 class Attachment(models.Model):
     file_prepend = "forum_topic/attachments/"
     uploaded_by = models.ForeignKey(User, related_name='attachments_user')
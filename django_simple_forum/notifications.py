@@ -0,0 +1,186 @@
+"""
+Email notifications for new comments, sent off the request path.
+
+Adding a comment publishes a single fan-out event to the outbox in its
+transaction. Draining the outbox then resolves the recipients in bulk,
+skipping the users who have not enabled ``send_mailnotifications``, and
+publishes a mail event per chunk of them, sent over the pooled mail transport,
+so posting on a busy topic returns as soon as the comment is saved and a
+failed chunk is retried by the outbox. Each template is rendered once per
+chunk, not once per recipient. Users who chose hourly or daily digests get an event row
+instead, summed up into one email per period by ``send_notification_digests``.
+"""
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db.models import Case, Count, Max, When
+from django.template import loader
+from django.utils.html import escape
+
+from .outbox import publish
+from .sending_mail import MailMessage, recipient_token, send_messages
+
+logger = logging.getLogger(__name__)
+
+# recipients handed to the mail transport per call
+SEND_CHUNK_SIZE = 100
+
+NOTIFICATION_TEMPLATES = {
+    'C': 'emails/comment_add.html',
+    'M': 'emails/comment_mentioned.html',
+}
+
+# the recipient fields email templates can use, as {{ user.<field> }}
+RECIPIENT_FIELDS = ('name', 'username', 'email')
+
+_templates = {}
+
+
+def get_email_template(template_name):
+    if template_name not in _templates:
+        _templates[template_name] = loader.get_template(template_name)
+    return _templates[template_name]
+
+
+def recipient_variables(user):
+    return {
+        'name': escape(user.get_full_name() or user.username),
+        'username': escape(user.username),
+        'email': escape(user.email),
+    }
+
+
+class NotificationRenderer(object):
+    """
+    Renders an email template once per event with tokens in place of the
+    recipient's fields, which the mail transport fills in for each copy.
+    """
+
+    def __init__(self, template_name, context, subject):
+        context = dict(context, user=dict((field, recipient_token(field)) for field in RECIPIENT_FIELDS))
+        self.body = get_email_template(template_name).render(context)
+        self.subject = subject
+
+    def message(self, users):
+        return MailMessage(
+            [user.email for user in users], settings.DEFAULT_FROM_EMAIL, self.subject, self.body,
+            recipient_variables=dict((user.email, recipient_variables(user)) for user in users))
+
+
+def notify_comment_added(comment):
+    publish('comment-notifications', {'comment_id': comment.id})
+
+
+def deliver_comment_notifications(event):
+    send_comment_notifications(event.data['comment_id'])
+
+
+def send_comment_notifications(comment_id):
+    """
+    Record the digest events of a comment and publish a mail event for each
+    chunk of its immediate recipients. Run from the outbox, these writes
+    commit with the deletion of the event that caused them, so they are made
+    once; a chunk whose mail fails is retried on its own.
+    """
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    UserProfile = apps.get_model('django_simple_forum', 'UserProfile')
+    NotificationEvent = apps.get_model('django_simple_forum', 'NotificationEvent')
+    comment = Comment.objects.filter(id=comment_id).first()
+    if comment is None:
+        return
+    participants = UserProfile.objects.filter(
+        user__topic_participations__topic_id=comment.topic_id, send_mailnotifications=True
+    ).order_by('user__topic_participations__id')
+    mentioned = UserProfile.objects.filter(user__mentioned_users=comment, send_mailnotifications=True)
+    for kind, profiles in (('C', participants), ('M', mentioned)):
+        # digest subscribers get an event row, summed up by send_notification_digests
+        NotificationEvent.objects.bulk_create([
+            NotificationEvent(user_id=user_id, comment_id=comment.id, kind=kind)
+            for user_id in profiles.exclude(notification_frequency='immediate').values_list('user_id', flat=True)
+        ])
+        user_ids = list(profiles.filter(notification_frequency='immediate').values_list('user_id', flat=True))
+        for start in range(0, len(user_ids), SEND_CHUNK_SIZE):
+            publish('comment-notification-mail', {
+                'comment_id': comment.id, 'kind': kind, 'user_ids': user_ids[start:start + SEND_CHUNK_SIZE]})
+
+
+def deliver_notification_mail(event):
+    data = event.data
+    send_notification_mail(data['comment_id'], data['kind'], data['user_ids'])
+
+
+def send_notification_mail(comment_id, kind, user_ids):
+    """Mail the users ``user_ids`` of a comment, raising if the transport fails."""
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    comment = Comment.objects.select_related('topic').filter(id=comment_id).first()
+    if comment is None:
+        return
+    users = get_user_model().objects.in_bulk(user_ids)
+    users = [users[user_id] for user_id in user_ids if user_id in users]
+    if not users:
+        return
+    context = {
+        'comment': comment,
+        'topic_url': settings.HOST_URL + reverse(
+            'django_simple_forum:view_topic', kwargs={'slug': comment.topic.slug}),
+        'HOST_URL': settings.HOST_URL,
+    }
+    subject = "New Comment For The Topic " + comment.topic.title
+    send_messages([NotificationRenderer(NOTIFICATION_TEMPLATES[kind], context, subject).message(users)])
+
+
+def send_notification_digests(frequency):
+    """
+    Mail every user on ``frequency`` one summary of their pending events, a
+    line per topic, and delete the events that went out. Returns the number
+    of digests sent.
+    """
+    NotificationEvent = apps.get_model('django_simple_forum', 'NotificationEvent')
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    frequencies = [frequency]
+    if frequency == 'hourly':
+        # left behind by users who switched back to immediate mails
+        frequencies.append('immediate')
+    events = NotificationEvent.objects.filter(user__userprofile__notification_frequency__in=frequencies)
+    # events recorded while the digests are sent wait for the next run
+    last_id = events.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return 0
+    events = events.filter(id__lte=last_id)
+    summary = events.values('user_id', 'comment__topic_id').annotate(
+        comments=Count('comment_id', distinct=True),
+        mentions=Count(Case(When(kind='M', then=1))),
+        latest=Max('created_on'),
+    ).order_by('user_id', '-latest')
+    entries = {}
+    for row in summary:
+        entries.setdefault(row['user_id'], []).append(row)
+    topics = Topic.objects.only('id', 'title', 'slug').in_bulk(set(row['comment__topic_id'] for row in summary))
+    users = get_user_model().objects.in_bulk(list(entries))
+    template = get_email_template('emails/notification_digest.html')
+    subject = "Your %s forum digest" % frequency
+    user_ids = sorted(entries)
+    sent = 0
+    for start in range(0, len(user_ids), SEND_CHUNK_SIZE):
+        chunk = [user_id for user_id in user_ids[start:start + SEND_CHUNK_SIZE] if user_id in users]
+        messages = []
+        for user_id in chunk:
+            for row in entries[user_id]:
+                row['topic'] = topics.get(row['comment__topic_id'])
+            body = template.render({
+                'user': users[user_id],
+                'entries': [row for row in entries[user_id] if row['topic'] is not None],
+                'HOST_URL': settings.HOST_URL,
+            })
+            messages.append(MailMessage([users[user_id].email], settings.DEFAULT_FROM_EMAIL, subject, body))
+        try:
+            send_messages(messages)
+        except Exception:
+            logger.exception('Could not send %s %s digests', len(messages), frequency)
+            continue
+        events.filter(user_id__in=chunk).delete()
+        sent += len(messages)
+    return sent
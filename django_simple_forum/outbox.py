@@ -0,0 +1,245 @@
+"""
+Transactional outbox for the side effects of forum writes.
+
+Views ``publish`` an event in the same transaction as the write it follows,
+so the event exists exactly when the write does. Once the transaction commits
+a background thread drains the outbox, keeping timeline entries and emails
+off the request path; the ``drain_outbox`` command, run from cron, picks up
+what a crashed process left behind and retries failed events with backoff.
+A drain claims a batch by leasing it for ``LEASE_SECONDS``, so an event held
+by a process that died becomes available again. An event is deleted in the
+transaction of its handler, so the handler's writes are never made twice; a
+handler raises to have its event retried. Event types with a batch
+handler are handled a whole batch at a time, falling back to one event at a
+time if that fails so that only the failing events are retried.
+"""
+import functools
+import json
+import logging
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .sending_mail import thread_mail_transport
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {
+    'timeline': 'django_simple_forum.timeline.record_timeline',
+    'comment-notifications': 'django_simple_forum.notifications.deliver_comment_notifications',
+    'comment-notification-mail': 'django_simple_forum.notifications.deliver_notification_mail',
+    'task': 'django_simple_forum.tasks.run_task_event',
+}
+# handlers taking all the events of their type in a batch at once
+BATCH_HANDLERS = {
+    'timeline': 'django_simple_forum.timeline.record_timelines',
+}
+LEASE_SECONDS = 5 * 60
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 60 * 60
+
+
+class BackgroundWorker(object):
+    """A daemon thread running queued jobs one at a time."""
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='forum-outbox')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def enqueue(self, func, *args):
+        self.start()
+        self.jobs.put((func, args))
+
+    def run(self):
+        while True:
+            func, args = self.jobs.get()
+            close_old_connections()
+            try:
+                func(*args)
+            except Exception:
+                logger.exception('Background job %s%r failed', func.__name__, args)
+            finally:
+                close_old_connections()
+                self.jobs.task_done()
+
+    def wait(self):
+        """Block until every queued job has run."""
+        self.jobs.join()
+
+
+worker = BackgroundWorker()
+_drain_scheduled = threading.Event()
+
+
+def get_handler(event_type):
+    handlers = dict(HANDLERS, **getattr(settings, 'FORUM_OUTBOX_HANDLERS', {}))
+    return import_string(handlers[event_type])
+
+
+def publish(event_type, payload):
+    """Record an event to be handled once the current transaction commits."""
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    event = OutboxEvent.objects.create(event_type=event_type, payload=json.dumps(payload, cls=DjangoJSONEncoder))
+    transaction.on_commit(schedule_drain)
+    return event
+
+
+def schedule_drain():
+    # one pending drain handles every event committed before it runs
+    if not _drain_scheduled.is_set():
+        _drain_scheduled.set()
+        worker.enqueue(drain_scheduled)
+
+
+def drain_scheduled():
+    _drain_scheduled.clear()
+    drain()
+
+
+def claim_batch(batch_size):
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = OutboxEvent.objects.filter(status='P', available_at__lte=now).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # spares concurrent drains from waiting on each other's rows
+            queryset = queryset.select_for_update(skip_locked=True)
+        return lease_events(list(queryset.values_list('id', flat=True)[:batch_size]), now)
+
+
+def lease_events(ids, now):
+    """
+    Lease those of the events ``ids`` still available at ``now``, returning
+    them. The UPDATE is conditional and tagged with a token of this claim, so
+    of two drains that selected the same events only one gets each of them.
+    """
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    token = uuid.uuid4().hex
+    OutboxEvent.objects.filter(id__in=ids, status='P', available_at__lte=now).update(
+        available_at=now + timedelta(seconds=LEASE_SECONDS), claim_token=token)
+    return list(OutboxEvent.objects.filter(id__in=ids, claim_token=token).order_by('id'))
+
+
+def handle_batches(events):
+    """Handle the events that have a batch handler, returning the ids of those handled."""
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    batch_handlers = dict(BATCH_HANDLERS, **getattr(settings, 'FORUM_OUTBOX_BATCH_HANDLERS', {}))
+    handled = set()
+    for event_type, path in batch_handlers.items():
+        group = [event for event in events if event.event_type == event_type]
+        if not group:
+            continue
+        try:
+            with transaction.atomic():
+                import_string(path)(group)
+                OutboxEvent.objects.filter(id__in=[event.id for event in group]).delete()
+        except Exception:
+            logger.exception('Outbox batch of %s %s events failed, handling them one by one',
+                             len(group), event_type)
+            continue
+        handled.update(event.id for event in group)
+    return handled
+
+
+def handle_event(event):
+    """Run the handler of ``event`` and delete it, returning the error text if it failed."""
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    try:
+        with transaction.atomic():
+            get_handler(event.event_type)(event)
+            OutboxEvent.objects.filter(id=event.id).delete()
+    except Exception:
+        logger.exception('Outbox event %s (%s) failed', event.id, event.event_type)
+        return traceback.format_exc()
+    return None
+
+
+def handle_pooled_event(transports, event):
+    try:
+        return handle_event(event)
+    finally:
+        # pool threads end with the drain, their connections must not outlive them
+        connection.close()
+        transport = thread_mail_transport()
+        if transport is not None:
+            # kept open for the thread's next event, closed when the drain ends
+            transports.add(transport)
+
+
+def handle_in_pool(pool, events, transports):
+    if pool is None:
+        return [handle_event(event) for event in events]
+    return pool.map(functools.partial(handle_pooled_event, transports), events)
+
+
+def close_pool(pool, transports):
+    pool.close()
+    pool.join()
+    for transport in transports:
+        transport.close()
+
+
+def record_failures(failures, max_attempts):
+    OutboxEvent = apps.get_model('django_simple_forum', 'OutboxEvent')
+    now = timezone.now()
+    for event, error in failures:
+        attempts = event.attempts + 1
+        delay = min(RETRY_DELAY * 2 ** event.attempts, MAX_RETRY_DELAY)
+        OutboxEvent.objects.filter(id=event.id).update(
+            attempts=attempts,
+            last_error=error,
+            status='F' if attempts >= max_attempts else 'P',
+            available_at=now + timedelta(seconds=delay),
+        )
+
+
+def drain(batch_size=100, workers=1, max_attempts=5):
+    """
+    Handle the available events in batches of ``batch_size``, on a pool of
+    ``workers`` threads. Returns the numbers of handled and failed events.
+    """
+    if connection.vendor == 'sqlite':
+        # one writer at a time, handlers in threads would only wait on each other's locks
+        workers = 1
+    pool = ThreadPool(workers) if workers > 1 else None
+    transports = set()
+    handled = failed = 0
+    try:
+        while True:
+            events = claim_batch(batch_size)
+            if not events:
+                break
+            handled_ids = handle_batches(events)
+            remaining = [event for event in events if event.id not in handled_ids]
+            remaining_errors = dict(zip(
+                [event.id for event in remaining], handle_in_pool(pool, remaining, transports)))
+            errors = [remaining_errors.get(event.id) for event in events]
+            failures = [(event, error) for event, error in zip(events, errors) if error is not None]
+            record_failures(failures, max_attempts)
+            handled += len(events) - len(failures)
+            failed += len(failures)
+    finally:
+        if pool is not None:
+            close_pool(pool, transports)
+    return handled, failed
@@ -0,0 +1,84 @@
+import base64
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes, force_text
+
+
+class CursorPage(object):
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator(object):
+    """
+    Keyset paginator over a (datetime field, id) pair, newest first.
+
+    Each page is a single indexed range scan of ``per_page + 1`` rows, so the
+    cost of a page does not depend on how deep into the list it is.
+    """
+
+    def __init__(self, queryset, per_page, field='created_on'):
+        self.queryset = queryset.order_by('-' + field, '-id')
+        self.per_page = int(per_page)
+        self.field = field
+
+    def encode_cursor(self, obj, direction):
+        value = '%s|%s|%s' % (direction, getattr(obj, self.field).isoformat(), obj.id)
+        return force_text(base64.urlsafe_b64encode(force_bytes(value)))
+
+    def decode_cursor(self, cursor):
+        try:
+            direction, value, pk = force_text(
+                base64.urlsafe_b64decode(force_bytes(cursor))).split('|')
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise InvalidPage('Invalid cursor')
+        if value is None or direction not in ('next', 'prev'):
+            raise InvalidPage('Invalid cursor')
+        return direction, value, pk
+
+    def page(self, cursor=None):
+        if not cursor:
+            rows = list(self.queryset[:self.per_page + 1])
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1], 'next') if has_more else None
+            return CursorPage(rows, next_cursor, None)
+
+        direction, value, pk = self.decode_cursor(cursor)
+        if direction == 'next':
+            rows = list(self.queryset.filter(
+                Q(**{self.field + '__lt': value}) | Q(**{self.field: value, 'id__lt': pk})
+            )[:self.per_page + 1])
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1], 'next') if has_more else None
+            previous_cursor = self.encode_cursor(rows[0], 'prev') if rows else None
+        else:
+            rows = list(self.queryset.filter(
+                Q(**{self.field + '__gt': value}) | Q(**{self.field: value, 'id__gt': pk})
+            ).reverse()[:self.per_page + 1])
+            has_more, rows = len(rows) > self.per_page, rows[:self.per_page]
+            rows.reverse()
+            previous_cursor = self.encode_cursor(rows[0], 'prev') if has_more else None
+            next_cursor = self.encode_cursor(rows[-1], 'next') if rows else None
+        return CursorPage(rows, next_cursor, previous_cursor)
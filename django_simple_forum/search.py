@@ -0,0 +1,316 @@
+"""
+Full-text search over topics and comments.
+
+Topics and comments are indexed as documents as they are saved and ranked
+against the words of a query, every word being required. Two backends are
+provided: ``SQLiteFTSBackend`` keeps the documents in an FTS5 table and lets
+SQLite rank and cut snippets, ``InvertedIndexBackend`` keeps postings in
+ordinary tables and ranks them in Python, so it runs on any database; it
+scores the ``MAX_POSTINGS_PER_TERM`` heaviest postings of the rarest query
+word against cached corpus totals, so a common word costs no more than a
+rare one. The backend is chosen by the ``FORUM_SEARCH_BACKEND`` setting, defaulting to FTS5
+where the database has the table.
+"""
+import math
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.db.models import Avg, Count
+from django.utils.html import escape, strip_tags
+from django.utils.module_loading import import_string
+
+FTS_TABLE = 'forum_search_fts'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or',
+    'that', 'the', 'this', 'to', 'was', 'with',
+])
+TITLE_WEIGHT = 10
+MAX_POSTINGS_PER_TERM = 1000
+STATS_KEY = 'forum:search:stats'
+SNIPPET_WORDS = 24
+# markers around matched words, swapped for <mark> once the text is escaped
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def highlight(text):
+    return escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def build_snippet(text, terms, words=SNIPPET_WORDS):
+    """The window of ``text`` around the first matched term, terms marked."""
+    tokens = list(TOKEN_RE.finditer(text))
+    if not tokens:
+        return ''
+    terms = set(terms)
+    first = next((i for i, token in enumerate(tokens) if token.group().lower() in terms), 0)
+    start = max(0, first - words // 3)
+    window = tokens[start:start + words]
+    parts, position = [], window[0].start()
+    for token in window:
+        parts.append(text[position:token.start()])
+        if token.group().lower() in terms:
+            parts.append(MARK_START + token.group() + MARK_END)
+        else:
+            parts.append(token.group())
+        position = token.end()
+    snippet = ''.join(parts)
+    if start > 0:
+        snippet = '...' + snippet
+    if start + words < len(tokens):
+        snippet += '...'
+    return snippet
+
+
+class SearchDocumentData(object):
+
+    def __init__(self, kind, doc_id, topic_id, title, body):
+        self.kind = kind
+        self.doc_id = doc_id
+        self.topic_id = topic_id
+        self.title = title
+        self.body = body
+
+    @classmethod
+    def for_topic(cls, topic):
+        return cls('T', topic.id, topic.id, topic.title or '', strip_tags(topic.description or ''))
+
+    @classmethod
+    def for_comment(cls, comment):
+        return cls('C', comment.id, comment.topic_id, '', strip_tags(comment.comment or ''))
+
+
+class SearchHit(object):
+
+    def __init__(self, kind, doc_id, topic_id, score, snippet):
+        self.kind = kind
+        self.doc_id = doc_id
+        self.topic_id = topic_id
+        self.score = score
+        self.snippet = snippet
+        self.topic = None
+        self.comment = None
+
+
+class BaseSearchBackend(object):
+
+    def index(self, document):
+        self.index_many([document])
+
+    def index_many(self, documents):
+        raise NotImplementedError
+
+    def remove(self, kind, doc_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def search(self, query, offset=0, limit=20):
+        """Return ``(total, hits)`` for the published topics matching ``query``."""
+        raise NotImplementedError
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+
+    @staticmethod
+    def rowid(kind, doc_id):
+        # deleting by rowid is a lookup, by an unindexed column a scan
+        return doc_id * 2 + (0 if kind == 'T' else 1)
+
+    @staticmethod
+    def match_expression(terms):
+        return ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+    def index_many(self, documents):
+        rows = [(self.rowid(doc.kind, doc.doc_id), doc.kind, doc.doc_id, doc.topic_id, doc.title, doc.body)
+                for doc in documents]
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(row[0],) for row in rows])
+            cursor.executemany(
+                'INSERT INTO %s (rowid, kind, doc_id, topic_id, title, body) '
+                'VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' % FTS_TABLE, rows)
+
+    def remove(self, kind, doc_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [self.rowid(kind, doc_id)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+
+    def search(self, query, offset=0, limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return 0, []
+        topic_table = apps.get_model('django_simple_forum', 'Topic')._meta.db_table
+        joins = (
+            'FROM {fts} JOIN {topic} ON {topic}.id = {fts}.topic_id '
+            'WHERE {fts} MATCH %s AND {topic}.status = %s'
+        ).format(fts=FTS_TABLE, topic=topic_table)
+        params = [self.match_expression(terms), 'Published']
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) ' + joins, params)
+            total = cursor.fetchone()[0]
+            cursor.execute(
+                "SELECT {fts}.kind, {fts}.doc_id, {fts}.topic_id, bm25({fts}, 0, 0, 0, %s, 1), "
+                "snippet({fts}, -1, %s, %s, '...', %s) ".format(fts=FTS_TABLE) + joins +
+                ' ORDER BY 4 LIMIT %s OFFSET %s',
+                [TITLE_WEIGHT, MARK_START, MARK_END, SNIPPET_WORDS] + params + [limit, offset])
+            rows = cursor.fetchall()
+        # bm25() is lower for better matches
+        return total, [SearchHit(kind, doc_id, topic_id, -score, highlight(snippet))
+                       for kind, doc_id, topic_id, score, snippet in rows]
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """Postings in plain tables, ranked with BM25 in Python."""
+
+    k1 = 1.2
+    b = 0.75
+
+    def models(self):
+        return (apps.get_model('django_simple_forum', 'SearchDocument'),
+                apps.get_model('django_simple_forum', 'SearchPosting'))
+
+    def index_many(self, documents):
+        SearchDocument, SearchPosting = self.models()
+        with transaction.atomic():
+            for kind in ('T', 'C'):
+                SearchDocument.objects.filter(
+                    kind=kind, doc_id__in=[doc.doc_id for doc in documents if doc.kind == kind]).delete()
+            SearchDocument.objects.bulk_create([
+                SearchDocument(kind=doc.kind, doc_id=doc.doc_id, topic_id=doc.topic_id, title=doc.title,
+                               body=doc.body, length=len(tokenize(doc.title)) + len(tokenize(doc.body)))
+                for doc in documents
+            ])
+            ids = {}
+            for kind in ('T', 'C'):
+                ids.update(((kind, doc_id), pk) for doc_id, pk in SearchDocument.objects.filter(
+                    kind=kind, doc_id__in=[doc.doc_id for doc in documents if doc.kind == kind]
+                ).values_list('doc_id', 'id'))
+            postings = []
+            for doc in documents:
+                document_id = ids[(doc.kind, doc.doc_id)]
+                weights = {}
+                for term in tokenize(doc.title):
+                    weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+                for term in tokenize(doc.body):
+                    weights[term] = weights.get(term, 0) + 1
+                postings.extend(SearchPosting(document_id=document_id, term=term[:64], weight=weight)
+                                for term, weight in weights.items())
+            SearchPosting.objects.bulk_create(postings)
+
+    def remove(self, kind, doc_id):
+        SearchDocument, SearchPosting = self.models()
+        SearchDocument.objects.filter(kind=kind, doc_id=doc_id).delete()
+
+    def clear(self):
+        SearchDocument, SearchPosting = self.models()
+        SearchPosting.objects.all().delete()
+        SearchDocument.objects.all().delete()
+        cache.delete(STATS_KEY)
+
+    def corpus_stats(self):
+        """The number of documents and their average length, cached as ranking barely moves with them."""
+        stats = cache.get(STATS_KEY)
+        if stats is None:
+            SearchDocument, SearchPosting = self.models()
+            totals = SearchDocument.objects.aggregate(documents=Count('id'), length=Avg('length'))
+            stats = (totals['documents'], totals['length'] or 1)
+            cache.set(STATS_KEY, stats, getattr(settings, 'FORUM_SEARCH_STATS_TIMEOUT', 10 * 60))
+        return stats
+
+    def search(self, query, offset=0, limit=20):
+        SearchDocument, SearchPosting = self.models()
+        terms = sorted(set(term[:64] for term in tokenize(query)))
+        if not terms:
+            return 0, []
+        frequency = dict((term, 0) for term in terms)
+        frequency.update(SearchPosting.objects.filter(term__in=terms).values('term').annotate(
+            documents=Count('id')).values_list('term', 'documents').order_by())
+        if not all(frequency.values()):
+            return 0, []
+        # every word is required: the rarest one's heaviest postings are the candidates
+        rarest = min(terms, key=lambda term: (frequency[term], term))
+        matched = dict((document_id, {rarest: weight}) for document_id, weight in SearchPosting.objects.filter(
+            term=rarest).order_by('-weight', 'document_id').values_list('document_id', 'weight')[
+                :MAX_POSTINGS_PER_TERM])
+        for term in terms:
+            if term != rarest:
+                for document_id, weight in SearchPosting.objects.filter(
+                        term=term, document_id__in=list(matched)).values_list('document_id', 'weight'):
+                    matched[document_id][term] = weight
+        candidates = [document_id for document_id, weights in matched.items() if len(weights) == len(terms)]
+        if not candidates:
+            return 0, []
+        documents = dict((row[0], row) for row in SearchDocument.objects.filter(
+            id__in=candidates, topic__status='Published').values_list('id', 'kind', 'doc_id', 'topic_id', 'length'))
+        total_documents, average_length = self.corpus_stats()
+
+        ranked = []
+        for document_id, (_, kind, doc_id, topic_id, length) in documents.items():
+            score = 0
+            for term, weight in matched[document_id].items():
+                idf = math.log(1 + (total_documents - frequency[term] + 0.5) / (frequency[term] + 0.5))
+                score += idf * weight * (self.k1 + 1) / (
+                    weight + self.k1 * (1 - self.b + self.b * length / average_length))
+            ranked.append((-score, document_id, kind, doc_id, topic_id))
+        ranked.sort()
+        page = ranked[offset:offset + limit]
+        texts = dict((row[0], row[1:]) for row in SearchDocument.objects.filter(
+            id__in=[row[1] for row in page]).values_list('id', 'title', 'body'))
+        hits = []
+        for score, document_id, kind, doc_id, topic_id in page:
+            title, body = texts[document_id]
+            text = body if set(terms) & set(tokenize(body)) else title
+            snippet = build_snippet(text, terms)
+            hits.append(SearchHit(kind, doc_id, topic_id, -score, highlight(snippet)))
+        return len(ranked), hits
+
+
+_backends = {}
+_fts_available = []
+
+
+def fts_available():
+    if not _fts_available:
+        _fts_available.append(
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names())
+    return _fts_available[0]
+
+
+def get_search_backend():
+    path = getattr(settings, 'FORUM_SEARCH_BACKEND', None)
+    if path is None:
+        path = ('django_simple_forum.search.SQLiteFTSBackend' if fts_available()
+                else 'django_simple_forum.search.InvertedIndexBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def search(query, offset=0, limit=20):
+    """
+    Ranked ``(total, hits)`` for ``query``, each hit carrying its topic and,
+    for comment hits, its comment.
+    """
+    total, hits = get_search_backend().search(query, offset, limit)
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    Comment = apps.get_model('django_simple_forum', 'Comment')
+    topics = Topic.objects.select_related('category', 'created_by').in_bulk(
+        set(hit.topic_id for hit in hits))
+    comments = Comment.objects.select_related('commented_by').in_bulk(
+        [hit.doc_id for hit in hits if hit.kind == 'C'])
+    for hit in hits:
+        hit.topic = topics.get(hit.topic_id)
+        if hit.kind == 'C':
+            hit.comment = comments.get(hit.doc_id)
+    return total, [hit for hit in hits if hit.topic is not None]
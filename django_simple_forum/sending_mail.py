@@ -1,36 +1,237 @@
-from django.conf import settings
-import boto.ses
-import sendgrid
+"""
+Mail delivery through reusable, batching transports.
+
+A transport is created once per process and thread for the ``MAIL_SENDER``
+setting and keeps its connection between calls: an SMTP connection from
+``get_connection`` for Django's mail backend, a ``requests.Session`` for the
+Mailgun and SendGrid HTTP APIs. ``send_messages`` groups the messages sharing
+a sender, subject and body so that each group goes out in as few provider
+calls as the batch APIs allow, every recipient still getting their own copy.
+Recipient-specific ``%recipient.<name>%`` tokens in a body are filled in per
+copy, by the provider where its batch API supports it.
+"""
+import json
+import smtplib
+import socket
+import threading
+
 import requests
-from django.core.mail import EmailMultiAlternatives
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django_ses_gateway.sending_mail import sending_mail
 
+SENDGRID_API_URL = 'https://api.sendgrid.com/v3/mail/send'
+
+
+def recipient_token(name):
+    return '%%recipient.%s%%' % name
+
+
+class MailMessage(object):
+
+    def __init__(self, mto, mfrom, msubject, mbody, email_template_name=None, context=None,
+                 recipient_variables=None):
+        self.mto = list(mto)
+        self.mfrom = mfrom
+        self.msubject = msubject
+        self.mbody = mbody
+        self.email_template_name = email_template_name
+        self.context = context
+        # {recipient: {name: value}}, values ready to be put in the body as they are
+        self.recipient_variables = recipient_variables or {}
+
+    @property
+    def batch_key(self):
+        return (self.mfrom, self.msubject, self.mbody)
+
+    def substitutions(self, recipient):
+        return dict((recipient_token(name), value)
+                    for name, value in self.recipient_variables.get(recipient, {}).items())
+
+    def personalize(self, recipient):
+        body = self.mbody
+        for token, value in self.substitutions(recipient).items():
+            body = body.replace(token, value)
+        return body
+
+
+def group_messages(messages, batch_size):
+    """
+    Messages of at most ``batch_size`` recipients for each distinct content,
+    carrying the recipient variables of every message merged into them.
+    """
+    groups = {}
+    for message in messages:
+        if message.batch_key not in groups:
+            groups[message.batch_key] = MailMessage(
+                [], message.mfrom, message.msubject, message.mbody, message.email_template_name, message.context)
+        group = groups[message.batch_key]
+        group.mto.extend(message.mto)
+        group.recipient_variables.update(message.recipient_variables)
+    for group in groups.values():
+        for start in range(0, len(group.mto), batch_size):
+            yield group, group.mto[start:start + batch_size]
+
+
+class BaseMailTransport(object):
+    batch_size = 1
+
+    def send_messages(self, messages):
+        sent = 0
+        for message, recipients in group_messages(messages, self.batch_size):
+            self.send_batch(message, recipients)
+            sent += len(recipients)
+        return sent
+
+    def send_batch(self, message, recipients):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SMTPTransport(BaseMailTransport):
+    """Django's mail backend over one connection kept open between calls."""
+
+    def __init__(self, backend=None, **kwargs):
+        self.connection = get_connection(backend, **kwargs)
+
+    def send_messages(self, messages):
+        emails = []
+        for message in messages:
+            if message.recipient_variables:
+                bodies = [([recipient], message.personalize(recipient)) for recipient in message.mto]
+            else:
+                bodies = [(message.mto, message.mbody)]
+            for mto, body in bodies:
+                email = EmailMultiAlternatives(message.msubject, body, message.mfrom, mto)
+                email.attach_alternative(body, "text/html")
+                emails.append(email)
+        self.ensure_open()
+        try:
+            return self.connection.send_messages(emails) or 0
+        except Exception:
+            # the server may have dropped the connection, the next call reopens it
+            self.close()
+            raise
+
+    def ensure_open(self):
+        smtp = getattr(self.connection, 'connection', None)
+        if smtp is not None:
+            try:
+                # cheaper than a new handshake, and catches connections the server timed out
+                smtp.noop()
+            except (smtplib.SMTPException, socket.error):
+                self.close()
+        self.connection.open()
+
+    def close(self):
+        self.connection.close()
+
+
+class MailgunTransport(BaseMailTransport):
+    # one call per 1000 recipients, recipient-variables keep each copy private
+    batch_size = 1000
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.auth = ('api', settings.MGUN_API_KEY)
+
+    def send_batch(self, message, recipients):
+        response = self.session.post(settings.MGUN_API_URL, data={
+            'from': message.mfrom,
+            'to': recipients,
+            'subject': message.msubject,
+            'html': message.mbody,
+            'recipient-variables': json.dumps(dict(
+                (recipient, message.recipient_variables.get(recipient, {})) for recipient in recipients)),
+        })
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class SendGridTransport(BaseMailTransport):
+    # personalizations allowed in one v3 mail/send call
+    batch_size = 1000
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Bearer %s' % settings.SG_API_KEY
+
+    def personalization(self, message, recipient):
+        personalization = {'to': [{'email': recipient}]}
+        if message.recipient_variables:
+            personalization['substitutions'] = message.substitutions(recipient)
+        return personalization
+
+    def send_batch(self, message, recipients):
+        response = self.session.post(SENDGRID_API_URL, json={
+            'personalizations': [self.personalization(message, recipient) for recipient in recipients],
+            'from': {'email': message.mfrom},
+            'subject': message.msubject,
+            'content': [
+                {'type': 'text/plain', 'value': message.msubject},
+                {'type': 'text/html', 'value': message.mbody},
+            ],
+        })
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class SESTransport(BaseMailTransport):
+    # a body rendered ahead, sent through the gateway that only renders templates
+    body_template_name = 'emails/message_body.html'
+
+    def send_batch(self, message, recipients):
+        # the gateway sends to one address per call
+        for recipient in recipients:
+            if message.email_template_name and not message.recipient_variables:
+                template_name, context = message.email_template_name, message.context
+            else:
+                template_name, context = self.body_template_name, {'body': message.personalize(recipient)}
+            sending_mail(message.msubject, template_name, context, message.mfrom, recipient)
+
+    def send_messages(self, messages):
+        # the gateway renders its own template per message
+        for message in messages:
+            self.send_batch(message, message.mto)
+        return sum(len(message.mto) for message in messages)
+
+
+TRANSPORTS = {
+    'AMAZON': SESTransport,
+    'MAILGUN': MailgunTransport,
+    'SENDGRID': SendGridTransport,
+}
+
+_local = threading.local()
+
+
+def get_mail_transport():
+    """The transport for ``MAIL_SENDER``, one per thread as connections are not thread safe."""
+    sender = getattr(settings, 'MAIL_SENDER', None)
+    transport = getattr(_local, 'transport', None)
+    if transport is None or _local.sender != sender:
+        if transport is not None:
+            transport.close()
+        transport = TRANSPORTS.get(sender, SMTPTransport)()
+        _local.transport, _local.sender = transport, sender
+    return transport
+
+
+def thread_mail_transport():
+    """The transport of this thread, None if it has not sent mail."""
+    return getattr(_local, 'transport', None)
+
+
+def send_messages(messages):
+    """Deliver ``MailMessage`` objects, returning the number of recipients sent to."""
+    return get_mail_transport().send_messages(messages)
+
 
-def Memail(mto, mfrom, msubject, mbody, email_template_name, context):
-    if settings.MAIL_SENDER == 'AMAZON':
-        sending_mail(msubject, email_template_name, context, mfrom, mto)
-    elif settings.MAIL_SENDER == 'MAILGUN':
-        requests.post(
-            settings.MGUN_API_URL,
-            auth=('api', settings.MGUN_API_KEY),
-            data={
-                'from': mfrom,
-                'to': mto,
-                'subject': msubject,
-                'html': mbody
-            })
-    elif settings.MAIL_SENDER == 'SENDGRID':
-        sg = sendgrid.SendGridClient(settings.SG_USER, settings.SG_PWD)
-        sending_msg = sendgrid.Mail()
-        sending_msg.set_subject(msubject)
-        sending_msg.set_html(mbody)
-        sending_msg.set_text(msubject)
-        sending_msg.set_from(mfrom)
-        sending_msg.add_to(mto)
-        reposne = sg.send(sending_msg)
-        print (reposne)
-    else:
-        text_content = msubject
-        msg = EmailMultiAlternatives(msubject, mbody, mfrom, mto)
-        msg.attach_alternative(mbody, "text/html")
-        msg.send()
+def Memail(mto, mfrom, msubject, mbody, email_template_name=None, context=None):
+    send_messages([MailMessage(mto, mfrom, msubject, mbody, email_template_name, context)])
@@ -0,0 +1,207 @@
+"""
+A small background task runner that needs no broker.
+
+Functions decorated with ``@task`` keep working when called, and ``.delay()``
+hands the call to the backend of the task's queue instead. Queues map to
+backends through the ``FORUM_TASK_BACKENDS`` setting, like ``CACHES``::
+
+    FORUM_TASK_BACKENDS = {
+        'default': 'django_simple_forum.tasks.ThreadPoolBackend',
+        'cpu': 'django_simple_forum.tasks.ProcessPoolBackend',
+        'durable': 'django_simple_forum.tasks.DatabaseBackend',
+    }
+
+``ThreadPoolBackend`` suits I/O-bound work such as sending mail or calling an
+API, ``ProcessPoolBackend`` CPU-bound work such as resizing images, and
+``DatabaseBackend`` work that must survive a restart: it stores the call in
+the outbox, which is drained after commit and by the ``drain_outbox`` command.
+``SyncBackend`` runs the call at once, for tests. Arguments must be JSON
+serializable for the database backend and picklable for the process pool.
+"""
+import logging
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+from django.utils.module_loading import import_string
+from microurl import google_mini
+from sorl.thumbnail import get_thumbnail
+
+from .outbox import publish
+from .sending_mail import Memail
+
+logger = logging.getLogger(__name__)
+
+SHORT_URL_RETRY_AFTER = 60 * 60
+
+DEFAULT_BACKENDS = {
+    'default': 'django_simple_forum.tasks.ThreadPoolBackend',
+    'cpu': 'django_simple_forum.tasks.ProcessPoolBackend',
+    'durable': 'django_simple_forum.tasks.DatabaseBackend',
+}
+
+
+def run_task(name, args, kwargs):
+    """Run the task registered at dotted path ``name``, logging a failure."""
+    try:
+        import_string(name).run(*args, **kwargs)
+    except Exception:
+        logger.exception('Task %s failed', name)
+
+
+class BaseTaskBackend(object):
+
+    def enqueue(self, task, args, kwargs):
+        raise NotImplementedError
+
+
+class SyncBackend(BaseTaskBackend):
+
+    def enqueue(self, task, args, kwargs):
+        task.run(*args, **kwargs)
+
+
+def run_task_in_thread(name, args, kwargs):
+    close_old_connections()
+    try:
+        run_task(name, args, kwargs)
+    finally:
+        # pool threads are reused, a connection left open would never be recycled
+        connections.close_all()
+
+
+class ThreadPoolBackend(BaseTaskBackend):
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            return self.pool
+
+    def enqueue(self, task, args, kwargs):
+        self.get_pool().apply_async(run_task_in_thread, (task.name, args, kwargs))
+
+
+_inherited_connections = []
+
+
+def init_worker_process():
+    # a forked worker shares the parent's database sockets: keep the inherited
+    # connection objects referenced so they are never closed from here, and
+    # let this process open its own
+    for conn in connections.all():
+        if conn.connection is not None:
+            _inherited_connections.append(conn.connection)
+            conn.connection = None
+
+
+class ProcessPoolBackend(BaseTaskBackend):
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.workers, initializer=init_worker_process)
+            return self.pool
+
+    def enqueue(self, task, args, kwargs):
+        self.get_pool().apply_async(run_task, (task.name, args, kwargs))
+
+
+class DatabaseBackend(BaseTaskBackend):
+
+    def enqueue(self, task, args, kwargs):
+        publish('task', {'name': task.name, 'args': list(args), 'kwargs': kwargs})
+
+
+def run_task_event(event):
+    """Outbox handler of ``DatabaseBackend`` calls, failing so the outbox retries."""
+    data = event.data
+    import_string(data['name']).run(*data['args'], **data['kwargs'])
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_task_backend(queue='default'):
+    path = dict(DEFAULT_BACKENDS, **getattr(settings, 'FORUM_TASK_BACKENDS', {}))[queue]
+    with _backends_lock:
+        if path not in _backends:
+            _backends[path] = import_string(path)()
+        return _backends[path]
+
+
+class Task(object):
+
+    def __init__(self, func, queue='default'):
+        self.func = func
+        self.queue = queue
+        self.name = '%s.%s' % (func.__module__, func.__name__)
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def run(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        get_task_backend(self.queue).enqueue(self, args, kwargs)
+
+
+def task(func=None, queue='default'):
+    """
+    Register a module level function as a task, used as ``@task`` or
+    ``@task(queue='cpu')``.
+    """
+    if func is None:
+        return lambda func: Task(func, queue)
+    return Task(func, queue)
+
+
+@task
+def send_email(mto, mfrom, subject, body):
+    Memail(mto, mfrom, subject, body)
+
+
+def short_url_key(url):
+    return 'forum:short_url:%s' % url
+
+
+@task
+def shorten_url(url):
+    try:
+        cache.set(short_url_key(url), google_mini(url, settings.MINIFIED_URL), None)
+    except Exception:
+        logger.exception('Could not shorten %s', url)
+        # serve the full url for a while rather than retrying on every view
+        cache.set(short_url_key(url), url, SHORT_URL_RETRY_AFTER)
+
+
+def get_short_url(url):
+    """The shortened ``url`` once ``shorten_url`` has run, ``url`` meanwhile."""
+    short_url = cache.get(short_url_key(url))
+    if short_url is not None:
+        return short_url
+    if cache.add(short_url_key(url) + ':pending', 1, SHORT_URL_RETRY_AFTER):
+        shorten_url.delay(url)
+    return url
+
+
+@task(queue='cpu')
+def generate_profile_thumbnail(name):
+    """Create the avatar thumbnail of an uploaded picture before a page asks for it."""
+    get_thumbnail(name, "100x100", upscale=True, padding=True)
@@ -1,31 +1,23 @@
 from django import template
-from django_simple_forum.models import ForumCategory, Tags, Badge, UserTopics, UserProfile
-from django.db.models import Count
-try:
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-except ImportError:
-    from django.contrib.auth.models import User
+from django_simple_forum.models import Badge, CATEGORY_BOARD, TAG_BOARD, USER_BOARD
+from django_simple_forum.loaders import get_loaders
 
 register = template.Library()
 
 
 @register.assignment_tag()
 def get_categories():
-    all_categories = ForumCategory.objects.filter(is_active=True).annotate(num_topics=Count('topic')).order_by('-num_topics')[:10]
-    return all_categories
+    return CATEGORY_BOARD.get()
 
 
 @register.assignment_tag()
 def get_tags():
-    all_categories = Tags.objects.annotate(num_topics=Count('topic')).order_by('-num_topics')[:10]
-    return all_categories
+    return TAG_BOARD.get()
 
 
 @register.assignment_tag()
 def get_users():
-    all_users = User.objects.annotate(num_topics=Count('topic')).order_by('-num_topics')[:10]
-    return all_users
+    return USER_BOARD.get()
 
 
 @register.assignment_tag()
@@ -36,28 +28,27 @@ def get_badges():
 
 @register.filter
 def is_topic_like(topic_id, user_id):
-    user_topic = UserTopics.objects.filter(topic_id=topic_id, user_id=user_id).first()
-    if user_topic:
-        if user_topic.is_like:
-            return True
-    return False
+    if not user_id:
+        return False
+    is_like, is_followed = get_loaders().user_topic.load((topic_id, user_id))
+    return is_like
 
 
 @register.filter
 def user_profile_pic(user_id):
-    user = UserProfile.objects.filter(user_id=user_id).first()
-    if user:
-        return user.profile_pic
-    return ''
+    # called with either a user or a user id
+    user_id = getattr(user_id, 'pk', user_id)
+    if not user_id:
+        return ''
+    return get_loaders().profile_pic.load(user_id)
 
 
 @register.filter
 def is_topic_followed(topic_id, user_id):
-    user_topic = UserTopics.objects.filter(topic_id=topic_id, user_id=user_id).first()
-    if user_topic:
-        if user_topic.is_followed:
-            return True
-    return False
+    if not user_id:
+        return False
+    is_like, is_followed = get_loaders().user_topic.load((topic_id, user_id))
+    return is_followed
 
 
 @register.filter
@@ -1,13 +1,59 @@
-from django.test import TestCase, Client
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.signals import template_rendered
+from django.test.utils import CaptureQueriesContext
 try:
     from django.contrib.auth import get_user_model
     User = get_user_model()
 except ImportError:
     from django.contrib.auth.models import User
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Max
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.six import StringIO
 from django_simple_forum.models import (
-    ForumCategory, Badge, UserProfile, Topic, Comment, Tags
+    CATEGORY_BOARD, TAG_BOARD, USER_BOARD, ForumCategory, Badge, UserProfile, Topic, Comment, Tags, UserTopics, Vote, ViewerSketch,
+    NotificationEvent, OutboxEvent, Timeline
 )
+from django_simple_forum.leaderboards import BOARD_SIZE
+from django_simple_forum.pagination import CursorPaginator
+from django_simple_forum.sending_mail import (
+    Memail, MailMessage, BaseMailTransport, MailgunTransport, SendGridTransport, SESTransport, get_mail_transport,
+    send_messages)
+from django_simple_forum import sending_mail as sending_mail_module
+from django_simple_forum import search as search_module
+from django_simple_forum.search import search, build_snippet, MARK_START, MARK_END
+from django_simple_forum.category_tree import get_category_tree
+from django_simple_forum import view_counts
+from django_simple_forum.typeahead import (
+    LazyPrefixIndex, PrefixEntry, PrefixIndex, TAG_INDEX, TOPIC_INDEX, build_tag_index)
+from django_simple_forum.hyperloglog import HyperLogLog
+from django_simple_forum.loaders import ForumLoaders
+from django_simple_forum import notifications
+from django_simple_forum.notifications import notify_comment_added, send_comment_notifications, send_notification_digests
+from django_simple_forum.outbox import (
+    close_pool, drain, handle_in_pool, lease_events, publish, worker as outbox_worker)
+from django_simple_forum import tasks
+from django_simple_forum.tasks import (
+    DatabaseBackend, ProcessPoolBackend, ThreadPoolBackend, task, get_short_url, short_url_key)
+from django_simple_forum.templatetags.forum_tags import is_topic_followed, is_topic_like, user_profile_pic
+from django_simple_forum.view_counts import (
+    record_topic_view, flush_topic_views, record_topic_viewer, BUCKET_SECONDS
+)
+from django_simple_forum.views import ForumCategoryView
 
 
 class TestLoginView(TestCase):
@@ -435,6 +481,24 @@ class TestUserListView(TestCase):
         response = self.client.post(url, {'search_text': 'text'})
         self.assertTemplateUsed(response, 'dashboard/users.html')
 
+    def test_users_search(self):
+        UserProfile.objects.create(user=self.user, user_roles='Admin')
+        other = User.objects.create(email='Kiran@example.com', username='Kiran')
+        profile = UserProfile.objects.create(user=other, user_roles='Publisher')
+        self.assertEqual((profile.search_username, profile.search_email), ('kiran', 'kiran@example.com'))
+        self.assertEqual(list(UserProfile.search(' KIR')), [profile])
+        self.assertEqual(UserProfile.search('example').count(), 0)
+
+        other.username = 'mohan'
+        other.save()
+        self.assertEqual(list(UserProfile.search('moh')), [profile])
+        self.assertEqual(list(UserProfile.search('kiran@')), [profile])
+
+        self.client.login(username=self.user.email, password=self.password)
+        response = self.client.post(reverse('django_simple_forum:users'), {'search_text': 'Ravi'})
+        self.assertEqual([user.user.username for user in response.context['users_list']],
+                         ['ravi@micropyramid.com'])
+
 
 class TestDashboardUserEditView(TestCase):
 
@@ -599,6 +663,26 @@ class TestTopicUpdateView(TestCase):
         response = self.client.post(url, data)
         self.assertFalse(response.json().get('error'))
 
+    def test_topic_update_tag_counts(self):
+        self.topic.status = 'Published'
+        self.topic.save()
+        python = Tags.objects.create(title='python', slug='python')
+        web = Tags.objects.create(title='web', slug='web')
+        self.topic.tags.add(python, web)
+        self.assertEqual(Tags.objects.get(id=python.id).topic_count, 1)
+
+        self.assertTrue(self.client.login(username=self.user.email, password=self.password))
+        url = reverse('django_simple_forum:topic_update', kwargs={"slug": self.topic.slug})
+        data = {'title': 'django', 'category': self.category.id, 'description': 'desc', 'tags': 'web,orm'}
+        response = self.client.post(url, data)
+        self.assertFalse(response.json().get('error'))
+        self.assertEqual(
+            dict(Tags.objects.values_list('slug', 'topic_count')), {'python': 0, 'web': 1, 'orm': 1})
+
+        self.topic.delete()
+        self.assertEqual(dict(Tags.objects.values_list('slug', 'topic_count')), {'python': 0, 'web': 0, 'orm': 0})
+        self.assertEqual(ForumCategory.objects.get(id=self.category.id).topic_count, 0)
+
 
 class TestTopicListView(TestCase):
 
@@ -623,6 +707,214 @@ class TestTopicListView(TestCase):
         self.assertTemplateUsed(response, 'forum/topic_list.html')
 
 
+class TestTopicCursorPagination(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topics = []
+        for index in range(5):
+            topic = Topic.objects.create(
+                title="django %s" % index,
+                slug='django-%s' % index,
+                description="web framework",
+                created_by=self.user,
+                status='Published',
+                category=self.category
+            )
+            # two topics share a timestamp to exercise the id tie-breaker
+            Topic.objects.filter(id=topic.id).update(
+                created_on=datetime(2017, 1, 1 + min(index, 3)))
+            self.topics.insert(0, topic)
+
+    def get_page(self, url, cursor=None):
+        data = {'format': 'json'}
+        if cursor:
+            data['cursor'] = cursor
+        return self.client.get(url, data, HTTP_HOST="django-forum.com").json()
+
+    def test_walk_pages(self):
+        url = reverse('django_simple_forum:forum_category_detail', kwargs={'slug': self.category.slug})
+        ForumCategoryView.paginate_by = 2
+        try:
+            page = self.get_page(url)
+            self.assertIsNone(page['previous_cursor'])
+            seen = [topic['id'] for topic in page['topics']]
+            while page['next_cursor']:
+                page = self.get_page(url, page['next_cursor'])
+                seen.extend(topic['id'] for topic in page['topics'])
+        finally:
+            ForumCategoryView.paginate_by = 20
+        self.assertEqual(seen, [topic.id for topic in self.topics])
+
+    def test_next_and_previous_cursors(self):
+        paginator = CursorPaginator(Topic.objects.all(), 2)
+        first = paginator.page()
+        self.assertEqual(list(first), self.topics[:2])
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(second), self.topics[2:4])
+        last = paginator.page(second.next_cursor)
+        self.assertEqual(list(last), self.topics[4:])
+        self.assertFalse(last.has_next())
+        self.assertEqual(list(paginator.page(last.previous_cursor)), self.topics[2:4])
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(list(back), self.topics[:2])
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor(self):
+        url = reverse('django_simple_forum:topic_list')
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, 'forum/topic_list.html')
+
+
+class TestTopicListingData(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.other_user = User.objects.create(
+            email='john@micropyramid.com',
+            username='john@micropyramid.com'
+        )
+        UserProfile.objects.create(user=self.user, user_roles='Publisher')
+        UserProfile.objects.create(user=self.other_user, user_roles='Publisher')
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        for index in range(5):
+            topic = Topic.objects.create(
+                title="django %s" % index,
+                slug='django-%s' % index,
+                description="web framework",
+                created_by=self.user,
+                status='Published',
+                category=self.category
+            )
+            Comment.objects.create(commented_by=self.other_user, topic=topic, comment='test comment')
+            Comment.objects.create(commented_by=self.other_user, topic=topic, comment='test comment')
+
+    def test_listing_data_queries(self):
+        with self.assertNumQueries(3):
+            topics = list(Topic.objects.with_listing_data()[:20])
+        with self.assertNumQueries(0):
+            for topic in topics:
+                self.assertEqual(topic.category.title, 'Python')
+                self.assertEqual(topic.get_reply_count(), 2)
+                self.assertEqual(topic.participant_count, 2)
+                self.assertEqual(
+                    [profile.user.username for profile in topic.get_avatar_users()],
+                    [self.user.username, self.other_user.username])
+
+    def test_listing_avatars_capped_in_query(self):
+        topic = Topic.objects.get(slug='django-0')
+        for index in range(Topic.AVATAR_LIMIT + 5):
+            user = User.objects.create(email='user%s@micropyramid.com' % index, username='user%s' % index)
+            UserProfile.objects.create(user=user)
+            UserTopics.toggle(user, topic, 'is_followed')
+        with CaptureQueriesContext(connection) as queries:
+            topic = Topic.objects.with_listing_data().get(slug='django-0')
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(len(topic.get_avatar_users()), Topic.AVATAR_LIMIT)
+        self.assertEqual(
+            [profile.id for profile in topic.get_avatar_users()],
+            [profile.id for profile in Topic.objects.get(slug='django-0').get_avatar_users()])
+
+    def test_listing_data_values(self):
+        self.assertEqual(
+            sorted(Topic.objects.with_listing_data().values_list('id', flat=True)),
+            sorted(Topic.objects.values_list('id', flat=True)))
+        self.assertEqual(Topic.objects.with_listing_data().values('slug').get(slug='django-0'), {'slug': 'django-0'})
+
+    def test_listing_data_matches_topic_users(self):
+        topic = Topic.objects.with_listing_data().get(slug='django-0')
+        fresh_topic = Topic.objects.get(slug='django-0')
+        self.assertEqual(
+            [profile.id for profile in topic.get_avatar_users()],
+            [profile.id for profile in fresh_topic.get_avatar_users()])
+        self.assertEqual(topic.get_reply_count(), fresh_topic.get_all_comments().count())
+
+
+class TestTopicParticipants(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.commenter = User.objects.create(
+            email='john@micropyramid.com',
+            username='john@micropyramid.com'
+        )
+        self.liker = User.objects.create(
+            email='jane@micropyramid.com',
+            username='jane@micropyramid.com'
+        )
+        for user in (self.user, self.commenter, self.liker):
+            UserProfile.objects.create(user=user, user_roles='Publisher')
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+
+    def assertParticipants(self, users):
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.participant_count, len(users))
+        self.assertEqual(
+            [profile.user for profile in self.topic.get_topic_users()], users)
+
+    def test_participants_maintained(self):
+        self.assertParticipants([self.user])
+        comment = Comment.objects.create(commented_by=self.commenter, topic=self.topic, comment='hi')
+        Comment.objects.create(commented_by=self.commenter, topic=self.topic, comment='again')
+        self.assertParticipants([self.user, self.commenter])
+
+        user_topic = UserTopics.objects.create(user=self.liker, topic=self.topic, is_like=True)
+        self.assertParticipants([self.user, self.commenter, self.liker])
+        user_topic.is_followed = True
+        user_topic.is_like = False
+        user_topic.save()
+        self.assertParticipants([self.user, self.commenter, self.liker])
+        user_topic.is_followed = False
+        user_topic.save()
+        self.assertParticipants([self.user, self.commenter])
+
+        comment.delete()
+        self.assertParticipants([self.user, self.commenter])
+        Comment.objects.filter(topic=self.topic).delete()
+        self.assertParticipants([self.user])
+
+
 class TestTopicView(TestCase):
 
     def setUp(self):
@@ -661,6 +953,123 @@ class TestTopicView(TestCase):
         self.assertTemplateUsed(response, 'forum/view_topic.html')
 
 
+class TestCommentTree(TestCase):
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST="django-forum.com")
+        self.user = User.objects.create(
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        UserProfile.objects.create(user=self.user, user_roles='Publisher')
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+        self.first = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='first')
+        self.second = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='second')
+        self.reply = Comment.objects.create(
+            commented_by=self.user, topic=self.topic, comment='reply', parent=self.first)
+        self.nested_reply = Comment.objects.create(
+            commented_by=self.user, topic=self.topic, comment='nested', parent=self.reply)
+        self.other_reply = Comment.objects.create(
+            commented_by=self.user, topic=self.topic, comment='other', parent=self.first)
+
+    def test_comment_tree(self):
+        UserProfile.objects.filter(user=self.user).update(profile_pic='forum_user/pic.png')
+        with self.assertNumQueries(1):
+            tree = self.topic.get_comment_tree()
+            self.assertEqual(
+                [(comment, comment.depth) for comment in tree],
+                [(self.first, 0), (self.reply, 1), (self.nested_reply, 2), (self.other_reply, 1),
+                 (self.second, 0)])
+            self.assertEqual(tree[0].reply_count, 2)
+            self.assertEqual(tree[0].commented_by, self.user)
+            self.assertEqual(tree[0].author_profile_pic, 'forum_user/pic.png')
+
+    def test_comment_paths(self):
+        self.assertEqual(self.first.depth, 0)
+        self.assertEqual(self.nested_reply.depth, 2)
+        self.assertTrue(self.nested_reply.path.startswith(self.reply.path))
+        self.assertEqual(list(self.first.get_descendants()), [self.reply, self.nested_reply, self.other_reply])
+        self.assertEqual(self.first.get_thread_reply_count(), 3)
+        self.assertEqual(self.second.get_thread_reply_count(), 0)
+
+    def test_comment_reparent(self):
+        self.reply.parent = self.second
+        self.reply.save()
+        self.nested_reply.refresh_from_db()
+        self.assertEqual(self.reply.depth, 1)
+        self.assertEqual(self.nested_reply.depth, 2)
+        self.assertTrue(self.nested_reply.path.startswith(self.second.path))
+        self.assertEqual(list(self.first.get_descendants()), [self.other_reply])
+        self.assertEqual(list(self.second.get_descendants()), [self.reply, self.nested_reply])
+
+    def test_comment_depth_limit(self):
+        parent = self.nested_reply
+        while parent.depth < Comment.MAX_DEPTH - 1:
+            parent = Comment.objects.create(
+                commented_by=self.user, topic=self.topic, comment='deep', parent=parent)
+        self.assertEqual(len(parent.path), Comment._meta.get_field('path').max_length)
+        with self.assertRaises(ValidationError):
+            Comment.objects.create(commented_by=self.user, topic=self.topic, comment='too deep', parent=parent)
+        # moving the thread under another reply would push its end past the limit too
+        self.reply.parent = self.other_reply
+        with self.assertRaises(ValidationError):
+            self.reply.save()
+        self.reply.parent = self.second
+        self.reply.save()
+        self.assertEqual(Comment.objects.aggregate(Max('depth'))['depth__max'], Comment.MAX_DEPTH - 1)
+
+        self.user.set_password('secret')
+        self.user.save()
+        self.client.login(username=self.user.email, password='secret')
+        response = self.client.post(reverse('django_simple_forum:new_comment'), {
+            'topic': self.topic.id, 'comment': 'too deep', 'parent': parent.id, 'mentioned_user': ''})
+        self.assertTrue(response.json().get('error'))
+        self.assertIn('parent', response.json().get('response'))
+        self.assertFalse(Comment.objects.filter(comment='too deep').exists())
+
+    def test_comment_parent_checked(self):
+        other_topic = Topic.objects.create(
+            title='flask', slug='flask', description='micro framework', created_by=self.user,
+            status='Published', category=self.category)
+        elsewhere = Comment.objects.create(commented_by=self.user, topic=other_topic, comment='elsewhere')
+        for parent_id in (999999, elsewhere.id):
+            with self.assertRaises(ValidationError):
+                Comment.objects.create(
+                    commented_by=self.user, topic=self.topic, comment='orphan', parent_id=parent_id)
+        for parent in (self.first, self.nested_reply):
+            self.first.parent = parent
+            with self.assertRaises(ValidationError):
+                self.first.save()
+
+        self.user.set_password('secret')
+        self.user.save()
+        self.client.login(username=self.user.email, password='secret')
+        response = self.client.post(reverse('django_simple_forum:new_comment'), {
+            'topic': self.topic.id, 'comment': 'orphan', 'parent': 999999, 'mentioned_user': ''})
+        self.assertTrue(response.json().get('error'))
+        self.assertFalse(Comment.objects.filter(comment='orphan').exists())
+
+    def test_topic_view_renders_tree(self):
+        url = reverse('django_simple_forum:view_topic', kwargs={'slug': self.topic.slug})
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['comment_tree'])[2], self.nested_reply)
+        self.assertContains(response, 'nested')
+
+
 class TestTopicDeleteView(TestCase):
 
     def setUp(self):
@@ -751,6 +1160,1075 @@ class TestCommentAdd(TestCase):
         self.assertFalse(response.json().get('error'))
 
 
+class TestCommentNotifications(TransactionTestCase):
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST="django-forum.com")
+        self.password = 'secret'
+        self.user = User.objects.create(email='ravi@micropyramid.com', username='ravi@micropyramid.com')
+        self.user.set_password(self.password)
+        self.user.save()
+        UserProfile.objects.create(user=self.user, send_mailnotifications=True)
+        self.category = ForumCategory.objects.create(
+            created_by=self.user, title='Python', is_active=True, slug='python', description='python')
+        self.topic = Topic.objects.create(
+            title='django', slug='django', description='web framework', created_by=self.user,
+            status='Published', category=self.category)
+        self.follower = User.objects.create(email='kiran@micropyramid.com', username='kiran')
+        UserProfile.objects.create(user=self.follower, send_mailnotifications=True)
+        UserTopics.toggle(self.follower, self.topic, 'is_followed')
+        self.quiet = User.objects.create(email='mohan@micropyramid.com', username='mohan')
+        UserProfile.objects.create(user=self.quiet, send_mailnotifications=False)
+        UserTopics.toggle(self.quiet, self.topic, 'is_followed')
+        self.mentioned = User.objects.create(email='sai@micropyramid.com', username='sai')
+        UserProfile.objects.create(user=self.mentioned, send_mailnotifications=True)
+        mail.outbox = []
+
+    def test_fan_out_after_commit(self):
+        self.client.login(username=self.user.email, password=self.password)
+        response = self.client.post(reverse('django_simple_forum:new_comment'), {
+            'topic': self.topic.id, 'comment': 'test comment', 'parent': '', 'mentioned_user': '@sai,@mohan'})
+        self.assertFalse(response.json().get('error'))
+        outbox_worker.wait()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [
+            'kiran@micropyramid.com', 'ravi@micropyramid.com', 'sai@micropyramid.com'])
+        bodies = dict((message.to[0], message.body) for message in mail.outbox)
+        self.assertIn('Dear kiran,', bodies['kiran@micropyramid.com'])
+        self.assertIn('Dear sai,', bodies['sai@micropyramid.com'])
+
+    def test_rendered_once_per_template(self):
+        rendered = []
+
+        def record_render(sender, template, **kwargs):
+            rendered.append(template.name)
+        template_rendered.connect(record_render)
+        self.addCleanup(template_rendered.disconnect, record_render)
+        self.mentioned.first_name, self.mentioned.last_name = 'Sai', '<b>'
+        self.mentioned.save()
+        UserTopics.toggle(self.mentioned, self.topic, 'is_followed')
+        comment = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='test')
+        send_comment_notifications(comment.id)
+        outbox_worker.wait()
+        self.assertEqual(rendered, ['emails/comment_add.html'])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('Dear Sai &lt;b&gt;,', [message.body for message in mail.outbox][-1])
+
+    def test_digest_events(self):
+        UserProfile.objects.filter(user=self.follower).update(notification_frequency='hourly')
+        UserProfile.objects.filter(user=self.mentioned).update(notification_frequency='daily')
+        UserProfile.objects.filter(user=self.quiet).update(notification_frequency='daily')
+        other = Topic.objects.create(
+            title='flask', slug='flask', description='micro framework', created_by=self.user,
+            status='Published', category=self.category)
+        UserTopics.toggle(self.follower, other, 'is_followed')
+        with transaction.atomic():
+            for topic in (self.topic, self.topic, other):
+                comment = Comment.objects.create(commented_by=self.user, topic=topic, comment='test')
+                comment.mentioned.add(self.mentioned)
+                send_comment_notifications(comment.id)
+        outbox_worker.wait()
+        # only the immediate subscriber is mailed per comment
+        self.assertEqual([message.to for message in mail.outbox], [['ravi@micropyramid.com']] * 3)
+        self.assertEqual(NotificationEvent.objects.filter(user=self.follower).count(), 3)
+        self.assertEqual(NotificationEvent.objects.filter(user=self.mentioned, kind='M').count(), 3)
+        self.assertFalse(NotificationEvent.objects.filter(user=self.quiet).exists())
+
+        mail.outbox = []
+        call_command('send_notification_digests', frequency='hourly', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['kiran@micropyramid.com']])
+        self.assertIn('>django</a>: 2 new comments', mail.outbox[0].body)
+        self.assertIn('>flask</a>: 1 new comment<', mail.outbox[0].body)
+        self.assertFalse(NotificationEvent.objects.filter(user=self.follower).exists())
+
+        mail.outbox = []
+        self.assertEqual(send_notification_digests('daily'), 1)
+        self.assertEqual([message.to for message in mail.outbox], [['sai@micropyramid.com']])
+        self.assertIn('you were mentioned', mail.outbox[0].body)
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertEqual(send_notification_digests('daily'), 0)
+
+    def test_failed_mail_retried(self):
+        UserProfile.objects.filter(user=self.follower).update(notification_frequency='hourly')
+        comment = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='test')
+
+        def send_messages(messages):
+            raise IOError('mail provider down')
+        original, notifications.send_messages = notifications.send_messages, send_messages
+        try:
+            with transaction.atomic():
+                notify_comment_added(comment)
+            outbox_worker.wait()
+        finally:
+            notifications.send_messages = original
+        self.assertEqual(mail.outbox, [])
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event_type, event.attempts), ('comment-notification-mail', 1))
+        self.assertIn('mail provider down', event.last_error)
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['ravi@micropyramid.com']])
+        # the digest event is recorded once, not again with the retry
+        self.assertEqual(NotificationEvent.objects.filter(user=self.follower).count(), 1)
+
+    def test_notification_frequency_setting(self):
+        self.client.login(username=self.user.email, password=self.password)
+        url = reverse('django_simple_forum:user_settings')
+        response = self.client.post(url, {'notification_frequency': 'daily'})
+        self.assertEqual(response.json().get('notification_frequency'), 'daily')
+        self.assertTrue(response.json().get('send_mailnotifications'))
+        response = self.client.post(url, {'notification_frequency': 'weekly'})
+        self.assertTrue(response.json().get('error'))
+        self.assertEqual(UserProfile.objects.get(user=self.user).notification_frequency, 'daily')
+
+    def test_not_sent_on_rollback(self):
+        try:
+            with transaction.atomic():
+                comment = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='test')
+                notify_comment_added(comment)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        outbox_worker.wait()
+        self.assertEqual(mail.outbox, [])
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(kwargs)
+        return self
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@override_settings(MGUN_API_URL='https://mailgun.test/messages', MGUN_API_KEY='key', SG_API_KEY='key')
+class TestMailTransports(TestCase):
+
+    def setUp(self):
+        mail.outbox = []
+        self.messages = [
+            MailMessage(['ravi@micropyramid.com'], 'forum@micropyramid.com', 'Subject', 'Body'),
+            MailMessage(['kiran@micropyramid.com', 'sai@micropyramid.com'], 'forum@micropyramid.com',
+                        'Subject', 'Body'),
+            MailMessage(['mohan@micropyramid.com'], 'forum@micropyramid.com', 'Subject', 'Other body'),
+        ]
+
+    def test_smtp_transport(self):
+        self.assertEqual(get_mail_transport(), get_mail_transport())
+        self.assertEqual(send_messages(self.messages), 3)
+        self.assertEqual([message.to for message in mail.outbox], [
+            ['ravi@micropyramid.com'], ['kiran@micropyramid.com', 'sai@micropyramid.com'],
+            ['mohan@micropyramid.com']])
+        Memail(['ravi@micropyramid.com'], 'forum@micropyramid.com', 'Subject', 'Body')
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_recipient_variables(self):
+        message = MailMessage(
+            ['ravi@micropyramid.com', 'kiran@micropyramid.com'], 'forum@micropyramid.com', 'Subject',
+            'Dear %recipient.name%', recipient_variables={
+                'ravi@micropyramid.com': {'name': 'Ravi'}, 'kiran@micropyramid.com': {'name': 'Kiran'}})
+        send_messages([message])
+        self.assertEqual([(email.to, email.body) for email in mail.outbox], [
+            (['ravi@micropyramid.com'], 'Dear Ravi'), (['kiran@micropyramid.com'], 'Dear Kiran')])
+
+        transport = MailgunTransport()
+        transport.session = FakeSession()
+        transport.send_messages([message])
+        self.assertEqual(json.loads(transport.session.posts[0]['data']['recipient-variables']),
+                         message.recipient_variables)
+        transport = SendGridTransport()
+        transport.session = FakeSession()
+        transport.send_messages([message])
+        self.assertEqual(transport.session.posts[0]['json']['personalizations'][1]['substitutions'],
+                         {'%recipient.name%': 'Kiran'})
+
+    def test_ses_transport_personalizes_each_copy(self):
+        sent = []
+        original, sending_mail_module.sending_mail = sending_mail_module.sending_mail, lambda *args: sent.append(args)
+        self.addCleanup(setattr, sending_mail_module, 'sending_mail', original)
+        message = MailMessage(
+            ['ravi@micropyramid.com', 'kiran@micropyramid.com'], 'forum@micropyramid.com', 'Subject',
+            'Dear %recipient.name%', recipient_variables={
+                'ravi@micropyramid.com': {'name': 'Ravi'}, 'kiran@micropyramid.com': {'name': 'Kiran'}})
+        rendered = MailMessage(
+            ['mohan@micropyramid.com'], 'forum@micropyramid.com', 'Subject', '', 'emails/new_topic.html', {})
+        self.assertEqual(SESTransport().send_messages([message, rendered]), 3)
+        self.assertEqual([(args[1], args[2], args[4]) for args in sent], [
+            ('emails/message_body.html', {'body': 'Dear Ravi'}, 'ravi@micropyramid.com'),
+            ('emails/message_body.html', {'body': 'Dear Kiran'}, 'kiran@micropyramid.com'),
+            ('emails/new_topic.html', {}, 'mohan@micropyramid.com')])
+
+    def test_batched_http_transports(self):
+        transport = MailgunTransport()
+        transport.session = FakeSession()
+        self.assertEqual(transport.send_messages(self.messages), 4)
+        self.assertEqual([post['data']['to'] for post in transport.session.posts], [
+            ['ravi@micropyramid.com', 'kiran@micropyramid.com', 'sai@micropyramid.com'],
+            ['mohan@micropyramid.com']])
+
+        transport = SendGridTransport()
+        transport.session = FakeSession()
+        transport.batch_size = 2
+        transport.send_messages(self.messages)
+        self.assertEqual([len(post['json']['personalizations']) for post in transport.session.posts], [2, 1, 1])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_mail_delivery', messages=3, stdout=out)
+        self.assertIn('pooled transport: 3 messages', out.getvalue())
+
+
+def failing_handler(event):
+    raise ValueError(event.data['reason'])
+
+
+class ClosingTransport(BaseMailTransport):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def mailing_handler(event):
+    get_mail_transport()
+
+
+class TestOutbox(TransactionTestCase):
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST="django-forum.com")
+        self.password = 'secret'
+        self.user = User.objects.create(email='ravi@micropyramid.com', username='ravi@micropyramid.com')
+        self.user.set_password(self.password)
+        self.user.save()
+        UserProfile.objects.create(user=self.user)
+        self.category = ForumCategory.objects.create(
+            created_by=self.user, title='Python', is_active=True, slug='python', description='python')
+        self.topic = Topic.objects.create(
+            title='django', slug='django', description='web framework', created_by=self.user,
+            status='Published', category=self.category)
+
+    def test_published_with_the_write(self):
+        self.client.login(username=self.user.email, password=self.password)
+        response = self.client.post(reverse('django_simple_forum:like_topic', kwargs={'slug': self.topic.slug}))
+        self.assertTrue(response.json().get('is_like'))
+        outbox_worker.wait()
+        self.assertFalse(OutboxEvent.objects.exists())
+        self.assertEqual(list(Timeline.objects.values_list('user_id', 'object_id', 'event_type')),
+                         [(self.user.id, self.topic.id, 'like-topic')])
+
+        try:
+            with transaction.atomic():
+                UserTopics.toggle(self.user, self.topic, 'is_followed')
+                publish('timeline', {
+                    'user_id': self.user.id, 'content_type_id': Timeline.objects.get().content_type_id,
+                    'object_id': self.topic.id, 'namespace': 'follow the', 'event_type': 'follow-topic'})
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(FORUM_OUTBOX_HANDLERS={'mailing': 'django_simple_forum.tests.mailing_handler'},
+                       MAIL_SENDER='CLOSING')
+    def test_pool_threads_close_their_mail_transports(self):
+        sending_mail_module.TRANSPORTS['CLOSING'] = ClosingTransport
+        self.addCleanup(sending_mail_module.TRANSPORTS.pop, 'CLOSING')
+        events = [OutboxEvent.objects.create(event_type='mailing', payload='{}') for i in range(3)]
+        pool, transports = ThreadPool(1), set()
+        self.assertEqual(handle_in_pool(pool, events, transports), [None, None, None])
+        # one transport for the thread, reused by its events and closed with the pool
+        self.assertEqual(len(transports), 1)
+        transport = list(transports)[0]
+        self.assertIsNot(transport, get_mail_transport())
+        self.assertFalse(transport.closed)
+        close_pool(pool, transports)
+        self.assertTrue(transport.closed)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(FORUM_OUTBOX_HANDLERS={'broken': 'django_simple_forum.tests.failing_handler'})
+    def test_drain_retries_with_backoff(self):
+        with transaction.atomic():
+            for reason in range(3):
+                publish('broken', {'reason': reason})
+        outbox_worker.wait()
+        event = OutboxEvent.objects.order_by('id').first()
+        self.assertEqual((event.status, event.attempts), ('P', 1))
+        self.assertIn('ValueError: 0', event.last_error)
+        self.assertGreater(event.available_at, timezone.now())
+        # not retried before its backoff is over
+        self.assertEqual(drain(), (0, 0))
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        out = StringIO()
+        call_command('drain_outbox', workers=2, batch_size=2, max_attempts=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Handled 0 outbox events, 3 failed')
+        self.assertEqual(list(OutboxEvent.objects.values_list('status', 'attempts')), [('F', 2)] * 3)
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(drain(), (0, 0))
+
+    def test_events_leased_once(self):
+        OutboxEvent.objects.bulk_create([OutboxEvent(event_type='broken', payload='{}') for _ in range(2)])
+        ids = list(OutboxEvent.objects.order_by('id').values_list('id', flat=True))
+        now = timezone.now()
+        # two drains that selected the same events before either leased them
+        self.assertEqual([event.id for event in lease_events(ids, now)], ids)
+        self.assertEqual(lease_events(ids, now), [])
+
+    def test_drain_in_thread_pool(self):
+        content_type_id = ContentType.objects.get_for_model(self.topic).id
+        OutboxEvent.objects.bulk_create([OutboxEvent(event_type='timeline', payload=json.dumps({
+            'user_id': self.user.id, 'content_type_id': content_type_id, 'object_id': self.topic.id,
+            'namespace': 'follow the', 'event_type': 'follow-topic'})) for _ in range(5)])
+        self.assertEqual(drain(batch_size=2, workers=3), (5, 0))
+        self.assertEqual(Timeline.objects.count(), 5)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_timeline_events_written_together(self):
+        content_type_id = ContentType.objects.get_for_model(self.topic).id
+        created_on = timezone.now() - timedelta(minutes=5)
+        payloads = [{
+            'user_id': self.user.id, 'content_type_id': content_type_id, 'object_id': self.topic.id,
+            'namespace': 'like the', 'event_type': 'like-topic'} for _ in range(4)]
+        payloads.insert(2, dict(payloads[0], unknown_field=1))
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(event_type='timeline', payload=json.dumps(payload), created_on=created_on)
+            for payload in payloads])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(drain(), (4, 1))
+        inserts = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('INSERT INTO "django_simple_forum_timeline"')]
+        # the bad event fails the batch, then the others are written one by one
+        self.assertEqual(len(inserts), 4)
+        self.assertEqual(list(Timeline.objects.values_list('created_on', flat=True)), [created_on] * 4)
+        self.assertIn('unknown_field', OutboxEvent.objects.get().last_error)
+
+        OutboxEvent.objects.all().delete()
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(event_type='timeline', payload=json.dumps(payload)) for payload in payloads[:2]])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(drain(), (2, 0))
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('INSERT INTO "django_simple_forum_timeline"')]), 1)
+
+
+@task
+def remember(key, value):
+    cache.set(key, value)
+
+
+@task(queue='cpu')
+def touch(path):
+    open(path, 'w').close()
+
+
+class TestTasks(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_decorator(self):
+        self.assertEqual(remember.name, 'django_simple_forum.tests.remember')
+        self.assertEqual(touch.queue, 'cpu')
+        remember('called', 1)
+        remember.delay('delayed', 2)
+        self.assertEqual((cache.get('called'), cache.get('delayed')), (1, 2))
+
+    def test_thread_pool_backend(self):
+        backend = ThreadPoolBackend(workers=2)
+        for value in range(3):
+            backend.enqueue(remember, ('thread-%s' % value, value), {})
+        backend.pool.close()
+        backend.pool.join()
+        self.assertEqual(cache.get_many(['thread-0', 'thread-1', 'thread-2']),
+                         {'thread-0': 0, 'thread-1': 1, 'thread-2': 2})
+
+    def test_process_pool_backend(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'touched')
+        backend = ProcessPoolBackend(workers=1)
+        backend.enqueue(touch, (path,), {})
+        backend.pool.close()
+        backend.pool.join()
+        self.assertTrue(os.path.exists(path))
+
+    def test_database_backend(self):
+        DatabaseBackend().enqueue(remember, ('durable', 'stored'), {})
+        self.assertIsNone(cache.get('durable'))
+        self.assertEqual(OutboxEvent.objects.get().event_type, 'task')
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(cache.get('durable'), 'stored')
+
+    def test_get_short_url(self):
+        url = 'http://django-forum.com/forum/topic/django/'
+        calls = []
+
+        def google_mini(long_url, key):
+            calls.append(long_url)
+            return 'http://goo.gl/django'
+        original, tasks.google_mini = tasks.google_mini, google_mini
+        self.addCleanup(setattr, tasks, 'google_mini', original)
+
+        with override_settings(MINIFIED_URL='key'):
+            self.assertEqual(get_short_url(url), url)
+            self.assertEqual(get_short_url(url), 'http://goo.gl/django')
+        self.assertEqual(calls, [url])
+
+        def failing_google_mini(long_url, key):
+            raise ValueError
+        tasks.google_mini = failing_google_mini
+        cache.clear()
+        with override_settings(MINIFIED_URL='key'):
+            get_short_url(url)
+        self.assertEqual(cache.get(short_url_key(url)), url)
+
+
+class TestTopicCommentStats(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+
+    def test_comment_stats_maintained(self):
+        comment = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='first')
+        reply = Comment.objects.create(
+            commented_by=self.user, topic=self.topic, comment='reply', parent=comment)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 2)
+        self.assertEqual(self.topic.last_comment, reply)
+        self.assertEqual(self.topic.last_commented_at, reply.updated_on)
+
+        other = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='other')
+        other.delete()
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 2)
+        self.assertEqual(self.topic.last_comment, reply)
+
+        # deleting the parent cascades to its reply
+        comment.delete()
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 0)
+        self.assertIsNone(self.topic.last_comment)
+        self.assertIsNone(self.topic.last_commented_at)
+
+    def test_rebuild_command(self):
+        Comment.objects.create(commented_by=self.user, topic=self.topic, comment='first')
+        last = Comment.objects.create(commented_by=self.user, topic=self.topic, comment='second')
+        Topic.objects.filter(id=self.topic.id).update(
+            comment_count=10, last_comment=None, last_commented_at=None)
+        call_command('rebuild_topic_comment_stats', chunk_size=1, stdout=StringIO())
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.comment_count, 2)
+        self.assertEqual(self.topic.last_comment, last)
+        self.assertEqual(self.topic.last_commented_at, last.updated_on)
+
+
+class TestTopicViewCounts(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+        self.other = Topic.objects.create(
+            title="flask",
+            slug='flask',
+            description="micro framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+
+    def test_views_buffered_until_flush(self):
+        now = 1000 * BUCKET_SECONDS
+        for i in range(3):
+            record_topic_view(self.topic.id, now=now)
+        record_topic_view(self.other.id, now=now)
+        record_topic_view(self.topic.id, now=now + BUCKET_SECONDS)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_views, 0)
+
+        # the buckets are still open
+        self.assertEqual(flush_topic_views(now=now + BUCKET_SECONDS), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_topic_views(now=now + 3 * BUCKET_SECONDS), 2)
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('UPDATE')]), 1)
+        self.topic.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.topic.no_of_views, 4)
+        self.assertEqual(self.other.no_of_views, 1)
+
+        # flushed buckets are not applied twice
+        self.assertEqual(flush_topic_views(now=now + 4 * BUCKET_SECONDS), 0)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_views, 4)
+
+    def test_views_kept_until_applied(self):
+        now = 1000 * BUCKET_SECONDS
+        record_topic_view(self.topic.id, now=now)
+        record_topic_view(self.other.id, now=now)
+
+        def apply_topic_views(counts, batch_size=500):
+            raise DatabaseError('connection lost')
+        original, view_counts.apply_topic_views = view_counts.apply_topic_views, apply_topic_views
+        try:
+            with self.assertRaises(DatabaseError):
+                flush_topic_views(now=now + 3 * BUCKET_SECONDS)
+        finally:
+            view_counts.apply_topic_views = original
+
+        # a flush running elsewhere holds the lock
+        cache.add(view_counts.FLUSH_LOCK_KEY, 1)
+        self.assertEqual(flush_topic_views(now=now + 3 * BUCKET_SECONDS), 0)
+        cache.delete(view_counts.FLUSH_LOCK_KEY)
+
+        self.assertEqual(flush_topic_views(now=now + 3 * BUCKET_SECONDS), 2)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_views, 1)
+
+    def test_flush_command(self):
+        record_topic_view(self.topic.id, now=time.time() - 3 * BUCKET_SECONDS)
+        out = StringIO()
+        call_command('flush_topic_views', stdout=out)
+        self.assertIn('Flushed views of 1 topics', out.getvalue())
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_views, 1)
+
+
+class TestUniqueViewers(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client(HTTP_HOST="django-forum.com")
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com',
+            is_superuser=True
+        )
+        self.password = 'secret'
+        self.user.set_password(self.password)
+        self.user.save()
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+
+    def test_sketch_estimate_and_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(5000):
+            first.add('user:%s' % i)
+        for i in range(2500, 7500):
+            second.add('user:%s' % i)
+        self.assertLess(abs(first.count() - 5000), 5000 * first.error * 3)
+        merged = HyperLogLog(first.to_bytes()).merge(second)
+        self.assertLess(abs(merged.count() - 7500), 7500 * merged.error * 3)
+
+        small = HyperLogLog()
+        for i in range(10):
+            small.add('user:%s' % i)
+            small.add('user:%s' % i)
+        self.assertEqual(small.count(), 10)
+
+    def test_record_topic_viewer(self):
+        today = datetime(2016, 5, 10).date()
+        record_topic_viewer(self.topic, 'user:1', today)
+        self.assertTrue(ViewerSketch.objects.filter(target_type='T', target_id=self.topic.id, day=today).exists())
+        # a returning viewer does not touch the database
+        with self.assertNumQueries(0):
+            record_topic_viewer(self.topic, 'user:1', today)
+        record_topic_viewer(self.topic, 'user:2', today)
+        record_topic_viewer(self.topic, 'user:3', today - timedelta(days=1))
+        record_topic_viewer(self.topic, 'user:1', today - timedelta(days=10))
+
+        stats = ViewerSketch.unique_viewers('T', self.topic.id, today)
+        self.assertEqual((stats['today'], stats['week'], stats['month']), (2, 3, 3))
+        self.assertEqual(ViewerSketch.unique_viewers('C', self.category.id, today)['week'], 3)
+        self.assertEqual(ViewerSketch.estimate(
+            'T', self.topic.id, today - timedelta(days=10), today - timedelta(days=1)).count(), 2)
+
+    def test_dashboard_shows_unique_viewers(self):
+        self.client.get(reverse('django_simple_forum:view_topic', kwargs={'slug': self.topic.slug}))
+        self.assertTrue(self.client.login(username=self.user.email, password=self.password))
+        response = self.client.get(
+            reverse('django_simple_forum:topic_detail', kwargs={'slug': self.topic.slug}))
+        self.assertEqual(response.context['unique_viewers']['today'], 1)
+        self.assertContains(response, 'Unique Viewers')
+
+
+class TestForumLoaders(TestCase):
+
+    def setUp(self):
+        self.client = Client(HTTP_HOST="django-forum.com")
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.password = 'secret'
+        self.user.set_password(self.password)
+        self.user.save()
+        self.other = User.objects.create(username='other@micropyramid.com', email='other@micropyramid.com')
+        # a real picture would be thumbnailed when the topic page renders
+        UserProfile.objects.create(user=self.user)
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+        self.topic = Topic.objects.create(
+            title="django",
+            slug='django',
+            description="web framework",
+            created_by=self.user,
+            status='Published',
+            category=self.category
+        )
+        UserTopics.toggle(self.user, self.topic, 'is_followed')
+
+    def test_batched_loads(self):
+        UserProfile.objects.filter(user=self.user).update(profile_pic='profile_pics/ravi.png')
+        loaders = ForumLoaders()
+        loaders.profile_pic.prime([self.user.id, self.other.id])
+        loaders.user_topic.prime([(self.topic.id, self.user.id), (self.topic.id, self.other.id)])
+        with self.assertNumQueries(2):
+            self.assertEqual(loaders.profile_pic.load(self.user.id), 'profile_pics/ravi.png')
+            self.assertEqual(loaders.profile_pic.load(self.other.id), '')
+            self.assertEqual(loaders.profile_pic.load(self.user.id), 'profile_pics/ravi.png')
+            self.assertEqual(loaders.user_topic.load((self.topic.id, self.user.id)), (False, True))
+            self.assertEqual(loaders.user_topic.load((self.topic.id, self.other.id)), (False, False))
+
+    def test_filters_without_request(self):
+        UserProfile.objects.filter(user=self.user).update(profile_pic='profile_pics/ravi.png')
+        self.assertTrue(is_topic_followed(self.topic.id, self.user.id))
+        self.assertFalse(is_topic_like(self.topic.id, self.user.id))
+        self.assertFalse(is_topic_followed(self.topic.id, None))
+        self.assertEqual(user_profile_pic(self.user), 'profile_pics/ravi.png')
+        self.assertEqual(user_profile_pic(self.other.id), '')
+
+    def test_topic_view_primes_loaders(self):
+        self.assertTrue(self.client.login(username=self.user.email, password=self.password))
+        response = self.client.get(reverse('django_simple_forum:view_topic', kwargs={'slug': self.topic.slug}))
+        self.assertContains(response, 'Followed')
+        loaders = response.wsgi_request.forum_loaders
+        self.assertIn(self.user.id, loaders.profile_pic.cache)
+        self.assertEqual(loaders.user_topic.cache[(self.topic.id, self.user.id)], (False, True))
+
+
+class TestSidebarLeaderboards(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.python = ForumCategory.objects.create(
+            created_by=self.user, title='Python', is_active=True, slug='python', description='python')
+        self.go = ForumCategory.objects.create(
+            created_by=self.user, title='Go', is_active=True, slug='go', description='go')
+        self.tag = Tags.objects.create(title='orm', slug='orm')
+
+    def create_topic(self, slug, category):
+        return Topic.objects.create(
+            title=slug, slug=slug, description=slug, created_by=self.user, status='Published', category=category)
+
+    def counts(self, board):
+        return [(entry.id, entry.num_topics) for entry in board.get()]
+
+    def test_boards_adjusted_without_aggregating(self):
+        self.create_topic('django', self.python)
+        self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1), (self.go.id, 0)])
+
+        # create, tag, move and delete are applied to the cached board
+        flask = self.create_topic('flask', self.python)
+        flask.tags.add(self.tag)
+        gin = self.create_topic('gin', self.python)
+        gin.category = self.go
+        gin.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 2), (self.go.id, 1)])
+        self.assertEqual(self.counts(TAG_BOARD), [(self.tag.id, 1)])
+        self.assertEqual(self.counts(USER_BOARD), [(self.user.id, 3)])
+
+        flask.delete()
+        self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1), (self.go.id, 1)])
+        self.assertEqual(self.counts(TAG_BOARD), [(self.tag.id, 0)])
+
+    def test_sidebar_reads_only_top_entries(self):
+        self.create_topic('django', self.python)
+        CATEGORY_BOARD.get()
+        key = CATEGORY_BOARD.key()
+        self.assertEqual(cache.get(CATEGORY_BOARD.count_key(key, self.python.id)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1), (self.go.id, 0)])
+        # an evicted counter is read back for its own row alone
+        cache.delete(CATEGORY_BOARD.count_key(key, self.go.id))
+        self.create_topic('flask', self.go)
+        self.assertEqual(cache.get(CATEGORY_BOARD.count_key(key, self.go.id)), 1)
+        self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1), (self.go.id, 1)])
+
+    def test_write_reranks_from_counters(self):
+        users = [User.objects.create(username='user%s' % i, email='user%s@example.com' % i)
+                 for i in range(BOARD_SIZE)]
+        for user in users:
+            Topic.objects.create(
+                title=user.username, slug=user.username, description='topic', created_by=user,
+                status='Published', category=self.python)
+        top = USER_BOARD.get()
+        self.assertEqual(len(top), BOARD_SIZE)
+        self.assertNotIn(self.user.id, [entry.id for entry in top])
+
+        # a user off the board climbs onto it without a rebuild
+        key = USER_BOARD.key()
+        self.create_topic('django', self.python)
+        self.create_topic('flask', self.python)
+        self.assertEqual(USER_BOARD.key(), key)
+        self.assertEqual(self.counts(USER_BOARD)[0], (self.user.id, 2))
+        self.assertEqual(len(USER_BOARD.get()), BOARD_SIZE)
+
+        # an entry that may have fallen behind users off the board rebuilds it
+        Topic.objects.filter(created_by=users[0]).delete()
+        self.assertNotEqual(USER_BOARD.key(), key)
+        self.assertNotIn(users[0].id, [entry.id for entry in USER_BOARD.get()])
+
+    def test_invalidated_by_category_changes(self):
+        self.create_topic('django', self.python)
+        self.assertEqual(len(CATEGORY_BOARD.get()), 2)
+        self.go.is_active = False
+        self.go.save()
+        self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1)])
+
+    def test_rebuild_serves_stale_copy_while_locked(self):
+        self.create_topic('django', self.python)
+        CATEGORY_BOARD.get()
+        CATEGORY_BOARD.invalidate()
+        cache.add(CATEGORY_BOARD.lock_key(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(CATEGORY_BOARD), [(self.python.id, 1), (self.go.id, 0)])
+
+
+class TestCategoryTree(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com',
+            is_superuser=True
+        )
+        self.password = 'secret'
+        self.user.set_password(self.password)
+        self.user.save()
+        self.python = ForumCategory.objects.create(
+            created_by=self.user, title='Python', is_active=True, is_votable=True, slug='python',
+            description='python')
+        self.django = ForumCategory.objects.create(
+            created_by=self.user, title='Django', is_active=True, is_votable=True, slug='django',
+            description='django', parent=self.python)
+        self.orm = ForumCategory.objects.create(
+            created_by=self.user, title='ORM', is_active=True, slug='orm', description='orm', parent=self.django)
+        for slug, category in (('gil', self.python), ('forms', self.django), ('queries', self.orm)):
+            Topic.objects.create(
+                title=slug, slug=slug, description=slug, created_by=self.user, status='Published',
+                category=category)
+
+    def test_subtree_stats(self):
+        tree = get_category_tree()
+        self.assertEqual(tree.roots, [self.python])
+        python = tree.get(self.python.id)
+        self.assertEqual([child.id for child in python.children], [self.django.id])
+        self.assertEqual(python.subtree_topic_count, 3)
+        self.assertEqual(tree.get(self.django.id).subtree_topic_count, 2)
+        self.assertEqual(tree.get(self.orm.id).depth, 2)
+        self.assertEqual(python.latest_activity, Topic.objects.get(slug='queries').updated_on)
+        self.assertEqual([category.id for category in tree.topic_categories()], [self.python.id, self.django.id])
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_category_tree(), tree)
+
+    def test_invalidated_by_writes(self):
+        tree = get_category_tree()
+        Topic.objects.create(
+            title='asyncio', slug='asyncio', description='asyncio', created_by=self.user, status='Published',
+            category=self.orm)
+        self.assertIsNot(get_category_tree(), tree)
+        self.assertEqual(get_category_tree().get(self.python.id).subtree_topic_count, 4)
+
+        self.orm.parent = self.python
+        self.orm.save()
+        self.assertEqual(get_category_tree().get(self.django.id).subtree_topic_count, 1)
+
+    def test_category_pages_render_from_tree(self):
+        self.assertTrue(self.client.login(username=self.user.email, password=self.password))
+        response = self.client.get(reverse('django_simple_forum:categories'))
+        self.assertEqual(response.context['categories_list'], [self.python])
+        self.assertContains(response, 'Django')
+        get_category_tree()
+        with self.assertNumQueries(0):
+            get_category_tree().category_choices()
+
+
+class TestForumSearch(TestCase):
+    backends = (
+        'django_simple_forum.search.SQLiteFTSBackend',
+        'django_simple_forum.search.InvertedIndexBackend',
+    )
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.category = ForumCategory.objects.create(
+            created_by=self.user,
+            title='Python',
+            is_active=True,
+            slug='python',
+            description='dynamic programming language'
+        )
+
+    def create_content(self):
+        self.orm = Topic.objects.create(
+            title="Django ORM aggregation", slug='django-orm', description="<p>How do I use annotate?</p>",
+            created_by=self.user, status='Published', category=self.category)
+        self.forms = Topic.objects.create(
+            title="Django forms", slug='django-forms', description="<p>Validating a form with the ORM</p>",
+            created_by=self.user, status='Published', category=self.category)
+        self.draft = Topic.objects.create(
+            title="Draft about the ORM", slug='draft', description="unpublished",
+            created_by=self.user, status='Draft', category=self.category)
+        self.comment = Comment.objects.create(
+            commented_by=self.user, topic=self.forms, comment='Subqueries need OuterRef to reference the outer query')
+
+    def test_search_backends(self):
+        for backend in self.backends:
+            with override_settings(FORUM_SEARCH_BACKEND=backend):
+                self.create_content()
+                total, hits = search('orm')
+                # title matches rank first and drafts are left out
+                self.assertEqual(total, 2, backend)
+                self.assertEqual([hit.topic for hit in hits], [self.orm, self.forms], backend)
+                self.assertIn('<mark>ORM</mark>', hits[0].snippet, backend)
+
+                total, hits = search('OuterRef subqueries')
+                self.assertEqual(total, 1, backend)
+                self.assertEqual(hits[0].comment, self.comment, backend)
+
+                self.assertEqual(search('orm', offset=1, limit=1)[1][0].topic, self.forms, backend)
+
+                # edits and deletes are indexed incrementally
+                self.comment.comment = 'Use a window function'
+                self.comment.save()
+                self.assertEqual(search('outerref')[0], 0, backend)
+                self.orm.delete()
+                self.assertEqual(search('annotate')[0], 0, backend)
+                Topic.objects.all().delete()
+
+    @override_settings(FORUM_SEARCH_BACKEND='django_simple_forum.search.InvertedIndexBackend')
+    def test_inverted_index_bounded_work(self):
+        cache.clear()
+        self.create_content()
+        self.assertEqual(search('orm')[0], 2)
+        # corpus totals come from the cache after the first search
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search('orm annotate')[0], 1)
+        self.assertFalse([query for query in queries.captured_queries if 'AVG(' in query['sql']])
+
+        original, search_module.MAX_POSTINGS_PER_TERM = search_module.MAX_POSTINGS_PER_TERM, 2
+        self.addCleanup(setattr, search_module, 'MAX_POSTINGS_PER_TERM', original)
+        # only the two title postings of 'orm' are scored, one of them a draft
+        total, hits = search('orm')
+        self.assertEqual(total, 1)
+        self.assertEqual(hits[0].topic, self.orm)
+
+    def test_rebuild_command(self):
+        for backend in self.backends:
+            with override_settings(FORUM_SEARCH_BACKEND=backend):
+                self.create_content()
+                out = StringIO()
+                call_command('rebuild_search_index', chunk_size=1, stdout=out)
+                self.assertIn('Indexed 3 topics and 1 comments', out.getvalue())
+                self.assertEqual(search('orm')[0], 2, backend)
+                Topic.objects.all().delete()
+
+    def test_snippet(self):
+        snippet = build_snippet('one two three <four> five', ['four'], words=3)
+        self.assertEqual(snippet, '...three <%sfour%s> five' % (MARK_START, MARK_END))
+
+    def test_search_view(self):
+        self.create_content()
+        response = self.client.get(reverse('django_simple_forum:forum_search'), {'q': 'orm'})
+        self.assertTemplateUsed(response, 'forum/search.html')
+        self.assertEqual(response.context['total'], 2)
+        self.assertContains(response, 'Django ORM aggregation')
+        response = self.client.get(reverse('django_simple_forum:forum_search'), {'q': 'orm', 'page': 'x'})
+        self.assertEqual(response.context['page'], 1)
+
+
+class TestTypeahead(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create(
+            first_name='Ravi',
+            last_name='G',
+            email='ravi@micropyramid.com',
+            username='ravi@micropyramid.com'
+        )
+        self.category = ForumCategory.objects.create(
+            created_by=self.user, title='Python', is_active=True, slug='python', description='python')
+        self.django = Tags.objects.create(title='Django', slug='django')
+        self.docker = Tags.objects.create(title='Docker', slug='docker')
+        Tags.objects.filter(id=self.docker.id).update(topic_count=5)
+        self.topic = Topic.objects.create(
+            title='Deploying Django apps', slug='deploying-django-apps', description='deploy',
+            created_by=self.user, status='Published', category=self.category)
+
+    def titles(self, response):
+        return [(result['kind'], result['title']) for result in response.json()['response']]
+
+    def test_prefix_index(self):
+        index = PrefixIndex([
+            PrefixEntry('tag', 1, 'Django ORM', 'django-orm', 3),
+            PrefixEntry('tag', 2, 'Docker', 'docker', 7),
+            PrefixEntry('tag', 3, 'Python', 'python', 1),
+        ])
+        self.assertEqual([entry.id for entry in index.lookup('D')], [2, 1])
+        self.assertEqual([entry.id for entry in index.lookup('orm')], [1])
+        self.assertEqual([entry.id for entry in index.lookup('o', title_start=True)], [])
+        self.assertEqual([entry.id for entry in index.lookup('d', limit=1)], [2])
+        index.add(PrefixEntry('tag', 1, 'Flask', 'flask', 3))
+        index.remove(2)
+        self.assertEqual(index.lookup('d'), [])
+        self.assertEqual([entry.id for entry in index.lookup('fl')], [1])
+
+    def test_typeahead_view(self):
+        url = reverse('django_simple_forum:typeahead')
+        # built once, then served from memory
+        self.client.get(url, {'q': 'd'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'd'})
+        self.assertEqual(self.titles(response), [
+            ('tag', 'Docker'), ('tag', 'Django'), ('topic', 'Deploying Django apps')])
+        response = self.client.get(url, {'q': 'djan', 'kind': 'topics'})
+        self.assertEqual(response.json()['response'][0]['url'], reverse(
+            'django_simple_forum:view_topic', kwargs={'slug': self.topic.slug}))
+        self.assertEqual(self.titles(self.client.get(url, {'q': 'd', 'limit': 1, 'kind': 'tags'})),
+                         [('tag', 'Docker')])
+
+    def test_index_updated_on_writes(self):
+        TAG_INDEX.get()
+        TOPIC_INDEX.get()
+        Tags.objects.create(title='Dask', slug='dask')
+        self.docker.delete()
+        self.topic.status = 'Draft'
+        self.topic.save()
+        with self.assertNumQueries(0):
+            self.assertEqual([entry.title for entry in TAG_INDEX.get().lookup('d')], ['Django', 'Dask'])
+            self.assertEqual(TOPIC_INDEX.get().lookup('d'), [])
+
+    def test_rebuilt_when_version_changes(self):
+        TAG_INDEX.get()
+        Tags.objects.filter(id=self.django.id).update(title='Flask')
+        cache.incr(TAG_INDEX.version_key)
+        self.assertEqual([entry.title for entry in TAG_INDEX.get().lookup('f')], ['Flask'])
+
+    def test_other_processes_replay_changes(self):
+        other_process = LazyPrefixIndex('tags', build_tag_index)
+        other_process.get()
+        version = TAG_INDEX.current_version()
+        self.django.save()
+        self.topic.no_of_views = 10
+        self.topic.save()
+        # saves that leave titles, slugs and status alone keep the version
+        self.assertEqual(TAG_INDEX.current_version(), version)
+
+        Tags.objects.create(title='Dask', slug='dask')
+        self.docker.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual([entry.title for entry in other_process.get().lookup('d')], ['Django', 'Dask'])
+
+        # a change that has expired from the cache means a rebuild
+        TAG_INDEX.update(('remove', self.django.id))
+        cache.delete(TAG_INDEX.change_key(TAG_INDEX.current_version()))
+        self.assertEqual([entry.title for entry in other_process.get().lookup('d')], ['Django', 'Dask'])
+
+    def test_tags_list_letter_filter(self):
+        response = self.client.post(reverse('django_simple_forum:forum_tags'), {'alphabet_value': 'd'})
+        self.assertEqual([tag.title for tag in response.context['tags']], ['Docker', 'Django'])
+
+
 class TestCommentEditView(TestCase):
 
     def setUp(self):
@@ -888,6 +2366,36 @@ class TestTopicLike(TestCase):
         url = reverse('django_simple_forum:like_topic', kwargs={'slug': self.topic.slug})
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertEqual(response.json().get('no_of_users'), 1)
+
+    def test_topic_like_toggle(self):
+        updated_on = self.topic.updated_on
+        self.assertTrue(UserTopics.toggle(self.user, self.topic, 'is_like'))
+        self.assertFalse(UserTopics.toggle(self.user, self.topic, 'is_like'))
+        self.assertTrue(UserTopics.toggle(self.user, self.topic, 'is_like'))
+        self.assertEqual(UserTopics.objects.filter(user=self.user, topic=self.topic).count(), 1)
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_likes, 1)
+        # only the counter is written, not the whole row
+        self.assertEqual(self.topic.updated_on, updated_on)
+        self.assertTrue(self.topic.participants.get(user=self.user).is_liker)
+
+    def test_topic_like_toggle_by_two_users(self):
+        other = User.objects.create(email='other@micropyramid.com', username='other@micropyramid.com')
+        self.assertTrue(UserTopics.toggle(other, self.topic, 'is_like'))
+        self.assertTrue(UserTopics.toggle(self.user, self.topic, 'is_like'))
+        self.assertFalse(UserTopics.toggle(other, self.topic, 'is_like'))
+        self.topic.refresh_from_db()
+        self.assertEqual(self.topic.no_of_likes, 1)
+        self.assertEqual(list(self.topic.participants.filter(is_liker=True).values_list('user_id', flat=True)),
+                         [self.user.id])
+
+    def test_topic_like_toggle_deleted_row(self):
+        UserTopics.toggle(self.user, self.topic, 'is_like')
+        UserTopics.objects.filter(user=self.user, topic=self.topic).delete()
+        # a missing row is created again instead of retried forever
+        self.assertTrue(UserTopics.toggle(self.user, self.topic, 'is_like'))
+        self.assertTrue(UserTopics.objects.get(user=self.user, topic=self.topic).is_like)
 
 
 class TestForumCategoryList(TestCase):
@@ -1064,10 +2572,16 @@ class TestTopicStatus(TestCase):
         login = self.client.login(username=self.user.email, password=self.password)
         self.assertTrue(login)
         url = reverse('django_simple_forum:topic_status', kwargs={'slug': self.topic.slug})
+        tag = Tags.objects.create(title='python', slug='python')
+        self.topic.tags.add(tag)
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertEqual(ForumCategory.objects.get(id=self.category.id).topic_count, 1)
+        self.assertEqual(Tags.objects.get(id=tag.id).topic_count, 1)
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertEqual(ForumCategory.objects.get(id=self.category.id).topic_count, 0)
+        self.assertEqual(Tags.objects.get(id=tag.id).topic_count, 0)
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
 
@@ -1201,10 +2715,14 @@ class TestTopicFollow(TestCase):
         url = reverse('django_simple_forum:follow_topic', kwargs={'slug': self.topic.slug})
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertTrue(response.json().get('is_followed'))
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertFalse(response.json().get('is_followed'))
         response = self.client.post(url)
         self.assertFalse(response.json().get('error'))
+        self.assertTrue(response.json().get('is_followed'))
+        self.assertEqual(UserTopics.objects.filter(user=self.user, topic=self.topic).count(), 1)
 
 
 class TestTopicVoteUpView(TestCase):
@@ -1598,3 +3116,37 @@ class TestCommentVoteUpView(TestCase):
         self.assertEqual(response.json().get('status'), 'up')
         response = self.client.get(url)
         self.assertEqual(response.json().get('status'), 'neutral')
+
+    def test_comment_vote_counters(self):
+        self.client.login(username=self.user.email, password=self.password)
+        self.client.get(reverse('django_simple_forum:comment_vote_up', kwargs={'pk': self.comment.id}))
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.up_votes, self.comment.down_votes), (1, 0))
+        response = self.client.get(
+            reverse('django_simple_forum:comment_vote_down', kwargs={'pk': self.comment.id}))
+        self.assertEqual(response.json().get('status'), 'removed')
+        self.comment.refresh_from_db()
+        self.assertEqual((self.comment.up_votes, self.comment.down_votes), (0, 0))
+        self.client.get(reverse('django_simple_forum:topic_vote_down', kwargs={'slug': self.topic.slug}))
+        self.topic.refresh_from_db()
+        self.assertEqual((self.topic.up_votes_count(), self.topic.down_votes_count()), (0, 1))
+
+    def test_reconcile_vote_counts(self):
+        Vote.objects.create(user=self.user, type='U', target_type='C', target_id=self.comment.id)
+        Topic.objects.filter(id=self.topic.id).update(down_votes=3)
+        call_command('reconcile_vote_counts', chunk_size=1, stdout=StringIO())
+        self.comment.refresh_from_db()
+        self.topic.refresh_from_db()
+        self.assertEqual((self.comment.up_votes, self.comment.down_votes), (1, 0))
+        self.assertEqual((self.topic.up_votes, self.topic.down_votes), (0, 0))
+
+    def test_vote_cast(self):
+        self.assertEqual(Vote.cast(self.user, self.comment, 'U'), 'up')
+        self.assertEqual(Vote.cast(self.user, self.comment, 'U'), 'neutral')
+        self.assertEqual(Vote.cast(self.user, self.topic, 'U'), 'up')
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Vote.cast(self.user, self.comment, 'D'), 'removed')
+        self.assertFalse(Vote.objects.filter(target_type='C', target_id=self.comment.id).exists())
+        self.comment.delete()
+        self.topic.delete()
+        self.assertFalse(Vote.objects.exists())
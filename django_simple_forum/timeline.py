@@ -0,0 +1,57 @@
+"""
+Buffered writes of timeline entries.
+
+A ``TimelineWriter`` collects entries and saves them with ``bulk_create``
+when flushed, once at the end of its ``with`` block. The outbox drain writes
+the timeline events of a batch through one writer, so the entries of every
+like, follow and comment committed since the last drain cost a single insert
+instead of a query each.
+"""
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+
+
+def content_type_id(model):
+    # served from the manager's per-process cache after the first lookup
+    return ContentType.objects.get_for_model(model).id
+
+
+class TimelineWriter(object):
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.entries = []
+
+    def add(self, user_id, content_type_id, object_id, namespace, event_type, created_on=None):
+        Timeline = apps.get_model('django_simple_forum', 'Timeline')
+        entry = Timeline(user_id=user_id, content_type_id=content_type_id, object_id=object_id,
+                         namespace=namespace, event_type=event_type)
+        if created_on is not None:
+            entry.created_on = created_on
+        self.entries.append(entry)
+
+    def flush(self):
+        """Save the buffered entries, returning how many were written."""
+        Timeline = apps.get_model('django_simple_forum', 'Timeline')
+        entries, self.entries = self.entries, []
+        Timeline.objects.bulk_create(entries, batch_size=self.batch_size)
+        return len(entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+def record_timeline(event):
+    """Outbox handler writing a timeline entry at the time of the event."""
+    record_timelines([event])
+
+
+def record_timelines(events):
+    """Outbox batch handler writing the entries of ``events`` in one insert."""
+    with TimelineWriter() as writer:
+        for event in events:
+            writer.add(created_on=event.created_on, **event.data)
@@ -0,0 +1,211 @@
+"""
+In-memory prefix indexes of tag titles and published topic titles.
+
+Each index is a sorted array of lower-cased keys, one for every word start of
+a title, so a prefix lookup is a bisect plus a scan of the matching range.
+The indexes are built lazily per process. A write changing a title, slug or
+status bumps the shared version and records the change under the new version
+in the cache; the other processes replay the changes they missed on their
+copies, and rebuild only when too far behind or once a change has expired.
+Every ``FORUM_TYPEAHEAD_TTL`` seconds an index is rebuilt anyway, which
+refreshes popularity.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+WORD_START_RE = re.compile(r'\b\w', re.UNICODE)
+
+# changes a process replays to catch up before it rather rebuilds its index
+MAX_REPLAYED_CHANGES = 100
+
+
+class PrefixEntry(object):
+
+    def __init__(self, kind, id, title, slug, popularity):
+        self.kind = kind
+        self.id = id
+        self.title = title
+        self.slug = slug
+        self.popularity = popularity
+
+    @property
+    def topic_count(self):
+        return self.popularity
+
+
+class PrefixIndex(object):
+
+    def __init__(self, entries=()):
+        self.entries = {}
+        self.keys = []
+        for entry in entries:
+            self.entries[entry.id] = entry
+            self.keys.extend(self.keys_for(entry))
+        self.keys.sort()
+
+    @staticmethod
+    def keys_for(entry):
+        title = entry.title.lower()
+        return [(title[match.start():], entry.id) for match in WORD_START_RE.finditer(title)]
+
+    def add(self, entry):
+        self.remove(entry.id)
+        self.entries[entry.id] = entry
+        for key in self.keys_for(entry):
+            bisect.insort(self.keys, key)
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in self.keys_for(entry):
+            position = bisect.bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+
+    def lookup(self, prefix, limit=10, title_start=False):
+        """
+        Entries with a word starting with ``prefix``, or only those whose
+        title does with ``title_start``, most popular first.
+        """
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        matched = set()
+        position = bisect.bisect_left(self.keys, (prefix,))
+        while position < len(self.keys) and self.keys[position][0].startswith(prefix):
+            matched.add(self.keys[position][1])
+            position += 1
+        if title_start:
+            matched = set(entry_id for entry_id in matched
+                          if self.entries[entry_id].title.lower().startswith(prefix))
+        order = lambda entry_id: (self.entries[entry_id].popularity, -entry_id)
+        if limit is None:
+            ids = sorted(matched, key=order, reverse=True)
+        else:
+            ids = heapq.nlargest(limit, matched, key=order)
+        return [self.entries[entry_id] for entry_id in ids]
+
+
+def apply_change(index, change):
+    action, value = change
+    if action == 'add':
+        index.add(value)
+    else:
+        index.remove(value)
+
+
+def tag_entry(tag):
+    return PrefixEntry('tag', tag.id, tag.title, tag.slug, tag.topic_count)
+
+
+def topic_entry(topic):
+    return PrefixEntry('topic', topic.id, topic.title, topic.slug, topic.no_of_views)
+
+
+def build_tag_index():
+    Tags = apps.get_model('django_simple_forum', 'Tags')
+    return PrefixIndex(tag_entry(tag) for tag in Tags.objects.only('id', 'title', 'slug', 'topic_count'))
+
+
+def build_topic_index():
+    Topic = apps.get_model('django_simple_forum', 'Topic')
+    return PrefixIndex(topic_entry(topic) for topic in Topic.objects.filter(status='Published').only(
+        'id', 'title', 'slug', 'no_of_views'))
+
+
+class LazyPrefixIndex(object):
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.lock = threading.Lock()
+        self.index = None
+        self.version = None
+        self.built_at = 0
+
+    @property
+    def version_key(self):
+        return 'forum:typeahead:%s:version' % self.name
+
+    def change_key(self, version):
+        return 'forum:typeahead:%s:change:%s' % (self.name, version)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'FORUM_TYPEAHEAD_TTL', 5 * 60)
+
+    def current_version(self):
+        cache.add(self.version_key, int(time.time() * 1000000), None)
+        return cache.get(self.version_key)
+
+    def catch_up(self, version):
+        """Replay the changes recorded since this copy's version, if they are all still cached."""
+        missed = range(self.version + 1, version + 1)
+        if not 0 < len(missed) <= MAX_REPLAYED_CHANGES:
+            return
+        changes = cache.get_many([self.change_key(each) for each in missed])
+        if len(changes) < len(missed):
+            return
+        for each in missed:
+            apply_change(self.index, changes[self.change_key(each)])
+        self.version = version
+
+    def get(self):
+        version = self.current_version()
+        with self.lock:
+            if self.index is not None and time.time() - self.built_at <= self.ttl and self.version != version:
+                self.catch_up(version)
+            if self.index is None or self.version != version or time.time() - self.built_at > self.ttl:
+                self.index = self.build()
+                self.version = version
+                self.built_at = time.time()
+            return self.index
+
+    def update(self, change):
+        """
+        Record ``change``, ``('add', entry)`` or ``('remove', id)``, under a
+        new shared version for the other processes and apply it to this
+        process's copy if that was up to date.
+        """
+        with self.lock:
+            self.current_version()
+            try:
+                version = cache.incr(self.version_key)
+            except ValueError:
+                self.index = None
+                return
+            cache.set(self.change_key(version), change, self.ttl)
+            if self.index is not None and self.version == version - 1:
+                apply_change(self.index, change)
+                self.version = version
+
+
+TAG_INDEX = LazyPrefixIndex('tags', build_tag_index)
+TOPIC_INDEX = LazyPrefixIndex('topics', build_topic_index)
+
+
+def index_tag_title(tag):
+    TAG_INDEX.update(('add', tag_entry(tag)))
+
+
+def unindex_tag_title(tag):
+    TAG_INDEX.update(('remove', tag.id))
+
+
+def index_topic_title(topic):
+    if topic.status == 'Published':
+        TOPIC_INDEX.update(('add', topic_entry(topic)))
+    else:
+        unindex_topic_title(topic)
+
+
+def unindex_topic_title(topic):
+    TOPIC_INDEX.update(('remove', topic.id))
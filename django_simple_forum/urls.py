@@ -24,6 +24,8 @@ urlpatterns = [
         views.CommentDelete.as_view(), name="comment_delete"),
     url(r'^comment/edit/(?P<comment_id>[-\w]+)/$', views.CommentEdit.as_view(), name="comment_edit"),
 
+    url(r'^search/$', views.ForumSearchView.as_view(), name="forum_search"),
+    url(r'^typeahead/$', views.TypeaheadView.as_view(), name="typeahead"),
     url(r'^categories/$', views.ForumCategoryList.as_view(), name="forum_categories"),
     url(r'^tags/$', views.ForumTagsList.as_view(), name="forum_tags"),
     url(r'^badges/$', views.ForumBadgeList.as_view(), name="forum_badges"),
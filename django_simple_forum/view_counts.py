@@ -0,0 +1,136 @@
+"""
+Write-behind buffer for topic view counts.
+
+Views are counted in the cache, in per-interval buckets, and
+``flush_topic_views`` folds closed buckets into ``Topic.no_of_views`` with one
+UPDATE per batch, so a page view never writes to the topic row.
+
+Distinct viewers go into daily HyperLogLog sketches. A copy of each sketch is
+cached, and the database is only written when a viewer raises a register,
+which stops happening for returning viewers and becomes rare as a sketch fills.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+from .models import Topic, ViewerSketch
+
+BUCKET_SECONDS = 60
+KEY_TIMEOUT = 60 * 60 * 24
+BUCKET_KEY = 'forum:views:%s:%s'
+BUCKET_SIZE_KEY = 'forum:views:%s:size'
+BUCKET_LOG_KEY = 'forum:views:%s:log:%s'
+FLUSHED_KEY = 'forum:views:flushed'
+FLUSH_LOCK_KEY = 'forum:views:flush-lock'
+# a flush that died holding the lock blocks the next ones for this long
+FLUSH_LOCK_TIMEOUT = 5 * 60
+SKETCH_KEY = 'forum:viewers:%s:%s:%s'
+
+
+def get_cache():
+    return caches[getattr(settings, 'FORUM_VIEW_COUNT_CACHE', 'default')]
+
+
+def current_bucket(now=None):
+    return int((now or time.time()) // BUCKET_SECONDS)
+
+
+def record_topic_view(topic_id, now=None):
+    cache = get_cache()
+    bucket = current_bucket(now)
+    key = BUCKET_KEY % (bucket, topic_id)
+    if cache.add(key, 1, KEY_TIMEOUT):
+        # first view of this topic in the bucket: log the id for the flush
+        cache.add(BUCKET_SIZE_KEY % bucket, 0, KEY_TIMEOUT)
+        position = cache.incr(BUCKET_SIZE_KEY % bucket)
+        cache.set(BUCKET_LOG_KEY % (bucket, position), topic_id, KEY_TIMEOUT)
+    else:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, KEY_TIMEOUT)
+
+
+def pending_topic_views(bucket):
+    """The view counts of a bucket, and the cache keys to delete once they are applied."""
+    cache = get_cache()
+    size = cache.get(BUCKET_SIZE_KEY % bucket) or 0
+    log_keys = [BUCKET_LOG_KEY % (bucket, position) for position in range(1, size + 1)]
+    topic_ids = set(cache.get_many(log_keys).values())
+    count_keys = dict((BUCKET_KEY % (bucket, topic_id), topic_id) for topic_id in topic_ids)
+    counts = {}
+    for key, count in cache.get_many(list(count_keys)).items():
+        counts[count_keys[key]] = count
+    return counts, log_keys + list(count_keys) + [BUCKET_SIZE_KEY % bucket]
+
+
+def apply_topic_views(counts, batch_size=500):
+    topic_ids = sorted(counts)
+    # all or nothing, the buckets are kept for the next flush if a batch fails
+    with transaction.atomic():
+        for start in range(0, len(topic_ids), batch_size):
+            batch = topic_ids[start:start + batch_size]
+            increment = Case(
+                *[When(id=topic_id, then=Value(counts[topic_id])) for topic_id in batch],
+                default=Value(0), output_field=IntegerField())
+            Topic.objects.filter(id__in=batch).update(no_of_views=F('no_of_views') + increment)
+
+
+def flush_topic_views(now=None, batch_size=500):
+    """
+    Apply the buffered views of every closed bucket and return the number of
+    topics updated. The bucket being written to and the one before it are
+    left alone so that in-flight requests are not cut off. The buckets are
+    deleted only once applied, and a flush already running elsewhere makes
+    this one a no-op, so no view is lost or counted twice.
+    """
+    cache = get_cache()
+    if not cache.add(FLUSH_LOCK_KEY, 1, FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        last_closed = current_bucket(now) - 2
+        first = cache.get(FLUSHED_KEY)
+        if first is None:
+            first = last_closed - KEY_TIMEOUT // BUCKET_SECONDS
+        counts = {}
+        flushed_keys = []
+        for bucket in range(first + 1, last_closed + 1):
+            bucket_counts, keys = pending_topic_views(bucket)
+            for topic_id, count in bucket_counts.items():
+                counts[topic_id] = counts.get(topic_id, 0) + count
+            flushed_keys.extend(keys)
+        apply_topic_views(counts, batch_size)
+        cache.set(FLUSHED_KEY, max(first, last_closed), None)
+        cache.delete_many(flushed_keys)
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+    return len(counts)
+
+
+def get_viewer_key(request):
+    if request.user.is_authenticated():
+        return 'user:%s' % request.user.id
+    return 'anon:%s:%s' % (request.META.get('REMOTE_ADDR', ''), request.META.get('HTTP_USER_AGENT', ''))
+
+
+def record_viewer(target_type, target_id, viewer, day=None):
+    """Add ``viewer`` to the day's sketch, returning True if it was written."""
+    cache = get_cache()
+    day = day or timezone.now().date()
+    key = SKETCH_KEY % (target_type, target_id, day.isoformat())
+    index, rank = HyperLogLog.position(viewer)
+    registers = cache.get(key)
+    if registers is not None and bytearray(registers)[index] >= rank:
+        return False
+    cache.set(key, ViewerSketch.add(target_type, target_id, day, index, rank), KEY_TIMEOUT)
+    return True
+
+
+def record_topic_viewer(topic, viewer, day=None):
+    record_viewer('T', topic.id, viewer, day)
+    record_viewer('C', topic.category_id, viewer, day)
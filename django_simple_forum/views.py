@@ -8,9 +8,11 @@ from datetime import datetime
 
 from django.contrib.auth import logout, login, load_backend
 from django.core.urlresolvers import reverse, reverse_lazy
+from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.conf import settings
 from django.contrib.auth.hashers import check_password
+from django.db import transaction
 from django.db.models import Q
 from django.http import JsonResponse
 from django.http.response import HttpResponseRedirect, HttpResponse
@@ -19,9 +21,9 @@ from django.views.generic import TemplateView, UpdateView, ListView, CreateView,
 from django.views.generic.edit import FormView
 from django.views.generic.detail import SingleObjectMixin
 from django.shortcuts import redirect, render, get_object_or_404
-from django.template import Context,loader
 from django.template.defaultfilters import slugify
 from django.utils.crypto import get_random_string
+from django.utils import timezone
 
 try:
     from django.contrib.auth import get_user_model
@@ -30,25 +32,33 @@ except ImportError:
     from django.contrib.auth.models import User
 
 # from endless_pagination.views import AjaxListView
-from microurl import google_mini
 
 from .forms import LoginForm
-from .models import ForumCategory, STATUS, Badge, Topic, Tags, UserProfile, UserTopics, Timeline,\
-    Facebook, Google, Comment, Vote
-from .mixins import AdminMixin, LoginRequiredMixin, CanUpdateTopicMixin
+from .models import ForumCategory, STATUS, NOTIFICATION_FREQUENCIES, Badge, Topic, Tags, UserProfile, UserTopics,\
+    Facebook, Google, Comment, Vote, ViewerSketch
+from .mixins import AdminMixin, LoginRequiredMixin, CanUpdateTopicMixin, TopicCursorPaginationMixin
+from .category_tree import get_category_tree
+from .loaders import get_loaders
+from .notifications import notify_comment_added
+from .outbox import publish
+from .search import search
+from .tasks import generate_profile_thumbnail, get_short_url, send_email
+from .timeline import content_type_id
+from .typeahead import TAG_INDEX, TOPIC_INDEX
+from .view_counts import record_topic_view, record_topic_viewer, get_viewer_key
 from .forms import CategoryForm, BadgeForm, RegisterForm, TopicForm, CommentForm, UserProfileForm,\
     ChangePasswordForm, UserChangePasswordForm, ForgotPasswordForm
 # from mpcomp.facebook import GraphAPI, get_access_token_from_code
-from .sending_mail import Memail
 
 
 def timeline_activity(user, content_object, namespace, event_type):
-    Timeline.objects.create(
-        user=user,
-        content_object=content_object,
-        namespace=namespace,
-        event_type=event_type,
-    )
+    publish('timeline', {
+        'user_id': user.id,
+        'content_type_id': content_type_id(content_object),
+        'object_id': content_object.id,
+        'namespace': namespace,
+        'event_type': event_type,
+    })
 
 
 class LoginView(FormView):
@@ -102,19 +112,17 @@ class CategoryList(AdminMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super(CategoryList, self).get_context_data(**kwargs)
-        categories_list = ForumCategory.objects.filter(parent=None)
-        context['categories_list'] = categories_list
+        context['categories_list'] = get_category_tree().roots
         return context
 
     def post(self, request, *args, **kwargs):
-        categories_list = self.model.objects.all()
+        categories_list = get_category_tree().nodes
 
         if request.POST.get('is_active') == 'True':
-            categories_list = categories_list.filter(is_active=True)
-        if request.POST.get('search_text', ''):
-            categories_list = categories_list.filter(
-                title__icontains=request.POST.get('search_text')
-            )
+            categories_list = [category for category in categories_list if category.is_active]
+        search_text = request.POST.get('search_text', '').lower()
+        if search_text:
+            categories_list = [category for category in categories_list if search_text in category.title.lower()]
         return render(request, self.template_name, {'categories_list': categories_list})
 
 
@@ -127,6 +135,12 @@ class CategoryDetailView(AdminMixin, DetailView):
     def get_object(self):
         return get_object_or_404(ForumCategory, slug=self.kwargs['slug'])
 
+    def get_context_data(self, **kwargs):
+        context = super(CategoryDetailView, self).get_context_data(**kwargs)
+        context['unique_viewers'] = ViewerSketch.unique_viewers(
+            'C', self.object.id, timezone.now().date())
+        return context
+
 
 class CategoryAdd(AdminMixin, CreateView):
     model = ForumCategory
@@ -158,9 +172,8 @@ class CategoryAdd(AdminMixin, CreateView):
     def get_context_data(self, **kwargs):
         context = super(CategoryAdd, self).get_context_data(**kwargs)
         form = CategoryForm(self.request.GET)
-        menus = ForumCategory.objects.filter(parent=None)
         context['form'] = form
-        context['menus'] = menus
+        context['menus'] = get_category_tree().roots
         return context
 
 
@@ -213,9 +226,8 @@ class CategoryEdit(AdminMixin, UpdateView):
     def get_context_data(self, **kwargs):
         context = super(CategoryEdit, self).get_context_data(**kwargs)
         form = CategoryForm(self.request.GET)
-        menus = ForumCategory.objects.filter(parent=None)
         context['form'] = form
-        context['menus'] = menus
+        context['menus'] = get_category_tree().roots
         return context
 
 
@@ -345,20 +357,16 @@ class UserList(AdminMixin, ListView):
     model = UserProfile
     template_name = 'dashboard/users.html'
     context_object_name = 'users_list'
-    queryset = UserProfile.objects.filter()
+    queryset = UserProfile.objects.select_related('user').order_by('id')
 
     def get_context_data(self, **kwargs):
         context = super(UserList, self).get_context_data(**kwargs)
         return context
 
     def post(self, request, *args, **kwargs):
-        users_list = self.model.objects.all()
-        if request.POST.get('search_text', ''):
-            users_list = list(set(users_list.filter(
-                user__email__icontains=request.POST.get('search_text')
-            ) | users_list.filter(
-                user__username__icontains=request.POST.get('search_text')
-            )))
+        users_list = self.queryset.all()
+        if request.POST.get('search_text', '').strip():
+            users_list = UserProfile.search(request.POST.get('search_text')).select_related('user').order_by('id')
         per_page = request.POST.get("filter_per_page") if request.POST.get(
             "filter_per_page") else 10
         return render(request, self.template_name, {'users_list': users_list,
@@ -408,24 +416,24 @@ class IndexView(FormView):
 
     def get_context_data(self, **kwargs):
         context = super(IndexView, self).get_context_data(**kwargs)
-        topics = Topic.objects.filter(status='Published')
+        topics = Topic.objects.filter(status='Published').with_listing_data()
         context['topic_list'] = topics
         return context
 
     def form_valid(self, form):
-        user = User.objects.create(
-            username=form.cleaned_data['username'], email=form.cleaned_data['email'])
-        user.set_password(form.cleaned_data['password'])
-        user.first_name = form.cleaned_data['first_name']
-        user.is_active = True
-        user.save()
+        with transaction.atomic():
+            user = User.objects.create(
+                username=form.cleaned_data['username'], email=form.cleaned_data['email'])
+            user.set_password(form.cleaned_data['password'])
+            user.first_name = form.cleaned_data['first_name']
+            user.is_active = True
+            user.save()
+            UserProfile.objects.create(user=user, user_roles='Publisher')
+            timeline_activity(user=user, content_object=user,
+                              namespace='created on', event_type="user-create")
         user.backend = 'django.contrib.auth.backends.ModelBackend'
-        UserProfile.objects.create(user=user, user_roles='Publisher')
         login(self.request, user)
 
-        timeline_activity(user=user, content_object=user,
-                          namespace='created on', event_type="user-create")
-
         data = {'error': False, 'response': 'Successfully Created Badge'}
         return JsonResponse(data)
 
@@ -439,7 +447,7 @@ class ForumLoginView(FormView):
 
     def get_context_data(self, **kwargs):
         context = super(ForumLoginView, self).get_context_data(**kwargs)
-        topics = Topic.objects.filter(status='Published')
+        topics = Topic.objects.filter(status='Published').with_listing_data()
         context['topic_list'] = topics
         return context
 
@@ -464,18 +472,21 @@ class TopicAdd(LoginRequiredMixin, CreateView):
         return kwargs
 
     def form_valid(self, form):
-        topic = form.save()
-        if self.request.POST['sub_category']:
-            topic.category_id = self.request.POST['sub_category']
-        topic.save()
-        if 'tags' in form.cleaned_data.keys() and form.cleaned_data['tags']:
-            for tag in form.cleaned_data['tags'].split(','):
-                if not Tags.objects.filter(slug=slugify(tag)):
-                    each = Tags.objects.create(slug=slugify(tag), title=tag)
-                    topic.tags.add(each)
-                else:
-                    each = Tags.objects.filter(slug=slugify(tag)).first()
-                    topic.tags.add(each)
+        with transaction.atomic():
+            topic = form.save()
+            if self.request.POST['sub_category']:
+                topic.category_id = self.request.POST['sub_category']
+            topic.save()
+            if 'tags' in form.cleaned_data.keys() and form.cleaned_data['tags']:
+                for tag in form.cleaned_data['tags'].split(','):
+                    if not Tags.objects.filter(slug=slugify(tag)):
+                        each = Tags.objects.create(slug=slugify(tag), title=tag)
+                        topic.tags.add(each)
+                    else:
+                        each = Tags.objects.filter(slug=slugify(tag)).first()
+                        topic.tags.add(each)
+            timeline_activity(user=self.request.user, content_object=self.request.user,
+                              namespace='created topic on', event_type="topic-create")
         # liked_users_ids = UserTopics.objects.filter(
         #     topic__category=topic.category, is_like=True).values_list('user', flat=True)
         # followed_users = UserTopics.objects.filter(
@@ -493,9 +504,6 @@ class TopicAdd(LoginRequiredMixin, CreateView):
         #     mfrom = settings.DEFAULT_FROM_EMAIL
         #     Memail(mto, mfrom, subject, rendered)
 
-        timeline_activity(user=self.request.user, content_object=self.request.user,
-                          namespace='created topic on', event_type="topic-create")
-
         data = {'error': False, 'response': 'Successfully Created Topic'}
         return JsonResponse(data)
 
@@ -504,13 +512,13 @@ class TopicAdd(LoginRequiredMixin, CreateView):
 
     def get_context_data(self, **kwargs):
         context = super(TopicAdd, self).get_context_data(**kwargs)
+        tree = get_category_tree()
         form = TopicForm(self.request.GET)
+        form.fields['category'].choices = tree.category_choices()
         context['form'] = form
         context['status'] = STATUS
-        context['categories'] = ForumCategory.objects.filter(
-            is_active=True, is_votable=True, parent=None)
-        context['sub_categories'] = ForumCategory.objects.filter(
-            is_active=True, is_votable=True).exclude(parent=None)
+        context['categories'] = [category for category in tree.topic_categories() if not category.parent_id]
+        context['sub_categories'] = [category for category in tree.topic_categories() if category.parent_id]
         return context
 
 
@@ -529,32 +537,27 @@ class TopicUpdateView(CanUpdateTopicMixin, UpdateView):
         return initital
 
     def form_valid(self, form):
-        topic = self.get_object()
-        old_tags = [tag.title for tag in topic.tags.all()]
         topic = form.save()
         tags_text = form.cleaned_data['tags']
         if tags_text:
-            new_tags = tags_text.split(',')
-            remove_tags = set(new_tags) - set(old_tags)
-            for tag in new_tags:
+            new_tags = []
+            for tag in tags_text.split(','):
                 tag_slug = slugify(tag)
                 if not Tags.objects.filter(slug=tag_slug).exists():
-                    tag = Tags.objects.create(slug=tag_slug, title=tag)
-                    topic.tags.add(tag)
+                    new_tags.append(Tags.objects.create(slug=tag_slug, title=tag))
                 else:
-                    tag = Tags.objects.filter(slug=tag_slug).first()
-                    if tag.title in remove_tags:
-                        topic.remove(tag)
-                    else:
-                        topic.tags.add(tag)
-        topic.save()
+                    new_tags.append(Tags.objects.filter(slug=tag_slug).first())
+            # only the difference is written, which keeps the tag topic counts in step
+            old_tags = set(topic.tags.all())
+            topic.tags.remove(*(old_tags - set(new_tags)))
+            topic.tags.add(*(set(new_tags) - old_tags))
         return JsonResponse({"error": False, "success_url": reverse('django_simple_forum:signup')})
 
     def form_invalid(self, form):
         return JsonResponse({'error': True, 'errors': form.errors})
 
 
-class TopicList(ListView):
+class TopicList(TopicCursorPaginationMixin, ListView):
     template_name = 'forum/topic_list.html'
     context_object_name = "topic_list"
 
@@ -563,7 +566,7 @@ class TopicList(ListView):
             query = Q(status='Published')|Q(created_by=self.request.user)
         else:
             query = Q(status='Published')
-        queryset = Topic.objects.filter(query).order_by('-created_on')
+        queryset = Topic.objects.filter(query).with_listing_data()
         return queryset
 
 class TopicView(TemplateView):
@@ -574,19 +577,26 @@ class TopicView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(TopicView, self).get_context_data(**kwargs)
-        context['topic'] = self.get_object()
+        topic = self.get_object()
+        record_topic_view(topic.id)
+        record_topic_viewer(topic, get_viewer_key(self.request))
+        # the avatars and follow state the page asks for, fetched one query per kind
+        loaders = get_loaders()
+        loaders.profile_pic.prime([topic.created_by_id])
+        if topic.last_comment_id:
+            loaders.profile_pic.prime([topic.get_last_comment().commented_by_id])
+        if self.request.user.id:
+            loaders.profile_pic.prime([self.request.user.id])
+            loaders.user_topic.prime([(topic.id, self.request.user.id)])
+        context['topic'] = topic
+        context['comment_tree'] = topic.get_comment_tree()
         # user_profile = get_object_or_404(UserProfile, user=self.request.user)
         # context['user_profile'] = user_profile
-        suggested_topics = Topic.objects.filter(
-            category=self.get_object().category).exclude(id=self.get_object().id)
+        suggested_topics = Topic.objects.with_listing_data().filter(
+            category_id=topic.category_id).exclude(id=topic.id)
         job_url = 'http://' + self.request.META['HTTP_HOST'] + reverse(
-            'django_simple_forum:view_topic', kwargs={'slug': self.get_object().slug})
-        try:
-            minified_url = google_mini(job_url, settings.MINIFIED_URL)
-        except:
-            minified_url = job_url
-
-        context['minified_url'] = minified_url
+            'django_simple_forum:view_topic', kwargs={'slug': topic.slug})
+        context['minified_url'] = get_short_url(job_url)
         context['suggested_topics'] = suggested_topics
         return context
 
@@ -622,17 +632,7 @@ class CommentVoteUpView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         comment = get_object_or_404(Comment, pk=kwargs.get("pk"))
-        vote = comment.votes.filter(user=request.user).first()
-        if not vote:
-            vote = Vote.objects.create(user=request.user, type="U")
-            comment.votes.add(vote)
-            comment.save()
-            status = "up"
-        elif vote and vote.type == "D":
-            vote.delete()
-            status = "removed"
-        else:
-            status = "neutral"
+        status = Vote.cast(request.user, comment, "U")
         return JsonResponse({"status": status})
 
 
@@ -640,17 +640,7 @@ class CommentVoteDownView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         comment = get_object_or_404(Comment, pk=kwargs.get("pk"))
-        vote = comment.votes.filter(user=request.user).first()
-        if not vote:
-            vote = Vote.objects.create(user=request.user, type="D")
-            comment.votes.add(vote)
-            comment.save()
-            status = "down"
-        elif vote and vote.type == "U":
-            vote.delete()
-            status = "removed"
-        else:
-            status = "neutral"
+        status = Vote.cast(request.user, comment, "D")
         return JsonResponse({"status": status})
 
 
@@ -666,39 +656,21 @@ class CommentAdd(LoginRequiredMixin, CreateView):
         return kwargs
 
     def form_valid(self, form):
-        comment = form.save()
-        if self.request.POST['parent']:
-            comment.parent_id = self.request.POST['parent']
-            comment.save()
-        if self.request.POST.get('mentioned_user', False):
-            data = self.request.POST.get('mentioned_user')
-            comment.mentioned = comment_mentioned_users_list(data)
-            comment.save()
-
-        for user in comment.topic.get_topic_users():
-            mto = [user.user.email]
-            c = {'comment': comment, "user": user.user,
-                 'topic_url': settings.HOST_URL+reverse('django_simple_forum:view_topic', kwargs={'slug': comment.topic.slug}),
-                 "HOST_URL": settings.HOST_URL}
-            t = loader.get_template('emails/comment_add.html')
-            subject = "New Comment For The Topic " + (comment.topic.title)
-            rendered = t.render(c)
-            mfrom = settings.DEFAULT_FROM_EMAIL
-            Memail(mto, mfrom, subject, rendered, email_template_name=None, context=None)
-
-        for user in comment.mentioned.all():
-            mto = [user.user.email]
-            c = Context({'comment': comment, "user": user.user,
-                         'topic_url': settings.HOST_URL+reverse('django_simple_forum:view_topic', kwargs={'slug': comment.topic.slug}),
-                         "HOST_URL": settings.HOST_URL})
-            t = loader.get_template('emails/comment_mentioned.html')
-            subject = "New Comment For The Topic " + (comment.topic.title)
-            rendered = t.render(c)
-            mfrom = settings.DEFAULT_FROM_EMAIL
-            Memail(mto, mfrom, subject, rendered)
-
-        timeline_activity(user=self.request.user, content_object=comment,
-                          namespace='commented for the', event_type="comment-create")
+        try:
+            with transaction.atomic():
+                comment = form.save(commit=False)
+                if self.request.POST['parent']:
+                    comment.parent_id = self.request.POST['parent']
+                comment.save()
+                if self.request.POST.get('mentioned_user', False):
+                    data = self.request.POST.get('mentioned_user')
+                    comment.mentioned = comment_mentioned_users_list(data)
+                    comment.save()
+                notify_comment_added(comment)
+                timeline_activity(user=self.request.user, content_object=comment,
+                                  namespace='commented for the', event_type="comment-create")
+        except ValidationError as e:
+            return JsonResponse({'error': True, 'response': {'parent': e.messages}})
 
         data = {'error': False, 'response': 'Successfully Created Topic'}
         return JsonResponse(data)
@@ -728,17 +700,21 @@ class CommentEdit(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         comment = self.get_object()
         if self.request.user == comment.commented_by:
-            self.get_object().mentioned.all().delete()
-            comment = form.save()
-            if self.request.POST['parent']:
-                comment.parent_id = self.request.POST['parent']
-                comment.save()
-            if self.request.POST.get('mentioned_user', False):
-                data = self.request.POST.get('mentioned_user')
-                comment.mentioned = comment_mentioned_users_list(data)
-                comment.save()
-            timeline_activity(user=self.request.user, content_object=comment,
-                              namespace='commented for the', event_type="comment-create")
+            try:
+                with transaction.atomic():
+                    self.get_object().mentioned.all().delete()
+                    comment = form.save()
+                    if self.request.POST['parent']:
+                        comment.parent_id = self.request.POST['parent']
+                        comment.save()
+                    if self.request.POST.get('mentioned_user', False):
+                        data = self.request.POST.get('mentioned_user')
+                        comment.mentioned = comment_mentioned_users_list(data)
+                        comment.save()
+                    timeline_activity(user=self.request.user, content_object=comment,
+                                      namespace='commented for the', event_type="comment-create")
+            except ValidationError as e:
+                return JsonResponse({'error': True, 'response': {'parent': e.messages}})
             data = {'error': False, 'response': 'Successfully Edited User'}
         else:
             data = {
@@ -777,7 +753,8 @@ class CommentDelete(LoginRequiredMixin, DeleteView):
     def post(self, request, *args, **kwargs):
         comment = self.get_object()
         if self.request.user == comment.commented_by:
-            comment.delete()
+            with transaction.atomic():
+                comment.delete()
             return JsonResponse({'error': False, 'response': 'Successfully Deleted Your Comment'})
         else:
             return JsonResponse({'error': False, 'response': 'Only commented user can delete this comment'})
@@ -795,28 +772,20 @@ class TopicLike(LoginRequiredMixin, View):
 
     def post(self, request, *args, **kwargs):
         topic = self.get_object()
-        user_topics = UserTopics.objects.filter(user=request.user, topic=topic)
-        if user_topics:
-            user_topic = user_topics[0]
-        else:
-            user_topic = UserTopics.objects.create(
-                user=request.user, topic=topic)
-        if user_topic.is_like:
-            user_topic.is_like = False
-            topic.no_of_likes = topic.no_of_likes - 1
-            timeline_activity(user=self.request.user, content_object=topic,
-                              namespace='unlike the', event_type="unlike-topic")
-        else:
-            user_topic.is_like = True
-            topic.no_of_likes = topic.no_of_likes + 1
-            timeline_activity(
-                user=self.request.user, content_object=topic, namespace='like the', event_type="like-topic")
-        user_topic.save()
-        topic.save()
+        with transaction.atomic():
+            is_like = UserTopics.toggle(request.user, topic, 'is_like')
+            if is_like:
+                timeline_activity(
+                    user=self.request.user, content_object=topic, namespace='like the', event_type="like-topic")
+            else:
+                timeline_activity(user=self.request.user, content_object=topic,
+                                  namespace='unlike the', event_type="unlike-topic")
+        no_of_likes, no_of_users = Topic.objects.filter(id=topic.id).values_list(
+            'no_of_likes', 'participant_count').get()
 
         return JsonResponse({'error': False, 'response': 'Successfully Deleted Category',
-                             'is_like': user_topic.is_like, 'no_of_likes': topic.no_of_likes,
-                             'no_of_users': topic.get_topic_users().count()})
+                             'is_like': is_like, 'no_of_likes': no_of_likes,
+                             'no_of_users': no_of_users})
 
 
 class ForumCategoryList(ListView):
@@ -827,6 +796,57 @@ class ForumCategoryList(ListView):
     paginate_by = '10'
 
 
+class ForumSearchView(TemplateView):
+    template_name = 'forum/search.html'
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super(ForumSearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        total, hits = search(query, (page - 1) * self.paginate_by, self.paginate_by)
+        context.update({
+            'query': query,
+            'hits': hits,
+            'total': total,
+            'page': page,
+            'previous_page': page - 1 if page > 1 else None,
+            'next_page': page + 1 if page * self.paginate_by < total else None,
+        })
+        return context
+
+
+class TypeaheadView(View):
+    max_limit = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '')
+        kind = request.GET.get('kind', 'all')
+        try:
+            limit = min(max(int(request.GET.get('limit', 10)), 1), self.max_limit)
+        except ValueError:
+            limit = 10
+        results = []
+        if kind in ('tags', 'all'):
+            results.extend({
+                'kind': 'tag',
+                'title': entry.title,
+                'url': reverse('django_simple_forum:forum_tags_detail', kwargs={'slug': entry.slug}),
+                'popularity': entry.popularity,
+            } for entry in TAG_INDEX.get().lookup(query, limit))
+        if kind in ('topics', 'all'):
+            results.extend({
+                'kind': 'topic',
+                'title': entry.title,
+                'url': reverse('django_simple_forum:view_topic', kwargs={'slug': entry.slug}),
+                'popularity': entry.popularity,
+            } for entry in TOPIC_INDEX.get().lookup(query, limit))
+        return JsonResponse({'error': False, 'response': results})
+
+
 class ForumTagsList(ListView):
     queryset = Tags.objects.filter()
     template_name = 'forum/tags.html'
@@ -836,8 +856,7 @@ class ForumTagsList(ListView):
     def post(self, request, *args, **kwargs):
         tags = self.queryset
         if str(request.POST.get('alphabet_value')) != 'all':
-            tags = tags.filter(
-                title__istartswith=request.POST.get('alphabet_value'))
+            tags = TAG_INDEX.get().lookup(request.POST.get('alphabet_value', ''), None, title_start=True)
         return render(request, self.template_name, {'tags': tags})
 
 
@@ -855,8 +874,9 @@ class ForumBadgeList(ListView):
         return render(request, self.template_name, {'tags': tags})
 
 
-class ForumCategoryView(ListView):
+class ForumCategoryView(TopicCursorPaginationMixin, ListView):
     template_name = 'forum/topic_list.html'
+    context_object_name = "topic_list"
 
     def get_queryset(self, queryset=None):
         if self.request.user.is_authenticated():
@@ -864,19 +884,18 @@ class ForumCategoryView(ListView):
         else:
             query = Q(status="Published")
         category = get_object_or_404(ForumCategory, slug=self.kwargs.get("slug"))
-        topics = category.topic_set.filter(query) 
+        topics = category.topic_set.filter(query).with_listing_data()
         return topics
 
 
-class ForumTagsView(TemplateView):
+class ForumTagsView(TopicCursorPaginationMixin, ListView):
     template_name = 'forum/topic_list.html'
+    context_object_name = "topic_list"
 
-    def get_context_data(self, **kwargs):
-        tag = get_object_or_404(Tags, slug=kwargs.get("slug"))
-        context = super(ForumTagsView, self).get_context_data(**kwargs)
-        topics = tag.get_topics()
-        context['topic_list'] = topics
-        return context
+    def get_queryset(self):
+        tag = get_object_or_404(Tags, slug=self.kwargs.get("slug"))
+        topics = tag.get_topics().with_listing_data()
+        return topics
 
 
 class TopicDetail(AdminMixin, TemplateView):
@@ -888,6 +907,8 @@ class TopicDetail(AdminMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(TopicDetail, self).get_context_data(**kwargs)
         context['topic'] = self.get_object()
+        context['unique_viewers'] = ViewerSketch.unique_viewers(
+            'T', context['topic'].id, timezone.now().date())
         return context
 
 
@@ -906,7 +927,7 @@ class TopicStatus(AdminMixin, View):
             topic.status = 'Draft'
         else:
             topic.status = 'Disabled'
-        topic.save()
+        topic.save(update_fields=['status'])
         return JsonResponse({'error': False, 'response': 'Successfully Updated Topic Status'})
 
 
@@ -976,42 +997,23 @@ class TopicFollow(LoginRequiredMixin, View):
 
     def post(self, request, *args, **kwargs):
         topic = self.get_object()
-        user_topics = UserTopics.objects.filter(user=request.user, topic=topic)
-        if user_topics:
-            user_topic = user_topics[0]
-        else:
-            user_topic = UserTopics.objects.create(
-                user=request.user, topic=topic)
-        if user_topic.is_followed:
-            user_topic.is_followed = False
-            user_topic.followed_on = datetime.now()
-            timeline_activity(user=self.request.user, content_object=topic,
-                              namespace='unfollow the', event_type="unfollow-topic")
-        else:
-            user_topic.is_followed = True
-            user_topic.followed_on = datetime.now()
-            timeline_activity(user=self.request.user, content_object=topic,
-                              namespace='follow the', event_type="follow-topic")
-        user_topic.save()
+        with transaction.atomic():
+            is_followed = UserTopics.toggle(request.user, topic, 'is_followed', followed_on=datetime.now())
+            if is_followed:
+                timeline_activity(user=self.request.user, content_object=topic,
+                                  namespace='follow the', event_type="follow-topic")
+            else:
+                timeline_activity(user=self.request.user, content_object=topic,
+                                  namespace='unfollow the', event_type="unfollow-topic")
         return JsonResponse({'error': False, 'response': 'Successfully Followed the topic',
-                             'is_followed': user_topic.is_followed})
+                             'is_followed': is_followed})
 
 
 class TopicVoteUpView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         topic = get_object_or_404(Topic, slug=kwargs.get("slug"))
-        vote = topic.votes.filter(user=request.user).first()
-        if not vote:
-            vote = Vote.objects.create(user=request.user, type="U")
-            topic.votes.add(vote)
-            topic.save()
-            status = "up"
-        elif vote and vote.type == "D":
-            vote.delete()
-            status = "removed"
-        else:
-            status = "neutral"
+        status = Vote.cast(request.user, topic, "U")
         return JsonResponse({"status": status})
 
 
@@ -1019,17 +1021,7 @@ class TopicVoteDownView(LoginRequiredMixin, View):
 
     def get(self, request, *args, **kwargs):
         topic = get_object_or_404(Topic, slug=kwargs.get("slug"))
-        vote = topic.votes.filter(user=request.user).first()
-        if not vote:
-            vote = Vote.objects.create(user=request.user, type="D")
-            topic.votes.add(vote)
-            topic.save()
-            status = "down"
-        elif vote and vote.type == "U":
-            vote.delete()
-            status = "removed"
-        else:
-            status = "neutral"
+        status = Vote.cast(request.user, topic, "D")
         return JsonResponse({"status": status})
 
 
@@ -1096,6 +1088,7 @@ class UserProfilePicView(LoginRequiredMixin, View):
         if 'profile_pic' in request.FILES:
             user_profile.profile_pic = request.FILES['profile_pic']
             user_profile.save()
+            transaction.on_commit(lambda: generate_profile_thumbnail.delay(user_profile.profile_pic.name))
             return JsonResponse({'error': False, 'response': 'Successfully uploaded'})
         else:
             return JsonResponse({'error': True, 'response': 'Please Upload Your Profile pic'})
@@ -1112,13 +1105,20 @@ class UserSettingsView(LoginRequiredMixin, View):
 
     def post(self, request, *args, **kwargs):
         user_profile = self.get_object()
-        if not user_profile.send_mailnotifications:
+        if 'notification_frequency' in request.POST:
+            frequency = request.POST.get('notification_frequency')
+            if frequency not in dict(NOTIFICATION_FREQUENCIES):
+                return JsonResponse({'error': True, 'response': {
+                    'notification_frequency': 'Select a valid notification frequency'}})
+            user_profile.notification_frequency = frequency
+        elif not user_profile.send_mailnotifications:
             user_profile.send_mailnotifications = True
         else:
             user_profile.send_mailnotifications = False
         user_profile.save()
         return JsonResponse({'error': False, 'response': 'You have successfully uploaded the settings',
-                             "send_mailnotifications": user_profile.send_mailnotifications})
+                             "send_mailnotifications": user_profile.send_mailnotifications,
+                             "notification_frequency": user_profile.notification_frequency})
 
 
 class UserDetailView(TemplateView):
@@ -1372,7 +1372,7 @@ class ForgotPasswordView(FormView):
                 settings.HOST_URL + '/forum/">forum</a></p>'
             to = user.email
             from_email = settings.DEFAULT_FROM_EMAIL
-            Memail([to], from_email, subject, message, email_template_name=None, context=None)
+            send_email.delay([to], from_email, subject, message)
             user.set_password(password)
             user.save()
             data = {
@@ -31,6 +31,7 @@ if __name__ == "__main__":
             'django.middleware.csrf.CsrfViewMiddleware',
             'django.contrib.auth.middleware.AuthenticationMiddleware',
             'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+            'django_simple_forum.loaders.ForumLoaderMiddleware',
         ),
         ROOT_URLCONF='test_runner',
         STATIC_URL='/static/',
@@ -59,7 +60,12 @@ if __name__ == "__main__":
             'django-forum.com',
         ],
         HOST_URL='http://django-forum.com',
-        MAIL_SENDER=None
+        MAIL_SENDER=None,
+        FORUM_TASK_BACKENDS={
+            'default': 'django_simple_forum.tasks.SyncBackend',
+            'cpu': 'django_simple_forum.tasks.SyncBackend',
+            'durable': 'django_simple_forum.tasks.SyncBackend',
+        },
     )
 
     django.setup()